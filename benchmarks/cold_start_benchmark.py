@@ -0,0 +1,94 @@
+"""
+Measures the cold start cost of each lambda handler: how long the handler module
+takes to import, and how long building its clients takes on the first invocation.
+Every measurement runs in a fresh interpreter so nothing is already imported.
+
+Usage: python -m benchmarks.cold_start_benchmark [--import-budget-ms 500] [--output results.json]
+
+Exits non zero when a handler takes longer to import than the budget. The handlers
+import boto3 and twitter when they load, around 250 to 400 ms, so the default budget
+sits just above that and catches anything more being pulled onto the import path.
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+# Just above what importing boto3 and twitter costs the handlers
+IMPORT_BUDGET_MS = 500
+
+HANDLERS = {
+    'sam_quest_handler': ['dynamodb_table', 'twitter_api', 'sqs_client'],
+    'process_twitter_feed_handler': ['dynamodb_table', 'twitter_api', 'kinesis_client'],
+    'game_sweeper_handler': ['dynamodb_table', 'twitter_api']
+}
+
+MEASURE_SCRIPT = '''
+import json
+import time
+
+start = time.perf_counter()
+import {handler}
+imported = time.perf_counter()
+
+from src import clients
+first_use = {{}}
+for client in {clients}:
+    client_start = time.perf_counter()
+    if client == 'dynamodb_table':
+        clients.dynamodb_table({handler}.dynamodb_table_name)
+    else:
+        getattr(clients, client)()
+    first_use[client] = (time.perf_counter() - client_start) * 1000
+
+print(json.dumps({{'import_ms': (imported - start) * 1000, 'first_use_ms': first_use}}))
+'''
+
+
+def measure(handler, clients, runs):
+    results = []
+
+    for _ in range(runs):
+        script = MEASURE_SCRIPT.format(handler=handler, clients=clients)
+        output = subprocess.check_output([sys.executable, '-c', script], universal_newlines=True)
+        # The handlers' buffered log lines are written on exit, after the result
+        results.append(next(json.loads(line) for line in output.splitlines() if '"import_ms"' in line))
+
+    import_times = sorted(result['import_ms'] for result in results)
+    first_invocation = sorted(sum(result['first_use_ms'].values()) for result in results)
+
+    return {
+        'import_ms_median': import_times[len(import_times) // 2],
+        'first_invocation_clients_ms_median': first_invocation[len(first_invocation) // 2],
+        'runs': results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure lambda handler cold start times')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--import-budget-ms', type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    report = {handler: measure(handler, clients, args.runs) for (handler, clients) in HANDLERS.items()}
+
+    for (handler, result) in report.items():
+        print('{}: import {:.1f} ms, first invocation clients {:.1f} ms'.format(
+            handler, result['import_ms_median'], result['first_invocation_clients_ms_median']))
+
+    if args.output is not None:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+
+    over_budget = [handler for (handler, result) in report.items() if result['import_ms_median'] > args.import_budget_ms]
+
+    if len(over_budget) > 0:
+        print('Import time over the {} ms budget: {}'.format(args.import_budget_ms, ', '.join(over_budget)))
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
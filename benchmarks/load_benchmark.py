@@ -0,0 +1,276 @@
+"""
+End to end load benchmark for the ingest -> game state pipeline.
+
+Simulates N concurrent games with M players each. Players tweet #LetsPlay,
+#JoinGame, #StartGame and #ChooseMe at a fake twitter api, and every round is
+driven through process_twitter_feed, the kinesis stream and handle_game_state,
+against moto.
+
+Reports requests/sec, p50/p99 per request latency (from the mention being
+tweeted to the batch that handled it finishing) and the number of DynamoDB,
+Kinesis and Twitter calls per game.
+
+Games are kept in DynamoDB by default, or with --store memory in an InMemoryGameStore.
+The games in each batch are handled by up to --workers threads.
+
+Usage: python -m benchmarks.load_benchmark --games 20 --players 3 --output results.json
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+
+import boto3
+from moto import mock_dynamodb2, mock_kinesis
+from twitter.models import Status
+
+from src.game_steps import get_choice
+from src.game_store import DynamoGameStore
+from src.logger import LOGGER
+from src.memory_game_store import InMemoryGameStore
+from src.models import GameState
+from src.process_twitter_feed import process_twitter_feed
+from src.sam_quest import MAX_GAME_WORKERS, handle_game_state
+from src.tweet_dispatcher import TokenBucket, TweetDispatcher
+from test.test_resources import MockTwitterApi, get_active_game_table, get_game_history_table, \
+    get_game_state_table, get_tweet_index_table, get_twitter_post_processing_table
+
+STREAM_NAME = 'benchmark-stream'
+MAX_VOTING_ROUNDS = 10
+
+
+class LoadTwitterApi(MockTwitterApi):
+    """
+    A fake twitter api that players tweet at, and that counts every call the pipeline makes
+    """
+
+    def __init__(self):
+        MockTwitterApi.__init__(self)
+        self.status_ids = itertools.count(1000)
+        self.calls = Counter()
+        self.tweeted_at = {}
+
+    def Tweet(self, user_name, user_id, hashtags, in_reply_to_status_id=None):
+        status_id = next(self.status_ids)
+        self.tweeted_at[status_id] = time.time()
+
+        self.mentions.append(Status.NewFromJsonDict({
+            'id': status_id,
+            'text': '@SAMQuest9 ' + ' '.join(['#' + tag for tag in hashtags]),
+            'in_reply_to_status_id': in_reply_to_status_id,
+            'created_at': time.strftime('%a %b %d %H:%M:%S +0000 %Y', time.gmtime(self.tweeted_at[status_id])),
+            'user': {'id': user_id, 'screen_name': user_name},
+            'entities': {'hashtags': [{'text': tag} for tag in hashtags]}
+        }))
+
+        return status_id
+
+    def GetMentions(self, count=None, since_id=None, max_id=None):
+        self.calls['GetMentions'] += 1
+        return MockTwitterApi.GetMentions(self, count=count, since_id=since_id, max_id=max_id)
+
+    def UsersLookup(self, user_id):
+        self.calls['UsersLookup'] += 1
+        return MockTwitterApi.UsersLookup(self, user_id)
+
+    def PostUpdate(self, status, in_reply_to_status_id=None):
+        self.calls['PostUpdate'] += 1
+        return Status.NewFromJsonDict({'id': next(self.status_ids), 'text': status,
+                                       'in_reply_to_status_id': in_reply_to_status_id})
+
+
+class Pipeline(object):
+    """
+    Runs the ingest and game state functions the way lambda would, and records latencies
+    """
+
+    def __init__(self, twitter_api, batch_size, store, workers):
+        self.twitter_api = twitter_api
+        self.batch_size = batch_size
+        self.workers = workers
+        self.aws_calls = Counter()
+        self.latencies = []
+
+        # The pipeline's clients are counted, the harness's own reads are not
+        system_session = boto3.Session(region_name='us-west-2')
+        system_session.events.register('before-call', self.__count_call)
+        self.feed_table = system_session.resource('dynamodb').Table(get_twitter_post_processing_table().name)
+        self.game_table = system_session.resource('dynamodb').Table(get_game_state_table().name)
+        self.active_game_table = system_session.resource('dynamodb').Table(get_active_game_table().name)
+        self.history_table = system_session.resource('dynamodb').Table(get_game_history_table().name)
+        self.tweet_index_table = system_session.resource('dynamodb').Table(get_tweet_index_table().name)
+        self.kinesis_client = system_session.client('kinesis')
+
+        if store == 'memory':
+            self.game_store = InMemoryGameStore()
+            self.harness_game_store = self.game_store
+        else:
+            self.game_store = DynamoGameStore(self.game_table, self.active_game_table, self.history_table,
+                                              self.tweet_index_table)
+            self.harness_game_store = DynamoGameStore(get_game_state_table())
+
+        self.harness_feed_table = get_twitter_post_processing_table()
+        self.harness_kinesis = boto3.client('kinesis', region_name='us-west-2')
+        self.harness_kinesis.create_stream(StreamName=STREAM_NAME, ShardCount=2)
+        shards = self.harness_kinesis.describe_stream(StreamName=STREAM_NAME)['StreamDescription']['Shards']
+        self.shard_iterators = [self.harness_kinesis.get_shard_iterator(StreamName=STREAM_NAME,
+                                                                        ShardId=shard['ShardId'],
+                                                                        ShardIteratorType='TRIM_HORIZON')['ShardIterator']
+                                for shard in shards]
+
+    def run(self):
+        """
+        Poll twitter until every mention is on the stream, then drain the stream
+        :return: The number of requests handled
+        """
+        newest = max(post.id for post in self.twitter_api.mentions)
+        for _ in range(100):
+            process_twitter_feed(self.twitter_api, self.kinesis_client, STREAM_NAME, self.feed_table)
+            feed = self.harness_feed_table.scan()['Items']
+            if any(int(item.get('LastPostId', 0)) >= newest for item in feed):
+                break
+
+        handled = 0
+        for (index, iterator) in enumerate(self.shard_iterators):
+            while True:
+                result = self.harness_kinesis.get_records(ShardIterator=iterator, Limit=self.batch_size)
+                iterator = result['NextShardIterator']
+
+                if len(result['Records']) == 0:
+                    break
+
+                posts = [json.loads(record['Data']) for record in result['Records']]
+                for (post, record) in zip(posts, result['Records']):
+                    post['arrived_at'] = record['ApproximateArrivalTimestamp'].timestamp()
+
+                dispatcher = TweetDispatcher(self.twitter_api, bucket=TokenBucket(10 ** 9, 10 ** 9))
+                handle_game_state(posts, self.twitter_api, self.game_store, dispatcher=dispatcher,
+                                  max_workers=self.workers)
+                dispatcher.shutdown()
+
+                finished = time.time()
+                self.latencies.extend(finished - self.twitter_api.tweeted_at[post['status_id']] for post in posts)
+                handled += len(posts)
+
+            self.shard_iterators[index] = iterator
+
+        return handled
+
+    def __count_call(self, model, **kwargs):
+        self.aws_calls['{}.{}'.format(model.service_model.service_name, model.name)] += 1
+
+
+def games_by_creator(game_store, start_ids):
+    return {creator: game_store.get_by_start_tweet(start_id) for (creator, start_id) in start_ids.items()}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_benchmark(game_count, player_count, batch_size, seed, store, workers):
+    random.seed(seed)
+    twitter_api = LoadTwitterApi()
+    pipeline = Pipeline(twitter_api, batch_size, store, workers)
+
+    games = [['game{}_player{}'.format(game, player) for player in range(player_count)] for game in range(game_count)]
+    user_ids = {name: user_id for (user_id, name) in enumerate(itertools.chain(*games), 1)}
+
+    start = time.time()
+    handled = 0
+
+    for players in games:
+        twitter_api.Tweet(players[0], user_ids[players[0]], ['LetsPlay'])
+    handled += pipeline.run()
+
+    start_ids = {players[0]: pipeline.harness_game_store.get_active_by_creator(players[0])[0].TweetStartId
+                 for players in games}
+    for players in games:
+        for player in players[1:]:
+            twitter_api.Tweet(player, user_ids[player], ['JoinGame'], int(start_ids[players[0]]))
+    handled += pipeline.run()
+
+    for players in games:
+        twitter_api.Tweet(players[0], user_ids[players[0]], ['StartGame'], int(start_ids[players[0]]))
+    handled += pipeline.run()
+
+    for _ in range(MAX_VOTING_ROUNDS):
+        sessions = games_by_creator(pipeline.harness_game_store, start_ids)
+        playing = [players for players in games if sessions[players[0]].GameState == str(GameState.PENDING_GAME_INPUT)]
+
+        if len(playing) == 0:
+            break
+
+        for players in playing:
+            session = sessions[players[0]]
+            options = get_choice(session.CurrentGameStep).options
+
+            for player in session.Players:
+                twitter_api.Tweet(player, user_ids[player], ['ChooseMe', random.choice(options)],
+                                  int(session.CurrentTweetId))
+
+        handled += pipeline.run()
+
+    elapsed = time.time() - start
+    sessions = games_by_creator(pipeline.harness_game_store, start_ids)
+
+    def per_game(calls):
+        return {name: float(count) / game_count for (name, count) in sorted(calls.items())}
+
+    return {
+        'games': game_count,
+        'players_per_game': player_count,
+        'batch_size': batch_size,
+        'workers': workers,
+        'store': store,
+        'completed_games': len([s for s in sessions.values() if s.GameState == str(GameState.GAME_COMPLETE)]),
+        'requests': handled,
+        'elapsed_seconds': elapsed,
+        'requests_per_second': handled / elapsed,
+        'latency_p50_ms': percentile(pipeline.latencies, 0.5) * 1000,
+        'latency_p99_ms': percentile(pipeline.latencies, 0.99) * 1000,
+        'aws_calls_per_game': per_game(pipeline.aws_calls),
+        'twitter_calls_per_game': per_game(twitter_api.calls)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the ingest -> game state pipeline')
+    parser.add_argument('--games', type=int, default=20)
+    parser.add_argument('--players', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=MAX_GAME_WORKERS)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--store', choices=['dynamo', 'memory'], default='dynamo')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    with mock_dynamodb2(), mock_kinesis():
+        # The pipeline prints a lot, keep it out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = run_benchmark(args.games, args.players, args.batch_size, args.seed, args.store,
+                                    args.workers)
+            LOGGER.flush()
+
+    print(json.dumps(results, indent=2))
+
+    if args.output is not None:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
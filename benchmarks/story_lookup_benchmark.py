@@ -0,0 +1,46 @@
+"""
+Micro-benchmark for matching a vote against the current story step.
+
+Compares the compiled story graph against the linear option scan that
+__make_selection used to do for every #ChooseMe tweet.
+
+Usage: python -m benchmarks.story_lookup_benchmark
+"""
+import timeit
+
+from src.game_steps import STORY_DEFINITION, get_choice
+
+ITERATIONS = 200000
+HASHTAGS = ['chooseme', 'tree']
+
+
+def linear_select(choice_id, hashtags):
+    step = STORY_DEFINITION[choice_id]
+    options = [option for option in step.get('options', []) if option['key'].lower() in hashtags]
+
+    if len(options) != 1:
+        return None
+
+    rendered = ' '.join(['#{}'.format(option['key']) for option in STORY_DEFINITION[options[0]['next_id']].get('options', [])])
+    return options[0]['next_id'], rendered
+
+
+def compiled_select(choice_id, hashtags):
+    next_id = get_choice(choice_id).select(hashtags)
+
+    if next_id is None:
+        return None
+
+    return next_id, get_choice(next_id).hashtags
+
+
+def main():
+    assert linear_select(1, HASHTAGS) == compiled_select(1, HASHTAGS)
+
+    for (name, select) in [('linear', linear_select), ('compiled', compiled_select)]:
+        seconds = timeit.timeit(lambda: select(1, HASHTAGS), number=ITERATIONS)
+        print('{:>8}: {:.3f} us per selection'.format(name, seconds / ITERATIONS * 1000000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+import os
+
+from src import clients
+from src.game_store import DynamoGameStore
+from src.game_sweeper import sweep_expired_games
+from src.instrumentation import INSTRUMENTATION
+from src.logger import LOGGER
+from src.tweet_dispatcher import STATUS_UPDATE_BUCKET, SharedTokenBucket, TweetDispatcher
+
+# Environment Variables
+dynamodb_table_name = os.environ.get('TABLE_NAME', 'test-twitter-table')
+active_game_table_name = os.environ.get('ACTIVE_GAME_TABLE_NAME', 'test-active-game-table')
+post_timeout_notice = os.environ.get('POST_TIMEOUT_NOTICE', 'true').lower() == 'true'
+# The status update budget shared by everything that posts for the account
+status_update_table_name = os.environ.get('STATUS_UPDATE_TABLE_NAME')
+
+
+def lambda_handler(event, context):
+    game_store = DynamoGameStore(clients.dynamodb_table(dynamodb_table_name),
+                                 clients.dynamodb_table(active_game_table_name))
+    dispatcher = None
+
+    if post_timeout_notice:
+        bucket = SharedTokenBucket(clients.dynamodb_table(status_update_table_name)) if status_update_table_name \
+            else STATUS_UPDATE_BUCKET
+        dispatcher = TweetDispatcher(clients.twitter_api(), bucket=bucket)
+
+    try:
+        sweep_expired_games(game_store, dispatcher)
+    finally:
+        if dispatcher is not None:
+            dispatcher.shutdown(wait=True)
+
+        INSTRUMENTATION.flush()
+        LOGGER.flush()
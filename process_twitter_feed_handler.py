@@ -1,8 +1,11 @@
-from time import sleep
+from time import sleep, time
 
-import twitter
-import boto3
 import os
+from src import clients
+from src.instrumentation import INSTRUMENTATION
+from src.logger import LOGGER
+from src.metrics import put_metrics
+from src.poll_planner import plan_next_poll
 from src.process_twitter_feed import process_twitter_feed
 
 # Constants
@@ -13,41 +16,56 @@ CONSUMER_SECRET = 'CONSUMER_SECRET'
 AWS_REGION = 'AWS_REGION'
 MAX_TIME_REMAINING = 21000
 
+# Poll schedule, kept across warm invocations
+last_poll_time = None
+planned_interval = None
+next_poll_time = 0
+
 # Environment Variables
-aws_region = os.environ.get(AWS_REGION, 'us-west-2')
 dynamodb_table_name = os.environ.get('TABLE_NAME', 'test-twitter-table')
 kinesis_stream = os.environ.get('KINESIS_STREAM', None)
 
 
-def get_api_credentials():
-    return {
-        'consumer_key': os.getenv('CONSUMER_KEY'),
-        'consumer_secret': os.getenv('CONSUMER_SECRET'),
-        'access_token_key': os.getenv('ACCESS_TOKEN_KEY'),
-        'access_token_secret': os.getenv('ACCESS_TOKEN_SECRET')
-    }
+def lambda_handler(event, context):
+    global last_poll_time, planned_interval, next_poll_time
 
+    LOGGER.info('InvocationStarted')
 
-# Clients
-print('Setting up dynamodb table connection.')
-dynamodb_table = boto3.resource('dynamodb', region_name=aws_region).Table(dynamodb_table_name)
-print('Setting up twitter client.')
-twitter_api = twitter.Api(**get_api_credentials())
-print('Setting up kinesis client.')
-kinesis_client = boto3.client('kinesis', region_name=aws_region)
+    # Built on the first invocation, then reused while the container is warm
+    dynamodb_table = clients.dynamodb_table(dynamodb_table_name)
+    twitter_api = clients.twitter_api()
+    kinesis_client = clients.kinesis_client()
 
+    processing_count = 1
 
-def lambda_handler(event, context):
+    try:
+        while context.get_remaining_time_in_millis() > MAX_TIME_REMAINING:
+            # Poll as often as the remaining rate limit budget allows
+            wait = next_poll_time - time()
+            time_left = (context.get_remaining_time_in_millis() - MAX_TIME_REMAINING) / 1000.0
 
-    print('Starting processing')
+            if wait > time_left:
+                LOGGER.info('PollDeferred', wait_seconds=round(wait, 1))
+                break
 
-    processing_count = 1
+            if wait > 0:
+                sleep(wait)
+
+            poll_time = time()
+
+            if last_poll_time is not None:
+                put_metrics({'PlannedPollInterval': planned_interval,
+                             'ActualPollInterval': poll_time - last_poll_time}, unit='Seconds')
 
-    while context.get_remaining_time_in_millis() > MAX_TIME_REMAINING:
-        print('Processing #{}'.format(processing_count))
-        process_twitter_feed(twitter_api, kinesis_client, kinesis_stream, dynamodb_table)
-        processing_count += 1
-        sleep(20)
+            LOGGER.info('PollStarted', poll=processing_count)
+            calls_per_poll = process_twitter_feed(twitter_api, kinesis_client, kinesis_stream, dynamodb_table)
+            processing_count += 1
 
-    print('Out of time. End of function')
+            planned_interval = plan_next_poll(twitter_api, calls_per_poll=calls_per_poll)
+            INSTRUMENTATION.flush()
+            last_poll_time = poll_time
+            next_poll_time = poll_time + planned_interval
 
+        LOGGER.info('InvocationFinished', polls=processing_count - 1)
+    finally:
+        LOGGER.flush()
@@ -1,48 +1,68 @@
 import base64
 import json
 import os
-import twitter
-
-import boto3
-from time import sleep
 
+from src import clients
+from src.game_store import DynamoGameStore
+from src.dead_letter_queue import DeadLetterQueue
+from src.instrumentation import INSTRUMENTATION
+from src.logger import LOGGER
+from src.request_ledger import RequestLedger
 from src.sam_quest import handle_game_state
+from src.tweet_dispatcher import SharedTokenBucket
 
 # Constants
 AWS_REGION = 'AWS_REGION'
 
-total_processed = 0
-
 # Environment Variables
-aws_region = os.environ.get(AWS_REGION, 'us-west-2')
 dynamodb_table_name = os.environ.get('TABLE_NAME', 'test-twitter-table')
+ledger_table_name = os.environ.get('LEDGER_TABLE_NAME', 'test-request-ledger-table')
+active_game_table_name = os.environ.get('ACTIVE_GAME_TABLE_NAME', 'test-active-game-table')
+history_table_name = os.environ.get('HISTORY_TABLE_NAME', 'test-game-history-table')
+tweet_index_table_name = os.environ.get('TWEET_INDEX_TABLE_NAME', 'test-tweet-index-table')
+dead_letter_queue_url = os.environ.get('DEAD_LETTER_QUEUE_URL')
+# The status update budget shared by everything that posts for the account
+status_update_table_name = os.environ.get('STATUS_UPDATE_TABLE_NAME')
+game_workers = int(os.environ.get('GAME_WORKERS', '8'))
+# Leaves time before the function timeout to post the replies of the requests that were started, for up to
+# REPLY_TIME_CAP_SECONDS more, and to report the requests that were not reached or not replied to
+batch_time_cap = float(os.environ.get('BATCH_TIME_CAP_SECONDS', '240'))
+
 
-def get_api_credentials():
-    return {
-        'consumer_key': os.getenv('CONSUMER_KEY'),
-        'consumer_secret': os.getenv('CONSUMER_SECRET'),
-        'access_token_key': os.getenv('ACCESS_TOKEN_KEY'),
-        'access_token_secret': os.getenv('ACCESS_TOKEN_SECRET')
-    }
+def lambda_handler(event, context):
+    # Built on the first invocation, then reused while the container is warm
+    dynamodb_table = clients.dynamodb_table(dynamodb_table_name)
+    ledger_table = clients.dynamodb_table(ledger_table_name)
+    active_game_table = clients.dynamodb_table(active_game_table_name)
+    history_table = clients.dynamodb_table(history_table_name)
+    tweet_index_table = clients.dynamodb_table(tweet_index_table_name)
+    twitter_api = clients.twitter_api()
 
+    dead_letters = DeadLetterQueue(clients.sqs_client(), dead_letter_queue_url) if dead_letter_queue_url \
+        else DeadLetterQueue()
 
-# Clients
-print('Setting up dynamodb table connection.')
-dynamodb_table = boto3.resource('dynamodb', region_name=aws_region).Table(dynamodb_table_name)
-print('Setting up twitter client.')
-twitter_api = twitter.Api(**get_api_credentials())
+    bucket = SharedTokenBucket(clients.dynamodb_table(status_update_table_name)) if status_update_table_name \
+        else None
 
+    posts = [__read_record(record) for record in event['Records']]
 
-def lambda_handler(event, context):
-    # global dynamodb_table
-    global total_processed
+    # Outbound tweets are rate limited by the dispatcher's token bucket, so there is no need to sleep here
+    try:
+        game_store = DynamoGameStore(dynamodb_table, active_game_table, history_table, tweet_index_table)
+        failed = handle_game_state(posts, twitter_api, game_store, ledger=RequestLedger(ledger_table),
+                                   dead_letters=dead_letters, max_workers=game_workers, time_cap=batch_time_cap,
+                                   bucket=bucket)
+    finally:
+        INSTRUMENTATION.flush()
+        LOGGER.flush()
+
+    # Kinesis retries from the first failed record, and the ledger skips what was already handled after it
+    return {'batchItemFailures': [{'itemIdentifier': event['Records'][index]['kinesis']['sequenceNumber']}
+                                  for index in failed]}
 
-    posts = [json.loads(base64.b64decode(record['kinesis']['data'])) for record in event['Records']]
 
-    # To avoid twitter throttling/locking, sleep 10 seconds after 10 records have been processed
-    if total_processed >= 10:
-        sleep(10)
-        total_processed = 0
+def __read_record(record):
+    post = json.loads(base64.b64decode(record['kinesis']['data']))
+    post['arrived_at'] = record['kinesis'].get('approximateArrivalTimestamp')
 
-    handle_game_state(posts, twitter_api, dynamodb_table)
-    total_processed += len(posts)
+    return post
@@ -0,0 +1,61 @@
+"""
+One shot migration that claims the creator of every open game in the active game
+table, so creators with a game from before the table existed can not start another.
+
+Usage: python -m scripts.backfill_active_games <game state table name> <active game table name>
+"""
+import os
+import sys
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+from src.models import GameState
+
+
+def backfill(dynamodb_table, active_game_table):
+    scan_args = {
+        'FilterExpression': Attr('GameState').ne(str(GameState.GAME_COMPLETE)),
+        'ProjectionExpression': 'TweetStartId, GameCreator'
+    }
+    claimed = 0
+
+    while True:
+        result = dynamodb_table.scan(**scan_args)
+
+        for item in result['Items']:
+            try:
+                active_game_table.put_item(Item={'GameCreator': item['GameCreator'],
+                                                 'TweetStartId': item['TweetStartId']},
+                                           ConditionExpression='attribute_not_exists(GameCreator)')
+                claimed += 1
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+
+                print('{} already has an active game, skipping game {}'.format(item['GameCreator'],
+                                                                                item['TweetStartId']))
+
+        if 'LastEvaluatedKey' not in result:
+            return claimed
+
+        scan_args['ExclusiveStartKey'] = result['LastEvaluatedKey']
+
+
+def main(argv):
+    if len(argv) < 3:
+        print(__doc__)
+        return 1
+
+    aws_region = os.environ.get('AWS_REGION', 'us-west-2')
+    dynamodb = boto3.resource('dynamodb', region_name=aws_region)
+
+    claimed = backfill(dynamodb.Table(argv[1]), dynamodb.Table(argv[2]))
+
+    print('Claimed {} creators in {}'.format(claimed, argv[2]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
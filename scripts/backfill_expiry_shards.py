@@ -0,0 +1,61 @@
+"""
+One shot migration that puts games created before the expiring games index into it,
+so the sweeper can end them. Open games without an ExpiryShard are given one, and
+games without an ExpirationTime are given one from their creation time.
+
+Usage: python -m scripts.backfill_expiry_shards <table name>
+"""
+import os
+import random
+import sys
+import time
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+
+from src.models import EXPIRY_SHARDS, GAME_LIFETIME_SECONDS, GameState
+
+
+def backfill(dynamodb_table):
+    scan_args = {
+        'FilterExpression': Attr('ExpiryShard').not_exists() & Attr('GameState').ne(str(GameState.GAME_COMPLETE)),
+        'ProjectionExpression': 'TweetStartId, CreationTime, ExpirationTime'
+    }
+    updated = 0
+
+    while True:
+        result = dynamodb_table.scan(**scan_args)
+
+        for item in result['Items']:
+            expiration_time = item.get('ExpirationTime',
+                                       int(item.get('CreationTime', time.time())) + GAME_LIFETIME_SECONDS)
+
+            dynamodb_table.update_item(Key={'TweetStartId': item['TweetStartId']},
+                                       UpdateExpression='SET ExpiryShard = :shard, ExpirationTime = :expiration_time',
+                                       ExpressionAttributeValues={':shard': random.randint(1, EXPIRY_SHARDS),
+                                                                  ':expiration_time': int(expiration_time)})
+            updated += 1
+
+        if 'LastEvaluatedKey' not in result:
+            return updated
+
+        scan_args['ExclusiveStartKey'] = result['LastEvaluatedKey']
+
+
+def main(argv):
+    if len(argv) < 2:
+        print(__doc__)
+        return 1
+
+    table_name = argv[1]
+    aws_region = os.environ.get('AWS_REGION', 'us-west-2')
+
+    dynamodb_table = boto3.resource('dynamodb', region_name=aws_region).Table(table_name)
+    updated = backfill(dynamodb_table)
+
+    print('Added {} open games in {} to the expiring games index'.format(updated, table_name))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
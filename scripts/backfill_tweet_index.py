@@ -0,0 +1,54 @@
+"""
+One shot migration that indexes the welcome tweet and current step of every game in
+the tweet index table, so replies to games from before the table existed still find
+their game.
+
+Usage: python -m scripts.backfill_tweet_index <game state table name> <tweet index table name>
+"""
+import os
+import sys
+import time
+
+import boto3
+
+from src.models import HISTORY_RETENTION_SECONDS
+
+
+def backfill(dynamodb_table, tweet_index_table):
+    scan_args = {'ProjectionExpression': 'TweetStartId, CurrentTweetId'}
+    purge_time = int(time.time()) + HISTORY_RETENTION_SECONDS
+    indexed = 0
+
+    with tweet_index_table.batch_writer(overwrite_by_pkeys=['StatusId']) as batch:
+        while True:
+            result = dynamodb_table.scan(**scan_args)
+
+            for item in result['Items']:
+                for status_id in (item['TweetStartId'], item.get('CurrentTweetId')):
+                    if status_id is not None:
+                        batch.put_item(Item={'StatusId': status_id, 'TweetStartId': item['TweetStartId'],
+                                             'PurgeTime': purge_time})
+                        indexed += 1
+
+            if 'LastEvaluatedKey' not in result:
+                return indexed
+
+            scan_args['ExclusiveStartKey'] = result['LastEvaluatedKey']
+
+
+def main(argv):
+    if len(argv) < 3:
+        print(__doc__)
+        return 1
+
+    aws_region = os.environ.get('AWS_REGION', 'us-west-2')
+    dynamodb = boto3.resource('dynamodb', region_name=aws_region)
+
+    indexed = backfill(dynamodb.Table(argv[1]), dynamodb.Table(argv[2]))
+
+    print('Indexed {} tweets in {}'.format(indexed, argv[2]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,32 @@
+"""
+One shot migration of the twitter feed table from one row per poll to a single
+cursor item per account.
+
+Usage: python -m scripts.compact_twitter_feed_table <table name> [account]
+"""
+import os
+import sys
+
+import boto3
+
+from src.cursor_store import TWITTER_ACCOUNT, compact_history
+
+
+def main(argv):
+    if len(argv) < 2:
+        print(__doc__)
+        return 1
+
+    table_name = argv[1]
+    account = argv[2] if len(argv) > 2 else TWITTER_ACCOUNT
+    aws_region = os.environ.get('AWS_REGION', 'us-west-2')
+
+    dynamodb_table = boto3.resource('dynamodb', region_name=aws_region).Table(table_name)
+    deleted = compact_history(dynamodb_table, account)
+
+    print('Deleted {} history rows for {} from {}'.format(deleted, account, table_name))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
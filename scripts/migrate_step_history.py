@@ -0,0 +1,91 @@
+"""
+One shot migration that moves the TwitterSteps list of every game into the game
+history table, replaces it with a StepCount and removes it from the session item.
+
+Run it before deploying the version that writes the history, which numbers new steps
+from the StepCount. Games are migrated one at a time, and the list is only removed if
+it has not changed since it was copied, so the old version can keep playing meanwhile.
+
+Usage: python -m scripts.migrate_step_history <game state table name> <game history table name>
+"""
+import os
+import sys
+import time
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+from src.models import HISTORY_RETENTION_SECONDS
+
+
+def migrate(dynamodb_table, history_table):
+    scan_args = {
+        'FilterExpression': Attr('TwitterSteps').exists(),
+        'ProjectionExpression': 'TweetStartId, TwitterSteps, CreationTime'
+    }
+    migrated = 0
+
+    while True:
+        result = dynamodb_table.scan(**scan_args)
+
+        for item in result['Items']:
+            if migrate_game(dynamodb_table, history_table, item):
+                migrated += 1
+
+        if 'LastEvaluatedKey' not in result:
+            return migrated
+
+        scan_args['ExclusiveStartKey'] = result['LastEvaluatedKey']
+
+
+def migrate_game(dynamodb_table, history_table, item):
+    tweet_start_id = int(item['TweetStartId'])
+    steps = [int(step_tweet_id) for step_tweet_id in item['TwitterSteps']]
+    creation_time = int(item.get('CreationTime') or time.time())
+
+    with history_table.batch_writer(overwrite_by_pkeys=['TweetStartId', 'StepNumber']) as batch:
+        for (index, step_tweet_id) in enumerate(steps):
+            batch.put_item(Item={
+                'TweetStartId': tweet_start_id,
+                'StepNumber': index + 1,
+                'StepTweetId': step_tweet_id,
+                'CreationTime': creation_time,
+                'PurgeTime': creation_time + HISTORY_RETENTION_SECONDS
+            })
+
+    try:
+        dynamodb_table.update_item(Key={'TweetStartId': tweet_start_id},
+                                   # Moving the version on makes writers holding the old list merge with this one
+                                   UpdateExpression='SET StepCount = :step_count, '
+                                                    'Version = if_not_exists(Version, :zero) + :one '
+                                                    'REMOVE TwitterSteps',
+                                   ConditionExpression='size(TwitterSteps) = :step_count '
+                                                       'AND attribute_not_exists(StepCount)',
+                                   ExpressionAttributeValues={':step_count': len(steps), ':zero': 0, ':one': 1})
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+        print('Game {} moved on while being migrated, run the migration again'.format(tweet_start_id))
+        return False
+
+    return True
+
+
+def main(argv):
+    if len(argv) < 3:
+        print(__doc__)
+        return 1
+
+    aws_region = os.environ.get('AWS_REGION', 'us-west-2')
+    dynamodb = boto3.resource('dynamodb', region_name=aws_region)
+
+    migrated = migrate(dynamodb.Table(argv[1]), dynamodb.Table(argv[2]))
+
+    print('Moved the steps of {} games into {}'.format(migrated, argv[2]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,91 @@
+"""
+Lazily built clients, shared across warm lambda invocations.
+
+Nothing here is constructed until a handler first asks for it, so building boto3
+sessions and the twitter client is left to the first invocation instead of the import.
+The libraries themselves are still imported when a handler loads, through the game
+store, cursor store and models, which is what the cold start benchmark budget covers.
+Every client is instrumented, so its calls are timed and counted.
+"""
+import os
+import threading
+
+from src.instrumentation import INSTRUMENTATION
+from src.logger import LOGGER
+
+AWS_REGION = 'AWS_REGION'
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_api_credentials():
+    return {
+        'consumer_key': os.getenv('CONSUMER_KEY'),
+        'consumer_secret': os.getenv('CONSUMER_SECRET'),
+        'access_token_key': os.getenv('ACCESS_TOKEN_KEY'),
+        'access_token_secret': os.getenv('ACCESS_TOKEN_SECRET')
+    }
+
+
+def get_client(name, factory):
+    """
+    Get a client by name, building it with the factory on first use
+    :param name: The name the client is cached under
+    :param factory: A function with no arguments that builds the client
+    :return:
+    """
+    if name not in _clients:
+        with _lock:
+            if name not in _clients:
+                LOGGER.info('ClientCreated', client=name)
+                _clients[name] = factory()
+
+    return _clients[name]
+
+
+def aws_region():
+    return os.environ.get(AWS_REGION, 'us-west-2')
+
+
+def dynamodb_table(table_name):
+    def factory():
+        import boto3
+        table = boto3.resource('dynamodb', region_name=aws_region()).Table(table_name)
+        INSTRUMENTATION.instrument_boto(table.meta.client, 'DynamoDB')
+        return table
+
+    return get_client('dynamodb table ' + table_name, factory)
+
+
+def kinesis_client():
+    def factory():
+        import boto3
+        return INSTRUMENTATION.instrument_boto(boto3.client('kinesis', region_name=aws_region()), 'Kinesis')
+
+    return get_client('kinesis client', factory)
+
+
+def sqs_client():
+    def factory():
+        import boto3
+        return INSTRUMENTATION.instrument_boto(boto3.client('sqs', region_name=aws_region()), 'SQS')
+
+    return get_client('sqs client', factory)
+
+
+def twitter_api():
+    def factory():
+        import twitter
+        return INSTRUMENTATION.wrap(twitter.Api(**get_api_credentials()), 'Twitter')
+
+    return get_client('twitter client', factory)
+
+
+def reset():
+    """
+    Forget every client, so the next use builds them again
+    :return:
+    """
+    with _lock:
+        _clients.clear()
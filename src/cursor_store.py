@@ -0,0 +1,169 @@
+import json
+import os
+
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+from src.logger import LOGGER
+
+TWITTER_ACCOUNT = '@SAMQuest9'
+
+# The single cursor item of an account is stored under this sort key
+CURSOR_POST_ID = 0
+
+# (Table name, account) -> last processed post id, kept across warm lambda invocations
+CURSOR_CACHE = {}
+
+
+class CursorStore(object):
+    """
+    Keeps track of the last twitter post processed for an account.
+
+    The cursor is a single item per account that only ever moves forward. The value
+    is cached in the process, so dynamo is only read on a cold start or when another
+    poller moved the cursor first.
+    """
+
+    def __init__(self, dynamodb_table, account=TWITTER_ACCOUNT):
+        self.dynamodb_table = dynamodb_table
+        self.account = account
+        self.cache_key = (dynamodb_table.name, account)
+
+    def get(self):
+        """
+        Get the last processed post id
+        :return: The post id, or None if nothing has been processed
+        """
+        if self.cache_key not in CURSOR_CACHE:
+            CURSOR_CACHE[self.cache_key] = self.__read()
+
+        return CURSOR_CACHE[self.cache_key]
+
+    def advance(self, post_id):
+        """
+        Move the cursor forward to a post. The cursor never moves backwards.
+        :param post_id:
+        :return:
+        """
+        try:
+            self.dynamodb_table.update_item(
+                Key={'TwitterAccount': self.account, 'TwitterPostId': CURSOR_POST_ID},
+                UpdateExpression='SET LastPostId = :post_id',
+                ConditionExpression='attribute_not_exists(LastPostId) OR LastPostId < :post_id',
+                ExpressionAttributeValues={':post_id': int(post_id)})
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+            # Someone else moved the cursor past this post, pick up their value
+            LOGGER.warning('CursorAlreadyAdvanced', account=self.account, post_id=post_id)
+            CURSOR_CACHE[self.cache_key] = self.__read()
+            return
+
+        CURSOR_CACHE[self.cache_key] = int(post_id)
+
+    def __read(self):
+        result = self.dynamodb_table.get_item(Key={'TwitterAccount': self.account, 'TwitterPostId': CURSOR_POST_ID},
+                                              ConsistentRead=True)
+
+        if 'Item' in result and 'LastPostId' in result['Item']:
+            return int(result['Item']['LastPostId'])
+
+        # Not migrated yet, fall back to the newest history row
+        return newest_history_post_id(self.dynamodb_table, self.account)
+
+
+class FileCursorStore(object):
+    """
+    Keeps the cursor in a local JSON file, for running the ingest service without dynamo.
+
+    The file is replaced in one step on every advance, so a crash leaves either the old
+    or the new cursor behind.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def get(self):
+        """
+        Get the last processed post id
+        :return: The post id, or None if nothing has been processed
+        """
+        if not os.path.exists(self.path):
+            return None
+
+        with open(self.path) as cursor_file:
+            return json.load(cursor_file).get('LastPostId')
+
+    def advance(self, post_id):
+        """
+        Move the cursor forward to a post. The cursor never moves backwards.
+        :param post_id:
+        :return:
+        """
+        last_post_id = self.get()
+
+        if last_post_id is not None and last_post_id >= int(post_id):
+            return
+
+        temporary_path = self.path + '.tmp'
+
+        with open(temporary_path, 'w') as cursor_file:
+            json.dump({'LastPostId': int(post_id)}, cursor_file)
+
+        os.replace(temporary_path, self.path)
+
+
+def newest_history_post_id(dynamodb_table, account=TWITTER_ACCOUNT):
+    """
+    Get the newest post id from the old one row per poll history
+    :param dynamodb_table:
+    :param account:
+    :return: The post id, or None if there is no history
+    """
+    result = dynamodb_table.query(KeyConditionExpression=Key('TwitterAccount').eq(account)
+                                  & Key('TwitterPostId').gt(CURSOR_POST_ID),
+                                  ScanIndexForward=False, Limit=1)
+
+    if result['Count'] == 0:
+        return None
+
+    return int(result['Items'][0]['TwitterPostId'])
+
+
+def compact_history(dynamodb_table, account=TWITTER_ACCOUNT):
+    """
+    One shot migration from one row per poll to a single cursor item. Moves the cursor
+    to the newest history row, then deletes every history row.
+    :param dynamodb_table:
+    :param account:
+    :return: The number of history rows deleted
+    """
+    newest = newest_history_post_id(dynamodb_table, account)
+
+    if newest is None:
+        return 0
+
+    CursorStore(dynamodb_table, account).advance(newest)
+
+    deleted = 0
+    query_args = {
+        'KeyConditionExpression': Key('TwitterAccount').eq(account) & Key('TwitterPostId').gt(CURSOR_POST_ID),
+        'ProjectionExpression': 'TwitterAccount, TwitterPostId'
+    }
+
+    with dynamodb_table.batch_writer() as batch:
+        while True:
+            result = dynamodb_table.query(**query_args)
+
+            for item in result['Items']:
+                batch.delete_item(Key={'TwitterAccount': item['TwitterAccount'],
+                                       'TwitterPostId': item['TwitterPostId']})
+                deleted += 1
+
+            if 'LastEvaluatedKey' not in result:
+                break
+
+            query_args['ExclusiveStartKey'] = result['LastEvaluatedKey']
+
+    return deleted
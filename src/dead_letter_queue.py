@@ -0,0 +1,35 @@
+import json
+
+from src.logger import LOGGER
+
+
+class DeadLetterQueue(object):
+    """
+    Where game requests go once they have failed too many times to keep retrying.
+
+    Each request is sent to an SQS queue with the error it last failed with, so it can
+    be looked at and replayed by hand. Without a queue the request is only logged.
+    """
+
+    def __init__(self, sqs_client=None, queue_url=None):
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+
+    def send(self, post, error, attempts):
+        """
+        :param post: The game request, as the dict it was read from the stream as
+        :param error: The exception it last failed with
+        :param attempts: How many times it was attempted
+        :return:
+        """
+        if self.sqs_client is None:
+            # The log is the only place the request is kept
+            LOGGER.error('RequestDeadLettered', status_id=post.get('status_id'), attempts=attempts, error=str(error),
+                         request=post)
+            return
+
+        self.sqs_client.send_message(QueueUrl=self.queue_url,
+                                     MessageBody=json.dumps({'request': post, 'error': str(error),
+                                                             'attempts': attempts}, default=str))
+
+        LOGGER.error('RequestDeadLettered', status_id=post.get('status_id'), attempts=attempts, error=str(error))
@@ -0,0 +1,566 @@
+import abc
+import time
+
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+
+from src.logger import LOGGER
+from src.models import EXPIRY_SHARDS, HISTORY_RETENTION_SECONDS, GameSession, GameState
+
+# Fields that only ever grow. Concurrent appends to these are merged instead of conflicting.
+APPEND_ONLY_FIELDS = ('Players',)
+
+# Every attribute of the session item. Reads project these, so attributes left on older
+# items, such as the TwitterSteps list the game history replaced, are never read.
+SESSION_FIELDS = tuple(GameSession().param_defaults)
+
+MAX_PLAYERS = 4
+MAX_SAVE_ATTEMPTS = 3
+
+# DynamoDB BatchWriteItem limit, across every table in the request
+MAX_BATCH_WRITE_ITEMS = 25
+
+# How long a creator claim is held while the game it is for has not been saved yet
+CREATOR_CLAIM_LEASE_SECONDS = 10 * 60
+
+
+class GameSessionConflictError(Exception):
+    """
+    Raised when a game was changed by someone else in a way that cannot be merged
+    """
+    pass
+
+
+class GameStore(abc.ABC):
+    """
+    Where game sessions are kept.
+
+    Every save is versioned. A save only succeeds if the stored game is still at the
+    version the session was loaded at, otherwise the local changes are replayed on
+    top of the latest version and the save is retried.
+
+    A creator can only have one open game. The creator is claimed before the game is
+    created, the claim is bound to the game once it is saved, and released when the
+    game completes.
+
+    The tweets of a game are kept apart from the session, in its history. The session
+    only holds the fixed size state that is needed to play, and new steps are appended
+    to the history once the session is saved. Every tweet the bot posts for a game is
+    also indexed, so a reply to any of them finds the game.
+
+    Backends implement the abstract methods: the lookups, record_vote, the creator claims,
+    get_history, _insert, _update and _append_steps.
+    """
+
+    @abc.abstractmethod
+    def get_by_start_tweet(self, tweet_start_id):
+        """
+        Get a game by the id of the tweet that started it
+        :param tweet_start_id:
+        :return: The GameSession, or None if it does not exist
+        """
+
+    @abc.abstractmethod
+    def get_by_tweet(self, status_id):
+        """
+        Get the game a tweet posted by the bot belongs to. This is the welcome tweet or any
+        step of the game, not only the one it is waiting on.
+        :param status_id:
+        :return: The GameSession, or None if the tweet is not part of a game
+        """
+
+    @abc.abstractmethod
+    def get_active_by_creator(self, user):
+        """
+        Get the games a user created that are not complete
+        :param user:
+        :return: A list of GameSessions
+        """
+
+    @abc.abstractmethod
+    def get_expired(self, now):
+        """
+        Get the open games that have not moved on before their expiration time
+        :param now: The current epoch time
+        :return: A list of GameSessions
+        """
+
+    def complete_expired(self, game_sessions):
+        """
+        Store expired games the sweeper completed. Each game is only written if it is still
+        at the version it was read at. A game that moved on in the meantime, e.g. a vote
+        came in, is skipped rather than merged, so it is not ended while it is being played.
+        :param game_sessions: The completed games
+        :return: The games that were stored
+        """
+        stored = []
+
+        for game_session in game_sessions:
+            saved = game_session.SavedState()
+            next_version = int(saved.get('Version') or 0) + 1
+
+            if not self._update(game_session, saved, next_version):
+                LOGGER.warning('ExpiredGameNotCompleted', tweet_start_id=game_session.TweetStartId)
+                continue
+
+            game_session.Version = next_version
+            game_session.MarkSaved()
+            self.__save_steps(game_session, [])
+            self.__release_if_completed(game_session, saved)
+            stored.append(game_session)
+
+        return stored
+
+    @abc.abstractmethod
+    def claim_creator(self, user, now=None):
+        """
+        Atomically claim the right for a user to create a game
+        :param user: The creator
+        :param now: The current epoch time. Defaults to time.time()
+        :return: False if the user already has an open game, or is creating one
+        """
+
+    @abc.abstractmethod
+    def bind_creator(self, user, tweet_start_id):
+        """
+        Tie a creator claim to the game it was for. It is then held until the game completes.
+        :param user:
+        :param tweet_start_id:
+        :return:
+        """
+
+    @abc.abstractmethod
+    def release_creator(self, user, tweet_start_id=None):
+        """
+        Release a creator claim
+        :param user:
+        :param tweet_start_id: Only release the claim if it is bound to this game
+        :return:
+        """
+
+    @abc.abstractmethod
+    def record_vote(self, game_session, voter, option):
+        """
+        Atomically count a vote for the current step of a game. A player can only vote
+        once per step, and votes for a step that has already moved on are rejected.
+        :param game_session: The game being voted on. Its vote fields are refreshed.
+        :param voter: The name of the player voting
+        :param option: The lowercase option key being voted for
+        :return: True if the vote was counted
+        """
+
+    @abc.abstractmethod
+    def get_history(self, tweet_start_id):
+        """
+        Get every step of a game. Not needed to play, so it is never read on the hot path.
+        :param tweet_start_id:
+        :return: A list of step dicts, in the order they were added
+        """
+
+    def save(self, game_session):
+        """
+        Write the changes made to a session since it was loaded.
+        :param game_session:
+        :return:
+        """
+        saved = game_session.SavedState()
+
+        if saved is None:
+            game_session.Version = 1
+
+            if not self._insert(game_session):
+                raise GameSessionConflictError('Game {} already exists'.format(game_session.TweetStartId))
+
+            game_session.MarkSaved()
+            self.__save_steps(game_session, [int(game_session.TweetStartId)])
+            self.bind_creator(game_session.GameCreator, game_session.TweetStartId)
+            return
+
+        for attempt in range(MAX_SAVE_ATTEMPTS):
+            next_version = int(saved.get('Version') or 0) + 1
+
+            if self._update(game_session, saved, next_version):
+                game_session.Version = next_version
+                game_session.MarkSaved()
+                self.__save_steps(game_session, [])
+                self.__release_if_completed(game_session, saved)
+                return
+
+            LOGGER.warning('GameSaveConflict', tweet_start_id=game_session.TweetStartId, attempt=attempt + 1)
+            latest = self.get_by_start_tweet(game_session.TweetStartId)
+            saved = rebase(game_session, saved, latest)
+
+        raise GameSessionConflictError('Could not save game {} after {} attempts'.format(
+            game_session.TweetStartId, MAX_SAVE_ATTEMPTS))
+
+    def __save_steps(self, game_session, tweet_ids):
+        steps = game_session.NewSteps()
+
+        # Steps with a story step were posted by the bot, the first one is the player's #LetsPlay
+        tweet_ids = tweet_ids + [step['StepTweetId'] for step in steps if 'GameStep' in step]
+
+        if len(steps) > 0 or len(tweet_ids) > 0:
+            self._append_steps(game_session.TweetStartId, steps, tweet_ids)
+            game_session.MarkStepsSaved()
+
+    def __release_if_completed(self, game_session, saved):
+        complete = str(GameState.GAME_COMPLETE)
+
+        if game_session.GameState == complete and saved.get('GameState') != complete:
+            self.release_creator(game_session.GameCreator, game_session.TweetStartId)
+
+    @abc.abstractmethod
+    def _insert(self, game_session):
+        """
+        Store a new game
+        :param game_session: The game, already at version 1
+        :return: False if a game with the same start tweet already exists
+        """
+
+    @abc.abstractmethod
+    def _update(self, game_session, saved, next_version):
+        """
+        Store the changes to a game, if the stored game is still at the saved version
+        :param game_session: The game with local changes
+        :param saved: The state the local changes were made on top of
+        :param next_version: The version to store the game at
+        :return: False if the stored game is no longer at the saved version
+        """
+
+    @abc.abstractmethod
+    def _append_steps(self, tweet_start_id, steps, tweet_ids):
+        """
+        Add steps to the history of a game, and index the tweets posted for it. Steps are
+        keyed by their number and tweets by their id, so writing either twice has no effect.
+        :param tweet_start_id:
+        :param steps: A list of step dicts
+        :param tweet_ids: The ids of the tweets to find the game by
+        :return:
+        """
+
+
+def changed_fields(game_session, saved):
+    """
+    The fields of a game that changed since it was saved
+    :param game_session:
+    :param saved: The saved state of the game
+    :return: A list of field names
+    """
+    current = game_session.AsDict()
+
+    return [field for field in game_session.param_defaults
+            if field not in ('TweetStartId', 'Version') and saved.get(field) != current.get(field)]
+
+
+def vote_is_allowed(stored, current_tweet_id, voter, option):
+    """
+    Check a vote against the stored state of a game
+    :param stored: The stored game, as a dict
+    :param current_tweet_id: The step the voter replied to
+    :param voter:
+    :param option:
+    :return: True if the vote can be counted
+    """
+    return (stored.get('CurrentTweetId') is not None
+            and int(stored['CurrentTweetId']) == int(current_tweet_id)
+            and stored.get('GameState') == str(GameState.PENDING_GAME_INPUT)
+            and option in (stored.get('CurrentVotes') or {})
+            and voter not in (stored.get('CurrentVoters') or set()))
+
+
+def rebase(game_session, saved, latest):
+    """
+    Replay the local changes on top of the latest stored version of a game.
+    :param game_session: The game with local changes. It is updated in place.
+    :param saved: The state the local changes were made on top of
+    :param latest: The latest stored GameSession
+    :return: The latest saved state, that the local changes now apply to
+    """
+    if latest is None:
+        raise GameSessionConflictError('Game {} no longer exists'.format(game_session.TweetStartId))
+
+    latest_state = latest.SavedState()
+    current = game_session.AsDict()
+
+    for field in changed_fields(game_session, saved):
+        if field in APPEND_ONLY_FIELDS:
+            appended = [value for value in current.get(field, [])[len(saved.get(field, [])):]
+                        if value not in latest_state.get(field, [])]
+            setattr(game_session, field, list(latest_state.get(field, [])) + appended)
+        elif saved.get(field) != latest_state.get(field):
+            raise GameSessionConflictError('Game {} field {} was changed by someone else'.format(
+                game_session.TweetStartId, field))
+
+    # Carry over changes made by the other writer to fields we did not touch
+    for field in game_session.param_defaults:
+        if saved.get(field) == current.get(field):
+            setattr(game_session, field, latest_state.get(field))
+
+    if game_session.Players is not None and len(game_session.Players) > MAX_PLAYERS:
+        raise GameSessionConflictError('Game {} is full'.format(game_session.TweetStartId))
+
+    return latest_state
+
+
+class DynamoGameStore(GameStore):
+    """
+    Stores game sessions in the game state table.
+
+    Saves only write the fields that changed since the session was loaded, using
+    list_append for the append only fields, and are conditional on the Version
+    attribute so that concurrent writers never silently overwrite each other.
+
+    Creator claims are single items in the active game table, keyed by creator, that
+    only exist while the creator has an open game. Without an active game table the
+    claim falls back to querying the creator's games, which is not atomic.
+
+    Steps are items in the history table, keyed by game and step number. Without a
+    history table no history is kept.
+
+    The tweet index table maps the id of each tweet posted for a game to the game, so a
+    reply is resolved with a strongly consistent read. Without a tweet index table only
+    replies to the welcome tweet are resolved.
+    """
+
+    def __init__(self, dynamodb_table, active_game_table=None, history_table=None, tweet_index_table=None):
+        self.dynamodb_table = dynamodb_table
+        self.active_game_table = active_game_table
+        self.history_table = history_table
+        self.tweet_index_table = tweet_index_table
+
+    def get_by_start_tweet(self, tweet_start_id):
+        result = self.dynamodb_table.get_item(Key={'TweetStartId': int(tweet_start_id)},
+                                              ConsistentRead=True,
+                                              **session_projection())
+
+        if 'Item' not in result or result['Item'] is None or len(result['Item']) == 0:
+            return None
+
+        return self.__to_session(result['Item'])
+
+    def get_by_tweet(self, status_id):
+        if self.tweet_index_table is None:
+            return self.get_by_start_tweet(status_id)
+
+        result = self.tweet_index_table.get_item(Key={'StatusId': int(status_id)}, ConsistentRead=True)
+
+        if 'Item' not in result or result['Item'] is None or len(result['Item']) == 0:
+            return None
+
+        return self.get_by_start_tweet(result['Item']['TweetStartId'])
+
+    def get_active_by_creator(self, user):
+        result = self.dynamodb_table.query(IndexName='GameCreator-index',
+                                           KeyConditionExpression=Key('GameCreator').eq(user),
+                                           FilterExpression=Attr('GameState').ne(str(GameState.GAME_COMPLETE)),
+                                           **session_projection())
+
+        return [self.__to_session(item) for item in result['Items']]
+
+    def get_expired(self, now):
+        expired = []
+
+        for shard in range(1, EXPIRY_SHARDS + 1):
+            query_args = session_projection()
+            query_args['IndexName'] = 'ExpiringGames-index'
+            query_args['KeyConditionExpression'] = Key('ExpiryShard').eq(shard) & Key('ExpirationTime').lt(int(now))
+
+            while True:
+                result = self.dynamodb_table.query(**query_args)
+                expired.extend(self.__to_session(item) for item in result['Items'])
+
+                if 'LastEvaluatedKey' not in result:
+                    break
+
+                query_args['ExclusiveStartKey'] = result['LastEvaluatedKey']
+
+        return expired
+
+    def claim_creator(self, user, now=None):
+        if self.active_game_table is None:
+            return len(self.get_active_by_creator(user)) == 0
+
+        now = int(time.time() if now is None else now)
+
+        try:
+            self.active_game_table.put_item(
+                Item={'GameCreator': user, 'LeaseExpiry': now + CREATOR_CLAIM_LEASE_SECONDS},
+                ConditionExpression='attribute_not_exists(GameCreator) OR LeaseExpiry < :now',
+                ExpressionAttributeValues={':now': now})
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+        return True
+
+    def bind_creator(self, user, tweet_start_id):
+        if self.active_game_table is None:
+            return
+
+        self.active_game_table.update_item(Key={'GameCreator': user},
+                                           UpdateExpression='SET TweetStartId = :tweet_start_id REMOVE LeaseExpiry',
+                                           ExpressionAttributeValues={':tweet_start_id': int(tweet_start_id)})
+
+    def release_creator(self, user, tweet_start_id=None):
+        if self.active_game_table is None:
+            return
+
+        delete_args = {'Key': {'GameCreator': user}}
+
+        if tweet_start_id is not None:
+            delete_args['ConditionExpression'] = 'TweetStartId = :tweet_start_id'
+            delete_args['ExpressionAttributeValues'] = {':tweet_start_id': int(tweet_start_id)}
+
+        try:
+            self.active_game_table.delete_item(**delete_args)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+    def get_history(self, tweet_start_id):
+        if self.history_table is None:
+            return []
+
+        query_args = {'KeyConditionExpression': Key('TweetStartId').eq(int(tweet_start_id))}
+        steps = []
+
+        while True:
+            result = self.history_table.query(**query_args)
+            steps.extend(result['Items'])
+
+            if 'LastEvaluatedKey' not in result:
+                return steps
+
+            query_args['ExclusiveStartKey'] = result['LastEvaluatedKey']
+
+    def record_vote(self, game_session, voter, option):
+        try:
+            result = self.dynamodb_table.update_item(
+                Key={'TweetStartId': int(game_session.TweetStartId)},
+                UpdateExpression='SET CurrentVotes.#option = CurrentVotes.#option + :one ADD CurrentVoters :voters',
+                ConditionExpression='CurrentTweetId = :current_tweet AND GameState = :state '
+                                    'AND attribute_exists(CurrentVotes.#option) AND NOT contains(CurrentVoters, :voter)',
+                ExpressionAttributeNames={'#option': option},
+                ExpressionAttributeValues={
+                    ':one': 1,
+                    ':voters': {voter},
+                    ':voter': voter,
+                    ':current_tweet': int(game_session.CurrentTweetId),
+                    ':state': str(GameState.PENDING_GAME_INPUT)
+                },
+                ReturnValues='ALL_NEW')
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+        game_session.CurrentVotes = result['Attributes'].get('CurrentVotes')
+        game_session.CurrentVoters = result['Attributes'].get('CurrentVoters')
+        game_session.MarkSaved(['CurrentVotes', 'CurrentVoters'])
+
+        return True
+
+    def _insert(self, game_session):
+        try:
+            self.dynamodb_table.put_item(Item=game_session.AsDict(),
+                                         ConditionExpression='attribute_not_exists(TweetStartId)')
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+        return True
+
+    def _update(self, game_session, saved, next_version):
+        current = game_session.AsDict()
+        set_clauses = []
+        remove_clauses = []
+        names = {'#Version': 'Version'}
+        values = {':next_version': next_version}
+
+        for field in changed_fields(game_session, saved):
+            names['#' + field] = field
+            old = saved.get(field)
+            new = current.get(field)
+
+            if new is None:
+                remove_clauses.append('#' + field)
+            elif field in APPEND_ONLY_FIELDS and old is not None and new[:len(old)] == old:
+                values[':' + field] = new[len(old):]
+                values[':empty_list'] = []
+                set_clauses.append('#{0} = list_append(if_not_exists(#{0}, :empty_list), :{0})'.format(field))
+            else:
+                values[':' + field] = new
+                set_clauses.append('#{0} = :{0}'.format(field))
+
+        set_clauses.append('#Version = :next_version')
+        update_expression = 'SET ' + ', '.join(set_clauses)
+
+        if len(remove_clauses) > 0:
+            update_expression += ' REMOVE ' + ', '.join(remove_clauses)
+
+        if 'Version' in saved:
+            condition_expression = '#Version = :version'
+            values[':version'] = saved['Version']
+        else:
+            condition_expression = 'attribute_not_exists(#Version)'
+
+        try:
+            self.dynamodb_table.update_item(Key={'TweetStartId': int(game_session.TweetStartId)},
+                                            UpdateExpression=update_expression,
+                                            ConditionExpression=condition_expression,
+                                            ExpressionAttributeNames=names,
+                                            ExpressionAttributeValues=values)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+        return True
+
+    def _append_steps(self, tweet_start_id, steps, tweet_ids):
+        """
+        The steps and the tweet index entries go in the same BatchWriteItem
+        """
+        requests = []
+
+        if self.history_table is not None:
+            requests.extend((self.history_table.name, {'PutRequest': {'Item': step}}) for step in steps)
+
+        if self.tweet_index_table is not None:
+            purge_time = int(time.time()) + HISTORY_RETENTION_SECONDS
+            requests.extend((self.tweet_index_table.name,
+                             {'PutRequest': {'Item': {'StatusId': int(tweet_id),
+                                                      'TweetStartId': int(tweet_start_id),
+                                                      'PurgeTime': purge_time}}})
+                            for tweet_id in tweet_ids)
+
+        for start in range(0, len(requests), MAX_BATCH_WRITE_ITEMS):
+            request_items = {}
+
+            for (table_name, request) in requests[start:start + MAX_BATCH_WRITE_ITEMS]:
+                request_items.setdefault(table_name, []).append(request)
+
+            # Like the boto3 batch writer, send whatever was left unprocessed until nothing is
+            while len(request_items) > 0:
+                result = self.dynamodb_table.meta.client.batch_write_item(RequestItems=request_items)
+                request_items = result.get('UnprocessedItems') or {}
+
+    @staticmethod
+    def __to_session(item):
+        game_session = GameSession.NewFromJsonDict(item)
+        game_session.MarkSaved()
+
+        return game_session
+
+
+def session_projection():
+    """
+    The arguments that limit a read of the game state table to the session attributes
+    :return: A dict of ProjectionExpression and ExpressionAttributeNames
+    """
+    return {
+        'ProjectionExpression': ', '.join('#' + field for field in SESSION_FIELDS),
+        'ExpressionAttributeNames': {'#' + field: field for field in SESSION_FIELDS}
+    }
@@ -0,0 +1,47 @@
+import time
+
+from src.logger import LOGGER
+from src.metrics import put_metrics
+
+
+def sweep_expired_games(game_store, dispatcher=None, now=None):
+    """
+    End every open game that has not moved on before its expiration time.
+
+    Expired games are found through the sparse expiring games index, so only open games
+    are read. They are marked complete, which takes them out of the index and lets
+    DynamoDB TTL purge them later.
+    :param game_store: The GameStore the games are kept in
+    :param dispatcher: If given, a timeout notice is posted to the players of each game
+    :param now: The current epoch time. Defaults to time.time()
+    :return: The games that were ended
+    """
+    now = int(time.time() if now is None else now)
+
+    expired = game_store.get_expired(now)
+
+    for game_session in expired:
+        game_session.Complete(now)
+
+    ended = game_store.complete_expired(expired)
+
+    if dispatcher is not None:
+        futures = [__post_timeout_notice(game_session, dispatcher) for game_session in ended]
+
+        for future in futures:
+            future.result()
+
+    LOGGER.info('ExpiredGamesSwept', found=len(expired), ended=len(ended))
+    put_metrics({'GamesExpired': len(ended)})
+
+    return ended
+
+
+def __post_timeout_notice(game_session, dispatcher):
+    users = ' '.join(['@{}'.format(player) for player in game_session.Players or []])
+    status_message = '{} your game timed out! Start a new one with #LetsPlay'.format(users)
+
+    # Replies to the step the players were last shown, so the notice lands in the game's thread
+    reply_status_id = game_session.CurrentTweetId or game_session.TweetStartId
+
+    return dispatcher.post(status_message, in_reply_to_status_id=int(reply_status_id))
@@ -0,0 +1,361 @@
+"""
+A long running service that reads mentions from a source, classifies them into game
+requests and hands them to a sink. It replaces the ingest lambda, which is scheduled
+every minute and loops on process_twitter_feed, so it leaves gaps and can overlap the
+next run.
+
+Fetching and publishing are two tasks joined by a bounded queue, so the next fetch
+overlaps publishing the last one, and a slow sink holds the source back. The cursor is
+checkpointed past a batch only once the sink took every request in it, so a restart
+picks up from the first request that was not published.
+
+SIGTERM and SIGINT stop the service gracefully. It stops fetching, publishes what was
+already fetched, and flushes the logs and metrics.
+
+Usage: python -m src.ingest_service --source poll|webhook|replay --sink kinesis|game-state [options]
+
+The tables, stream and dead letter queue are read from the same environment variables as
+the handlers, with FEED_TABLE_NAME and GAME_TABLE_NAME for the two tables the handlers
+both call TABLE_NAME.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import sys
+import time
+
+from src import clients
+from src.cursor_store import CursorStore, FileCursorStore
+from src.instrumentation import INSTRUMENTATION
+from src.kinesis_publisher import acknowledged_cursor
+from src.logger import LOGGER
+from src.process_twitter_feed import classified_through, classify_mentions
+from src.user_cache import UserResolver
+
+# Fetched batches waiting to be published. The source is not fetched from while it is full.
+MAX_QUEUED_BATCHES = 10
+
+# Waits between attempts after the source or the sink failed, doubling up to the max
+BASE_BACKOFF_SECONDS = 1
+MAX_BACKOFF_SECONDS = 60
+
+# How long a stop waits for the fetched batches to be published
+SHUTDOWN_TIMEOUT_SECONDS = 30
+
+
+class IngestService(object):
+    """
+    Runs the classify and publish pipeline from a mention source to a request sink,
+    until it is stopped or the source runs out
+    """
+
+    def __init__(self, source, sink, cursor_store, user_resolver, max_queued=MAX_QUEUED_BATCHES,
+                 base_backoff=BASE_BACKOFF_SECONDS, shutdown_timeout=SHUTDOWN_TIMEOUT_SECONDS):
+        """
+        :param source: A mention source, see src.mention_sources
+        :param sink: A request sink, see src.request_sinks
+        :param cursor_store: Where the last published mention is checkpointed, a CursorStore or FileCursorStore
+        :param user_resolver: A UserResolver for the screen names of the authors of mentions
+        :param max_queued: How many fetched batches can wait to be published
+        :param base_backoff: The first wait after a failure, in seconds
+        :param shutdown_timeout: How long a stop waits for the fetched batches to be published
+        """
+        self.source = source
+        self.sink = sink
+        self.cursor_store = cursor_store
+        self.user_resolver = user_resolver
+        self.max_queued = max_queued
+        self.base_backoff = base_backoff
+        self.shutdown_timeout = shutdown_timeout
+        self.checkpoint = None
+        self.published = 0
+        self.stop_requested = False
+        # Made in run(), so it belongs to the loop the service runs on
+        self.stopping = None
+
+    def stop(self):
+        """
+        Stop fetching, and finish once what was already fetched is published. Safe to call
+        from a signal handler on the loop.
+        :return:
+        """
+        LOGGER.info('IngestStopping')
+        self.stop_requested = True
+
+        if self.stopping is not None:
+            self.stopping.set()
+
+    async def run(self):
+        """
+        Run until stopped, or until the source runs out and everything it gave is published
+        :return: The number of requests published
+        """
+        loop = asyncio.get_event_loop()
+        self.stopping = asyncio.Event()
+
+        if self.stop_requested:
+            self.stopping.set()
+
+        self.checkpoint = await loop.run_in_executor(None, self.cursor_store.get)
+        LOGGER.info('IngestStarted', last_processed_tweet_id=self.checkpoint)
+
+        queue = asyncio.Queue(maxsize=self.max_queued)
+        fetching = loop.create_task(self.__fetch(queue, self.checkpoint))
+        publishing = loop.create_task(self.__publish(queue))
+        stopped = loop.create_task(self.stopping.wait())
+
+        try:
+            await asyncio.wait([fetching, publishing, stopped], return_when=asyncio.FIRST_COMPLETED)
+
+            # Publishing only finishes early if it raised, or gave up on a batch while stopping
+            if publishing.done():
+                publishing.result()
+
+            for task in (fetching, stopped):
+                task.cancel()
+            await asyncio.wait([fetching, stopped])
+
+            if not fetching.cancelled() and fetching.exception() is not None:
+                raise fetching.exception()
+
+            # Publish what is queued, then stop at the end marker
+            marker = loop.create_task(queue.put(None))
+            (done, _) = await asyncio.wait([publishing], timeout=self.shutdown_timeout
+                                           if self.stopping.is_set() else None)
+            marker.cancel()
+
+            if publishing in done:
+                publishing.result()
+            else:
+                LOGGER.error('IngestShutdownTimedOut', batches_left=queue.qsize())
+        finally:
+            for task in (fetching, publishing, stopped):
+                task.cancel()
+
+            LOGGER.info('IngestStopped', published=self.published, last_processed_tweet_id=self.checkpoint)
+            INSTRUMENTATION.flush()
+            LOGGER.flush()
+
+        return self.published
+
+    async def __fetch(self, queue, since_id):
+        loop = asyncio.get_event_loop()
+        backoff = self.base_backoff
+
+        while True:
+            try:
+                posts = await self.source.fetch(since_id)
+
+                if posts is None:
+                    LOGGER.info('MentionSourceFinished', last_fetched_tweet_id=since_id)
+                    return
+
+                game_requests = await loop.run_in_executor(None, classify_mentions, posts, self.user_resolver,
+                                                           time.time())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                LOGGER.error('MentionSourceFailed', error=str(e), retry_seconds=backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+                continue
+
+            # A long running process, so nothing waits for the end of an invocation to be written
+            INSTRUMENTATION.flush()
+            LOGGER.flush()
+
+            if len(posts) == 0:
+                backoff = self.base_backoff
+                continue
+
+            # Mentions whose authors could not be looked up are fetched again, once the lookups had time to recover
+            newest_post_id = classified_through(posts, self.user_resolver)
+
+            if newest_post_id is not None:
+                since_id = newest_post_id if since_id is None else max(since_id, newest_post_id)
+                await queue.put((game_requests, newest_post_id))
+
+            if newest_post_id != posts[-1].id:
+                LOGGER.warning('MentionsHeldBack', mentions=len(posts), retry_seconds=backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+            else:
+                backoff = self.base_backoff
+
+    async def __publish(self, queue):
+        while True:
+            batch = await queue.get()
+
+            if batch is None:
+                return
+
+            (game_requests, newest_post_id) = batch
+
+            if not await self.__publish_batch(game_requests):
+                # The checkpoint can not move past a request that was not published, so the rest waits for a restart
+                LOGGER.error('IngestPublishAbandoned', batches_left=queue.qsize())
+                return
+
+            # Mentions that were dropped while classifying are passed over with the rest of the batch
+            await self.__advance(newest_post_id)
+
+    async def __publish_batch(self, game_requests):
+        """
+        Hand a batch to the sink until it took every request, or the service is stopping
+        :return: True if every request was taken
+        """
+        status_ids = [game_request.status_id for game_request in game_requests]
+        acknowledged = set()
+        pending = game_requests
+        backoff = self.base_backoff
+
+        while len(pending) > 0:
+            try:
+                acknowledged.update(await self.sink.publish(pending))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                LOGGER.error('RequestSinkFailed', error=str(e))
+
+            published = len(pending)
+            pending = [game_request for game_request in pending if game_request.status_id not in acknowledged]
+            self.published += published - len(pending)
+
+            if len(pending) == 0:
+                break
+
+            await self.__advance(acknowledged_cursor(status_ids, acknowledged))
+
+            if self.stopping.is_set():
+                return False
+
+            LOGGER.warning('RequestsNotPublished', requests=len(pending), retry_seconds=backoff)
+
+            # Woken early by a stop, for one last attempt
+            try:
+                await asyncio.wait_for(self.stopping.wait(), backoff)
+            except asyncio.TimeoutError:
+                pass
+
+            backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+
+        return True
+
+    async def __advance(self, post_id):
+        if post_id is None or (self.checkpoint is not None and post_id <= self.checkpoint):
+            return
+
+        await asyncio.get_event_loop().run_in_executor(None, self.cursor_store.advance, post_id)
+        self.checkpoint = post_id
+
+
+def build_source(args):
+    from src.mention_sources import PollingSource, ReplaySource, WebhookSource
+
+    if args.source == 'replay':
+        return ReplaySource(args.replay_file, interval=args.replay_interval)
+
+    if args.source == 'webhook':
+        consumer_secret = clients.get_api_credentials()['consumer_secret']
+
+        if not consumer_secret:
+            raise ValueError('CONSUMER_SECRET is needed to check the signatures of webhook events')
+
+        return WebhookSource(consumer_secret)
+
+    return PollingSource(clients.twitter_api())
+
+
+def build_sink(args):
+    from src.dead_letter_queue import DeadLetterQueue
+    from src.request_sinks import GameStateSink, KinesisSink
+    from src.tweet_dispatcher import SharedTokenBucket
+
+    if args.sink == 'kinesis':
+        return KinesisSink(clients.kinesis_client(), os.environ['KINESIS_STREAM'])
+
+    dead_letter_queue_url = os.environ.get('DEAD_LETTER_QUEUE_URL')
+    dead_letters = DeadLetterQueue(clients.sqs_client(), dead_letter_queue_url) if dead_letter_queue_url \
+        else DeadLetterQueue()
+
+    # Shares the status update budget with the deployed functions posting for the same account
+    status_update_table_name = os.environ.get('STATUS_UPDATE_TABLE_NAME')
+    bucket = SharedTokenBucket(clients.dynamodb_table(status_update_table_name)) if status_update_table_name \
+        else None
+
+    if args.sqlite is not None:
+        from src.sqlite_game_store import SqliteGameStore
+        return GameStateSink(clients.twitter_api(), SqliteGameStore(args.sqlite), dead_letters=dead_letters,
+                             bucket=bucket)
+
+    from src.game_store import DynamoGameStore
+    from src.request_ledger import RequestLedger
+
+    game_store = DynamoGameStore(clients.dynamodb_table(os.environ.get('GAME_TABLE_NAME', 'test-twitter-table')),
+                                 clients.dynamodb_table(os.environ.get('ACTIVE_GAME_TABLE_NAME',
+                                                                       'test-active-game-table')),
+                                 clients.dynamodb_table(os.environ.get('HISTORY_TABLE_NAME',
+                                                                       'test-game-history-table')),
+                                 clients.dynamodb_table(os.environ.get('TWEET_INDEX_TABLE_NAME',
+                                                                       'test-tweet-index-table')))
+    ledger = RequestLedger(clients.dynamodb_table(os.environ.get('LEDGER_TABLE_NAME', 'test-request-ledger-table')))
+
+    return GameStateSink(clients.twitter_api(), game_store, ledger=ledger, dead_letters=dead_letters, bucket=bucket)
+
+
+def build_cursor_store(args):
+    if args.cursor_file is not None:
+        return FileCursorStore(args.cursor_file)
+
+    return CursorStore(clients.dynamodb_table(os.environ.get('FEED_TABLE_NAME', 'test-twitter-table')))
+
+
+async def serve(service, source, args):
+    server = None
+
+    if args.source == 'webhook':
+        server = await source.serve(args.host, args.port)
+
+    try:
+        return await service.run()
+    finally:
+        if server is not None:
+            server.close()
+            await server.wait_closed()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Ingest twitter mentions as game requests')
+    parser.add_argument('--source', choices=['poll', 'webhook', 'replay'], default='poll')
+    parser.add_argument('--sink', choices=['kinesis', 'game-state'], default='kinesis')
+    parser.add_argument('--replay-file', help='Tweets to replay, one JSON object per line')
+    parser.add_argument('--replay-interval', type=float, default=0, help='Seconds between replayed batches')
+    parser.add_argument('--host', default='0.0.0.0', help='The webhook host')
+    parser.add_argument('--port', type=int, default=8080, help='The webhook port')
+    parser.add_argument('--cursor-file', help='Checkpoint to a local file instead of the feed table')
+    parser.add_argument('--sqlite', help='Keep games in this SQLite database, with the game-state sink')
+    args = parser.parse_args(argv[1:])
+
+    if args.source == 'replay' and args.replay_file is None:
+        parser.error('--replay-file is needed to replay mentions')
+
+    source = build_source(args)
+    service = IngestService(source, build_sink(args), build_cursor_store(args), UserResolver(clients.twitter_api()))
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signal_number, service.stop)
+
+    try:
+        loop.run_until_complete(serve(service, source, args))
+    finally:
+        loop.close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,240 @@
+"""
+Timing, outcome and retry counters for every call made to twitter, dynamo and kinesis.
+
+Calls are recorded by a process wide Instrumentation, and reported through a sink when
+a handler flushes it at the end of an invocation. In lambda the sink writes CloudWatch
+Embedded Metric Format lines, locally it does nothing. If the X-Ray SDK is installed
+and lambda tracing is active, each call is also wrapped in a named subsegment.
+"""
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+from src.metrics import put_metrics
+
+# EMF accepts up to 100 values for a single metric on one line
+MAX_LATENCY_SAMPLES = 100
+
+
+class CallStats(object):
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.latencies = []
+
+    def add(self, elapsed_ms, failed, retries):
+        self.calls += 1
+        self.errors += 1 if failed else 0
+        self.retries += retries
+
+        if len(self.latencies) < MAX_LATENCY_SAMPLES:
+            self.latencies.append(elapsed_ms)
+
+
+class NoopSink(object):
+    def emit(self, stats):
+        pass
+
+
+class EmfSink(object):
+    """
+    Writes one pair of EMF lines per dependency operation
+    """
+
+    def emit(self, stats):
+        for ((dependency, operation), call_stats) in sorted(stats.items()):
+            dimensions = {'Dependency': dependency, 'Operation': operation}
+
+            put_metrics({'Calls': call_stats.calls,
+                         'Errors': call_stats.errors,
+                         'Retries': call_stats.retries}, dimensions=dimensions)
+            put_metrics({'Latency': call_stats.latencies}, unit='Milliseconds', dimensions=dimensions)
+
+
+class Instrumentation(object):
+    """
+    Records calls to external dependencies, keyed by (dependency, operation)
+    """
+
+    def __init__(self, sink=None, tracer=None, clock=time.time):
+        self.sink = sink or NoopSink()
+        self.tracer = tracer
+        self.clock = clock
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def track(self, dependency, operation):
+        """
+        Time the block as a single call
+        :param dependency: e.g. 'Twitter'
+        :param operation: e.g. 'PostUpdate'
+        :return:
+        """
+        started = self.__begin(dependency, operation)
+        failed = True
+
+        try:
+            yield
+            failed = False
+        finally:
+            self.__end(dependency, operation, started, failed)
+
+    def record(self, dependency, operation, elapsed_ms, failed=False, retries=0):
+        with self.lock:
+            self.stats.setdefault((dependency, operation), CallStats()).add(elapsed_ms, failed, retries)
+
+    def wrap(self, target, dependency):
+        """
+        Wrap an api object so every method called on it is recorded
+        :param target: e.g. a twitter.Api
+        :param dependency: The name the calls are recorded under
+        :return: An InstrumentedApi
+        """
+        return InstrumentedApi(target, dependency, self)
+
+    def instrument_boto(self, client, dependency):
+        """
+        Record every call a botocore client makes. Retries made inside botocore are
+        counted from the response metadata. Instrumenting a client twice has no effect.
+        :param client: A botocore client, e.g. table.meta.client
+        :param dependency: The name the calls are recorded under
+        :return: The client
+        """
+        events = client.meta.events
+        unique_id = 'samquest-instrumentation-' + dependency
+
+        events.register('before-parameter-build', self.__name_boto_call, unique_id=unique_id + '-name')
+        events.register('before-call', self.__before_boto_call(dependency), unique_id=unique_id + '-before')
+        events.register('after-call', self.__after_boto_call(dependency), unique_id=unique_id + '-after')
+        events.register('after-call-error', self.__after_boto_error(dependency), unique_id=unique_id + '-error')
+
+        return client
+
+    def flush(self):
+        """
+        Report everything recorded since the last flush
+        :return: The stats that were reported
+        """
+        with self.lock:
+            (stats, self.stats) = (self.stats, {})
+
+        if len(stats) > 0:
+            self.sink.emit(stats)
+
+        return stats
+
+    def __begin(self, dependency, operation):
+        if self.__tracing():
+            self.tracer.begin_subsegment('{}.{}'.format(dependency, operation))
+
+        return self.clock()
+
+    def __end(self, dependency, operation, started, failed, retries=0):
+        self.record(dependency, operation, (self.clock() - started) * 1000, failed, retries)
+
+        if self.__tracing():
+            self.tracer.end_subsegment()
+
+    def __tracing(self):
+        # The lambda segment only exists on the invoking thread, calls from worker threads are only timed
+        return self.tracer is not None and threading.current_thread() is threading.main_thread()
+
+    @staticmethod
+    def __name_boto_call(model, params, context, **kwargs):
+        # Only the api parameters carry the index name, the request seen by before-call is serialized
+        context['samquest_operation'] = boto_operation(model, params)
+
+    def __before_boto_call(self, dependency):
+        def handler(model, context, **kwargs):
+            context.setdefault('samquest_operation', model.name)
+            context['samquest_started'] = self.__begin(dependency, context['samquest_operation'])
+
+        return handler
+
+    def __after_boto_call(self, dependency):
+        def handler(parsed, context, **kwargs):
+            if 'samquest_started' not in context:
+                return
+
+            retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+            self.__end(dependency, context['samquest_operation'], context.pop('samquest_started'),
+                       'Error' in parsed, retries)
+
+        return handler
+
+    def __after_boto_error(self, dependency):
+        def handler(context, **kwargs):
+            if 'samquest_started' in context:
+                self.__end(dependency, context['samquest_operation'], context.pop('samquest_started'), True)
+
+        return handler
+
+
+class InstrumentedApi(object):
+    """
+    Proxies an api object, recording each method call made through it
+    """
+
+    def __init__(self, target, dependency, instrumentation):
+        self._target = target
+        self._dependency = dependency
+        self._instrumentation = instrumentation
+
+    def __getattr__(self, name):
+        attribute = getattr(self._target, name)
+
+        if not callable(attribute) or name.startswith('_'):
+            return attribute
+
+        def call(*args, **kwargs):
+            with self._instrumentation.track(self._dependency, name):
+                return attribute(*args, **kwargs)
+
+        return call
+
+
+def boto_operation(model, params):
+    """
+    The name a boto call is recorded under. Queries are split out by index, so GSI
+    queries can be told apart from queries on the table.
+    :param model: The botocore operation model
+    :param params: The request parameters
+    :return:
+    """
+    if params.get('IndexName') is not None:
+        return '{}.{}'.format(model.name, params['IndexName'])
+
+    return model.name
+
+
+def default_sink():
+    """
+    EMF in lambda, nothing anywhere else. METRICS_SINK=emf|none overrides the choice.
+    :return:
+    """
+    sink = os.environ.get('METRICS_SINK', 'emf' if 'AWS_LAMBDA_FUNCTION_NAME' in os.environ else 'none')
+
+    return EmfSink() if sink == 'emf' else NoopSink()
+
+
+def default_tracer():
+    """
+    The X-Ray recorder, if the SDK is installed and lambda tracing is active
+    :return: The recorder, or None
+    """
+    if 'AWS_XRAY_DAEMON_ADDRESS' not in os.environ:
+        return None
+
+    try:
+        from aws_xray_sdk.core import xray_recorder
+    except ImportError:
+        return None
+
+    return xray_recorder
+
+
+# Shared by every client in the process, flushed by the handlers
+INSTRUMENTATION = Instrumentation(default_sink(), default_tracer())
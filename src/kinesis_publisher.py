@@ -0,0 +1,130 @@
+import random
+from time import sleep
+
+from botocore.exceptions import ClientError
+
+from src.logger import LOGGER
+
+# Kinesis PutRecords limits
+MAX_RECORDS_PER_REQUEST = 500
+MAX_BYTES_PER_REQUEST = 5 * 1024 * 1024
+
+MAX_ATTEMPTS = 5
+BASE_BACKOFF_SECONDS = 0.1
+
+
+class KinesisPublisher(object):
+    """
+    Buffers records for a kinesis stream and publishes them with PutRecords.
+
+    Records are flushed in chunks of at most 500 records or 5 MB. Entries that
+    kinesis rejects (throttling, internal errors) are retried on their own with
+    an exponential backoff, so a partially failed request never re-sends the
+    records that were already accepted.
+    """
+
+    def __init__(self, kinesis_client, stream_name, max_attempts=MAX_ATTEMPTS,
+                 base_backoff=BASE_BACKOFF_SECONDS):
+        self.kinesis_client = kinesis_client
+        self.stream_name = stream_name
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.pending = []
+
+    def add(self, record_id, data, partition_key):
+        """
+        Buffer a record to be sent on the next flush.
+        :param record_id: An id used to report back which records were acknowledged
+        :param data: The record payload
+        :param partition_key: The kinesis partition key for the record
+        :return:
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        self.pending.append((record_id, {'Data': data, 'PartitionKey': partition_key}))
+
+    def flush(self):
+        """
+        Send all buffered records to kinesis.
+        :return: The set of record ids that kinesis acknowledged
+        """
+        acknowledged = set()
+
+        for chunk in self.__chunks(self.pending):
+            acknowledged.update(self.__put_with_retry(chunk))
+
+        failed_count = len(self.pending) - len(acknowledged)
+        if failed_count > 0:
+            LOGGER.error('KinesisPublishFailed', records=failed_count)
+
+        self.pending = []
+
+        return acknowledged
+
+    def __chunks(self, records):
+        chunk = []
+        chunk_size = 0
+
+        for record in records:
+            entry = record[1]
+            entry_size = len(entry['Data']) + len(entry['PartitionKey'].encode('utf-8'))
+
+            if len(chunk) == MAX_RECORDS_PER_REQUEST or chunk_size + entry_size > MAX_BYTES_PER_REQUEST:
+                yield chunk
+                chunk = []
+                chunk_size = 0
+
+            chunk.append(record)
+            chunk_size += entry_size
+
+        if len(chunk) > 0:
+            yield chunk
+
+    def __put_with_retry(self, chunk):
+        acknowledged = []
+        remaining = chunk
+
+        for attempt in range(self.max_attempts):
+            if attempt > 0:
+                sleep(random.uniform(0, self.base_backoff * (2 ** attempt)))
+
+            try:
+                response = self.kinesis_client.put_records(StreamName=self.stream_name,
+                                                           Records=[entry for (_, entry) in remaining])
+            except ClientError as e:
+                LOGGER.error('KinesisPutRecordsFailed', error=str(e))
+                continue
+
+            failed = []
+            for (record, result) in zip(remaining, response['Records']):
+                if 'ErrorCode' in result:
+                    failed.append(record)
+                else:
+                    acknowledged.append(record[0])
+
+            if len(failed) == 0:
+                break
+
+            LOGGER.warning('KinesisRecordsRejected', rejected=len(failed), records=len(remaining))
+            remaining = failed
+
+        return acknowledged
+
+
+def acknowledged_cursor(record_ids, acknowledged):
+    """
+    Find the highest record id that the cursor can safely move to. Every record
+    up to and including the returned id has been acknowledged.
+    :param record_ids: All of the record ids that were published
+    :param acknowledged: The record ids that kinesis acknowledged
+    :return: The new cursor position, or None if it cannot move
+    """
+    cursor = None
+
+    for record_id in sorted(record_ids):
+        if record_id not in acknowledged:
+            break
+        cursor = record_id
+
+    return cursor
@@ -0,0 +1,138 @@
+from concurrent.futures import wait
+import threading
+import time
+
+from src.metrics import put_metrics
+
+# Upper bound of each histogram bucket, in seconds. The last bucket catches everything slower.
+BUCKET_BOUNDS = (0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, float('inf'))
+
+# EMF takes at most this many values in the array of a metric
+MAX_EMF_VALUES = 100
+
+# Each stage runs from the first timestamp to the second
+STAGES = (
+    ('TwitterDelay', 'created_at', 'ingested_at'),
+    ('PollDelay', 'ingested_at', 'arrived_at'),
+    ('StreamLag', 'arrived_at', 'started_at'),
+    ('Processing', 'started_at', 'replied_at'),
+    ('Total', 'created_at', 'replied_at')
+)
+
+
+class LatencyHistogram(object):
+    """
+    Counts of latencies per (request type, stage), in fixed buckets
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def add(self, request_type, stage, seconds):
+        bucket = next(index for (index, bound) in enumerate(BUCKET_BOUNDS) if seconds <= bound)
+
+        with self.lock:
+            counts = self.counts.setdefault((request_type, stage), [0] * len(BUCKET_BOUNDS))
+            counts[bucket] += 1
+
+    def emit(self):
+        """
+        Write the histogram as EMF lines per request type and stage, each with an array of
+        at most MAX_EMF_VALUES latencies. Each latency is reported at the upper bound of its
+        bucket, the overflow bucket at the bound below it.
+        :return:
+        """
+        with self.lock:
+            (counts, self.counts) = (self.counts, {})
+
+        for ((request_type, stage), bucket_counts) in sorted(counts.items()):
+            values = []
+
+            for (index, count) in enumerate(bucket_counts):
+                values.extend([BUCKET_BOUNDS[min(index, len(BUCKET_BOUNDS) - 2)]] * count)
+
+            for start in range(0, len(values), MAX_EMF_VALUES):
+                put_metrics({'RequestLatency': values[start:start + MAX_EMF_VALUES]}, unit='Seconds',
+                            dimensions={'RequestType': request_type, 'Stage': stage})
+
+
+class LatencyTracker(object):
+    """
+    Tracks how long players wait for a reply to each request in a batch, from the tweet
+    being created to the reply being posted.
+
+    The first reply posted while handling a request is the one the player sees.
+    Requests that get no reply, such as a vote that does not close a round, are not
+    counted.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.started_at = clock()
+        self.histogram = LatencyHistogram()
+        self.replied = set()
+        self.futures = []
+        self.lock = threading.Lock()
+
+    def watch(self, game_request, dispatcher):
+        """
+        Get a dispatcher that records when the first reply for a request is posted
+        :param game_request:
+        :param dispatcher: The dispatcher replies are posted through
+        :return: A dispatcher for handling this request
+        """
+        return LatencyDispatcher(self, game_request, dispatcher)
+
+    def reply_posted(self, game_request):
+        with self.lock:
+            if game_request.status_id in self.replied:
+                return
+
+            self.replied.add(game_request.status_id)
+
+        timestamps = {
+            'created_at': game_request.created_at,
+            'ingested_at': game_request.ingested_at,
+            'arrived_at': game_request.arrived_at,
+            'started_at': self.started_at,
+            'replied_at': self.clock()
+        }
+
+        for (stage, start, end) in STAGES:
+            if timestamps[start] is not None and timestamps[end] is not None:
+                self.histogram.add(game_request.request_type, stage,
+                                   max(0, float(timestamps[end]) - float(timestamps[start])))
+
+    def emit(self):
+        """
+        Wait for the replies that are still being posted, then write the histogram
+        :return:
+        """
+        wait(self.futures)
+        self.histogram.emit()
+
+
+class LatencyDispatcher(object):
+    """
+    Posts through another dispatcher, and tells the tracker when a reply went out. The
+    futures of the replies posted for the request are kept in futures.
+    """
+
+    def __init__(self, tracker, game_request, dispatcher):
+        self.tracker = tracker
+        self.game_request = game_request
+        self.dispatcher = dispatcher
+        self.futures = []
+
+    def post(self, status, in_reply_to_status_id=None):
+        future = self.dispatcher.post(status, in_reply_to_status_id=in_reply_to_status_id)
+        future.add_done_callback(self.__posted)
+        self.tracker.futures.append(future)
+        self.futures.append(future)
+
+        return future
+
+    def __posted(self, future):
+        if future.exception() is None and future.result() != False:
+            self.tracker.reply_posted(self.game_request)
@@ -0,0 +1,130 @@
+"""
+A structured logger for the handlers.
+
+Each entry is a JSON line with a level, an event name and its fields. Entries are
+buffered and written in one go when the handler flushes at the end of an invocation,
+instead of one write per line. Entries below LOG_LEVEL are dropped before they are
+formatted, and chatty events can be sampled per event name. Warnings and errors are
+never sampled.
+
+LOG_LEVEL sets the level (DEBUG, INFO, WARNING or ERROR, INFO by default), and
+LOG_SAMPLE_RATES overrides the sample rates, e.g. 'RequestReceived=0.1,GameSaved=1'.
+"""
+import atexit
+import json
+import os
+import random
+import sys
+import threading
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+
+# The fraction of entries kept for events that are logged once per request
+DEFAULT_SAMPLE_RATES = {
+    'MentionClassified': 0.1,
+    'RequestReceived': 0.1,
+    'ReplyPosted': 0.1
+}
+
+# Written early if an invocation logs more than this
+MAX_BUFFERED_ENTRIES = 1000
+
+
+class Logger(object):
+
+    def __init__(self, level=INFO, sample_rates=None, stream=None, sample=random.random):
+        self.level = level
+        self.sample_rates = DEFAULT_SAMPLE_RATES if sample_rates is None else sample_rates
+        self.stream = stream
+        self.sample = sample
+        self.buffer = []
+        self.lock = threading.Lock()
+
+    def is_enabled(self, level):
+        return level >= self.level
+
+    def debug(self, event, **fields):
+        self.log(DEBUG, event, **fields)
+
+    def info(self, event, **fields):
+        self.log(INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self.log(WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.log(ERROR, event, **fields)
+
+    def log(self, level, event, **fields):
+        """
+        Buffer an entry
+        :param level: The level of the entry
+        :param event: The name of the event, used for sampling
+        :param fields: Values logged with the event. They must be JSON serializable, or have a str().
+        :return:
+        """
+        if level < self.level:
+            return
+
+        if level < WARNING and self.sample() >= self.sample_rates.get(event, 1):
+            return
+
+        entry = {'level': LEVEL_NAMES[level], 'event': event}
+        entry.update(fields)
+        line = json.dumps(entry, default=str)
+
+        with self.lock:
+            self.buffer.append(line)
+            full = len(self.buffer) >= MAX_BUFFERED_ENTRIES
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Write every buffered entry
+        :return:
+        """
+        with self.lock:
+            (lines, self.buffer) = (self.buffer, [])
+
+        if len(lines) > 0:
+            stream = self.stream or sys.stdout
+            stream.write('\n'.join(lines) + '\n')
+            stream.flush()
+
+
+def parse_sample_rates(value):
+    """
+    :param value: e.g. 'RequestReceived=0.1,GameSaved=1'
+    :return: A dict of event name -> sample rate
+    """
+    rates = dict(DEFAULT_SAMPLE_RATES)
+
+    for pair in value.split(','):
+        if '=' in pair:
+            (event, rate) = pair.split('=', 1)
+            rates[event.strip()] = float(rate)
+
+    return rates
+
+
+def level_from_name(name):
+    for (level, level_name) in LEVEL_NAMES.items():
+        if level_name == name.upper():
+            return level
+
+    return INFO
+
+
+# Shared by every module in the process, flushed by the handlers
+LOGGER = Logger(level=level_from_name(os.environ.get('LOG_LEVEL', 'INFO')),
+                sample_rates=parse_sample_rates(os.environ.get('LOG_SAMPLE_RATES', '')))
+
+# Local runs and tests do not go through a handler, so write whatever is left on exit
+atexit.register(LOGGER.flush)
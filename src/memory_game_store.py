@@ -0,0 +1,151 @@
+import copy
+import threading
+import time
+
+from src.game_store import CREATOR_CLAIM_LEASE_SECONDS, GameStore, vote_is_allowed
+from src.models import GameSession, GameState
+
+
+class InMemoryGameStore(GameStore):
+    """
+    Keeps game sessions in process, indexed by start tweet and creator, with the history
+    of each game and the tweets posted for it kept beside it.
+
+    Sessions are stored as copies of their dicts, so callers only see the stored state
+    through the lookups, the same as with the other stores. Meant for tests, benchmarks
+    and local runs.
+    """
+
+    def __init__(self):
+        self.games = {}
+        self.by_creator = {}
+        # Tweet id -> tweet start id of the game it was posted for
+        self.tweets = {}
+        # Creator -> (bound tweet start id, or None while pending, lease expiry)
+        self.active_creators = {}
+        # Tweet start id -> step number -> step
+        self.history = {}
+        self.lock = threading.Lock()
+
+    def get_by_start_tweet(self, tweet_start_id):
+        with self.lock:
+            item = self.games.get(int(tweet_start_id))
+
+            return None if item is None else self.__to_session(item)
+
+    def get_by_tweet(self, status_id):
+        with self.lock:
+            tweet_start_id = self.tweets.get(int(status_id))
+
+            return None if tweet_start_id is None else self.__to_session(self.games[tweet_start_id])
+
+    def get_active_by_creator(self, user):
+        with self.lock:
+            return [self.__to_session(self.games[tweet_start_id])
+                    for tweet_start_id in self.by_creator.get(user, ())
+                    if self.games[tweet_start_id].get('GameState') != str(GameState.GAME_COMPLETE)]
+
+    def get_expired(self, now):
+        with self.lock:
+            return [self.__to_session(item) for item in self.games.values()
+                    if item.get('ExpiryShard') is not None and int(item.get('ExpirationTime', now)) < now]
+
+    def claim_creator(self, user, now=None):
+        now = int(time.time() if now is None else now)
+
+        with self.lock:
+            claim = self.active_creators.get(user)
+
+            if claim is not None and (claim[0] is not None or claim[1] >= now):
+                return False
+
+            self.active_creators[user] = (None, now + CREATOR_CLAIM_LEASE_SECONDS)
+
+        return True
+
+    def bind_creator(self, user, tweet_start_id):
+        with self.lock:
+            self.active_creators[user] = (int(tweet_start_id), None)
+
+    def release_creator(self, user, tweet_start_id=None):
+        with self.lock:
+            claim = self.active_creators.get(user)
+
+            if claim is not None and (tweet_start_id is None or claim[0] == int(tweet_start_id)):
+                del self.active_creators[user]
+
+    def get_history(self, tweet_start_id):
+        with self.lock:
+            steps = self.history.get(int(tweet_start_id), {})
+
+            return [copy.deepcopy(steps[step_number]) for step_number in sorted(steps)]
+
+    def record_vote(self, game_session, voter, option):
+        with self.lock:
+            item = self.games.get(int(game_session.TweetStartId))
+
+            if item is None or not vote_is_allowed(item, game_session.CurrentTweetId, voter, option):
+                return False
+
+            item['CurrentVotes'][option] += 1
+            item['CurrentVoters'] = set(item.get('CurrentVoters') or ()) | {voter}
+
+            game_session.CurrentVotes = copy.deepcopy(item['CurrentVotes'])
+            game_session.CurrentVoters = set(item['CurrentVoters'])
+
+        game_session.MarkSaved(['CurrentVotes', 'CurrentVoters'])
+
+        return True
+
+    def _insert(self, game_session):
+        with self.lock:
+            if int(game_session.TweetStartId) in self.games:
+                return False
+
+            self.__put(copy.deepcopy(game_session.AsDict()))
+
+        return True
+
+    def _update(self, game_session, saved, next_version):
+        with self.lock:
+            tweet_start_id = int(game_session.TweetStartId)
+            stored = self.games.get(tweet_start_id)
+
+            if stored is None or stored.get('Version') != saved.get('Version'):
+                return False
+
+            item = copy.deepcopy(game_session.AsDict())
+            item['Version'] = next_version
+
+            self.__remove(tweet_start_id)
+            self.__put(item)
+
+        return True
+
+    def _append_steps(self, tweet_start_id, steps, tweet_ids):
+        with self.lock:
+            history = self.history.setdefault(int(tweet_start_id), {})
+
+            for step in steps:
+                history[step['StepNumber']] = copy.deepcopy(step)
+
+            for tweet_id in tweet_ids:
+                self.tweets[int(tweet_id)] = int(tweet_start_id)
+
+    def __put(self, item):
+        tweet_start_id = int(item['TweetStartId'])
+        self.games[tweet_start_id] = item
+
+        self.by_creator.setdefault(item.get('GameCreator'), set()).add(tweet_start_id)
+
+    def __remove(self, tweet_start_id):
+        item = self.games.pop(tweet_start_id)
+
+        self.by_creator.get(item.get('GameCreator'), set()).discard(tweet_start_id)
+
+    @staticmethod
+    def __to_session(item):
+        game_session = GameSession.NewFromJsonDict(copy.deepcopy(item))
+        game_session.MarkSaved()
+
+        return game_session
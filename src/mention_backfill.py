@@ -0,0 +1,51 @@
+from src.logger import LOGGER
+
+# Twitter returns at most 200 mentions per page, and only serves the 800 most recent
+PAGE_SIZE = 200
+MAX_FETCH_PAGES = 4
+
+# How many pages of mentions a single poll processes. Anything beyond is left for the next poll.
+DEFAULT_MAX_PAGES = 2
+
+
+def iter_mentions(twitter_api, since_id, max_pages=DEFAULT_MAX_PAGES, stats=None):
+    """
+    Yield every mention newer than since_id, oldest first.
+
+    Twitter pages mentions newest first, so this pages backwards with max_id until it
+    reaches since_id, then yields the oldest max_pages pages worth of mentions. Because
+    mentions come out oldest first, the cursor can be moved forward after each one, and
+    a backlog larger than max_pages drains over several polls.
+    :param twitter_api: The twitter api
+    :param since_id: The id of the last processed mention, or None
+    :param max_pages: The maximum number of pages of mentions to yield
+    :param stats: An optional dict. 'Pages' is set to the number of mentions pages fetched, for the poll planner.
+    :return:
+    """
+    mentions = {}
+    max_id = None
+
+    for page_number in range(MAX_FETCH_PAGES):
+        page = twitter_api.GetMentions(count=PAGE_SIZE, since_id=since_id, max_id=max_id)
+
+        if stats is not None:
+            stats['Pages'] = page_number + 1
+
+        for post in page:
+            mentions[post.id] = post
+
+        if len(page) < PAGE_SIZE:
+            break
+
+        max_id = min(post.id for post in page) - 1
+    else:
+        if since_id is not None:
+            LOGGER.warning('MentionsLost', since_id=since_id)
+
+    oldest_first = sorted(mentions)
+
+    if len(oldest_first) > max_pages * PAGE_SIZE:
+        LOGGER.warning('MentionsBacklogged', waiting=len(oldest_first), processing=max_pages * PAGE_SIZE)
+
+    for post_id in oldest_first[:max_pages * PAGE_SIZE]:
+        yield mentions[post_id]
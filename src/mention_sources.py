@@ -0,0 +1,285 @@
+"""
+Where the ingest service reads mentions from.
+
+A source is asked for mentions with fetch(since_id). It waits until there are new
+mentions and returns them oldest first. It returns an empty list when a wait ended with
+nothing new, and None once it has nothing more to give. Blocking twitter calls run on
+the event loop's executor, so fetching never holds up the publishing of what was
+already fetched.
+"""
+import asyncio
+import base64
+import bisect
+from collections import OrderedDict
+import hashlib
+import hmac
+from http import HTTPStatus
+import json
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from twitter.error import TwitterError
+from twitter.models import Status
+
+from src.logger import LOGGER
+from src.mention_backfill import PAGE_SIZE, iter_mentions
+from src.metrics import put_metrics
+from src.poll_planner import MENTIONS_URL, plan_next_poll
+
+# Pushed mentions are handed out in batches of at most this many
+MAX_WEBHOOK_BATCH = PAGE_SIZE
+
+# Ids of the most recently pushed mentions, for dropping events twitter delivers twice
+MAX_REMEMBERED_MENTIONS = 10000
+
+MAX_WEBHOOK_BODY_BYTES = 1024 * 1024
+
+SIGNATURE_HEADER = 'x-twitter-webhooks-signature'
+
+
+class PollingSource(object):
+    """
+    Polls the mentions timeline, as often as the twitter rate limit budget allows
+    """
+
+    def __init__(self, twitter_api, planner=plan_next_poll, clock=time.time):
+        """
+        :param twitter_api: The twitter api
+        :param planner: Works out the seconds to wait before the next poll, from the twitter api and the
+        calls_per_poll the last poll made
+        :param clock:
+        """
+        self.twitter_api = twitter_api
+        self.planner = planner
+        self.clock = clock
+        self.last_poll_time = None
+        self.planned_interval = None
+        self.next_poll_time = 0
+
+    async def fetch(self, since_id):
+        loop = asyncio.get_event_loop()
+        wait = self.next_poll_time - self.clock()
+
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        poll_time = self.clock()
+
+        if self.last_poll_time is not None:
+            put_metrics({'PlannedPollInterval': self.planned_interval,
+                         'ActualPollInterval': poll_time - self.last_poll_time}, unit='Seconds')
+
+        stats = {}
+        posts = await loop.run_in_executor(None, self.__poll, since_id, stats)
+
+        calls_per_poll = {MENTIONS_URL: stats.get('Pages', 0)}
+        self.planned_interval = await loop.run_in_executor(
+            None, lambda: self.planner(self.twitter_api, calls_per_poll=calls_per_poll))
+        self.last_poll_time = poll_time
+        self.next_poll_time = poll_time + self.planned_interval
+
+        return posts
+
+    def __poll(self, since_id, stats):
+        try:
+            return list(iter_mentions(self.twitter_api, since_id, stats=stats))
+        except TwitterError as e:
+            if 'Rate limit exceeded' in str(e.message):
+                # The planner waits for the reset time twitter reported
+                LOGGER.warning('TwitterRateLimited')
+            else:
+                LOGGER.error('TwitterError', error=str(e))
+
+            return []
+
+
+class WebhookSource(object):
+    """
+    Receives the mentions twitter pushes through the Account Activity API, either from
+    the HTTP server started by serve(), or handed to receive() by another web server.
+
+    Twitter checks the webhook with a challenge response check (CRC), and signs every
+    event it posts, both with the app's consumer secret. Pushed mentions are only kept in
+    memory, so mentions pushed while the service is down are not seen by this source.
+    since_id is not used, as events can arrive out of order.
+    """
+
+    def __init__(self, consumer_secret, max_batch=MAX_WEBHOOK_BATCH, max_remembered=MAX_REMEMBERED_MENTIONS):
+        self.consumer_secret = consumer_secret
+        self.max_batch = max_batch
+        self.max_remembered = max_remembered
+        self.seen = OrderedDict()
+        self.queue = None
+
+    def receive(self, payload):
+        """
+        Queue the mentions in an Account Activity event
+        :param payload: The event, as a dict
+        :return: The number of mentions queued
+        """
+        queued = 0
+
+        for tweet in payload.get('tweet_create_events', ()):
+            post = Status.NewFromJsonDict(tweet)
+
+            # The account's own tweets, such as the replies to players, are sent as well
+            if post.user is not None and str(post.user.id) == str(payload.get('for_user_id')):
+                continue
+
+            if post.id in self.seen:
+                continue
+
+            self.seen[post.id] = True
+            while len(self.seen) > self.max_remembered:
+                self.seen.popitem(last=False)
+
+            self.__queue().put_nowait(post)
+            queued += 1
+
+        return queued
+
+    async def fetch(self, since_id):
+        queue = self.__queue()
+        posts = [await queue.get()]
+
+        while not queue.empty() and len(posts) < self.max_batch:
+            posts.append(queue.get_nowait())
+
+        return sorted(posts, key=lambda post: post.id)
+
+    def sign(self, message):
+        """
+        :param message: The bytes to sign
+        :return: The signature, the way twitter sends it
+        """
+        digest = hmac.new(self.consumer_secret.encode('utf-8'), message, hashlib.sha256).digest()
+
+        return 'sha256=' + base64.b64encode(digest).decode('ascii')
+
+    async def serve(self, host, port):
+        """
+        Start an HTTP server for twitter to push events to
+        :param host:
+        :param port:
+        :return: The asyncio server. The caller closes it.
+        """
+        server = await asyncio.start_server(self.__handle_connection, host, port)
+        LOGGER.info('WebhookListening', host=host, port=port)
+
+        return server
+
+    async def __handle_connection(self, reader, writer):
+        try:
+            (method, target, headers, body) = await read_http_request(reader)
+            (status, response) = self.__respond(method, target, headers, body)
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            (status, response) = (HTTPStatus.BAD_REQUEST, {'error': str(e)})
+
+        if status != HTTPStatus.OK:
+            LOGGER.warning('WebhookRequestRejected', status=int(status))
+
+        body = json.dumps(response).encode('utf-8')
+        writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n'
+                     'Connection: close\r\n\r\n'.format(int(status), status.phrase, len(body)).encode('ascii') + body)
+
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    def __respond(self, method, target, headers, body):
+        if method == 'GET':
+            crc_token = parse_qs(urlsplit(target).query).get('crc_token')
+
+            if crc_token is None:
+                return HTTPStatus.BAD_REQUEST, {'error': 'crc_token is missing'}
+
+            return HTTPStatus.OK, {'response_token': self.sign(crc_token[0].encode('utf-8'))}
+
+        if method == 'POST':
+            if not hmac.compare_digest(headers.get(SIGNATURE_HEADER, '').encode('latin-1'),
+                                       self.sign(body).encode('ascii')):
+                return HTTPStatus.FORBIDDEN, {'error': 'bad signature'}
+
+            return HTTPStatus.OK, {'queued': self.receive(json.loads(body.decode('utf-8')))}
+
+        return HTTPStatus.METHOD_NOT_ALLOWED, {'error': 'method not allowed'}
+
+    def __queue(self):
+        # Made on first use, so it belongs to the loop the service runs on
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+
+        return self.queue
+
+
+class ReplaySource(object):
+    """
+    Replays mentions from a file of tweets, one JSON object per line in the format the
+    twitter api returns them, for local runs and load tests. Mentions come out oldest
+    first, a page of the mentions timeline at a time.
+    """
+
+    def __init__(self, path, batch_size=PAGE_SIZE, interval=0):
+        """
+        :param path: The file of tweets
+        :param batch_size: How many mentions each fetch returns
+        :param interval: Seconds to wait between fetches
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self.posts = None
+        self.post_ids = None
+
+    async def fetch(self, since_id):
+        if self.posts is None:
+            self.posts = await asyncio.get_event_loop().run_in_executor(None, self.__read)
+            self.post_ids = [post.id for post in self.posts]
+        elif self.interval > 0:
+            await asyncio.sleep(self.interval)
+
+        start = 0 if since_id is None else bisect.bisect_right(self.post_ids, since_id)
+        batch = self.posts[start:start + self.batch_size]
+
+        return batch if len(batch) > 0 else None
+
+    def __read(self):
+        with open(self.path) as replay_file:
+            posts = [Status.NewFromJsonDict(json.loads(line)) for line in replay_file if line.strip()]
+
+        LOGGER.info('ReplayLoaded', path=self.path, mentions=len(posts))
+
+        return sorted(posts, key=lambda post: post.id)
+
+
+async def read_http_request(reader):
+    """
+    Read a single HTTP/1.1 request
+    :param reader: The asyncio stream reader of the connection
+    :return: The method, the request target, a dict of lower cased header name -> value, and the body
+    """
+    request_line = (await reader.readline()).decode('latin-1').split()
+
+    if len(request_line) != 3:
+        raise ValueError('bad request line')
+
+    headers = {}
+
+    while True:
+        line = (await reader.readline()).decode('latin-1').strip()
+
+        if line == '':
+            break
+
+        (name, _, value) = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get('content-length', 0))
+
+    if length > MAX_WEBHOOK_BODY_BYTES:
+        raise ValueError('body too large')
+
+    body = await reader.readexactly(length) if length > 0 else b''
+
+    return request_line[0].upper(), request_line[1], headers, body
@@ -0,0 +1,32 @@
+import json
+import time
+
+NAMESPACE = 'SAMQuest'
+
+
+def put_metrics(values, unit='Count', dimensions=None):
+    """
+    Emit metrics as a CloudWatch Embedded Metric Format log line. Lambda ships
+    the line to CloudWatch Logs, which extracts the metrics from it.
+    :param values: A dict of metric name -> value
+    :param unit: The CloudWatch unit for all of the values
+    :param dimensions: An optional dict of dimension name -> value
+    :return:
+    """
+    dimensions = dimensions or {}
+
+    line = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': NAMESPACE,
+                'Dimensions': [list(dimensions.keys())],
+                'Metrics': [{'Name': name, 'Unit': unit} for name in values]
+            }]
+        }
+    }
+
+    line.update(dimensions)
+    line.update(values)
+
+    print(json.dumps(line))
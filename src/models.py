@@ -1,6 +1,21 @@
+import copy
+
 from twitter.models import TwitterModel
 from enum import Enum
 
+# How long a game stays open without a new step before the sweeper ends it
+GAME_LIFETIME_SECONDS = 8 * 60 * 60
+
+# How long a complete game is kept before DynamoDB TTL deletes it
+COMPLETED_GAME_RETENTION_SECONDS = 7 * 24 * 60 * 60
+
+# Open games are spread over this many partitions of the expiring games index, numbered
+# from 1 since AsDict leaves out falsy values
+EXPIRY_SHARDS = 4
+
+# How long step history is kept before DynamoDB TTL deletes it
+HISTORY_RETENTION_SECONDS = 30 * 24 * 60 * 60
+
 class GameRequest(TwitterModel):
     def __init__(self, **kwargs):
         self.param_defaults = {
@@ -9,12 +24,27 @@ class GameRequest(TwitterModel):
             'status_id': None,
             'in_reply_to_status_id': None,
             'request_type': None,
-            'hashtags': []
+            'hashtags': [],
+            # Epoch seconds the tweet was created, read from twitter by the poller and put on the stream
+            'created_at': None,
+            'ingested_at': None,
+            'arrived_at': None
         }
 
         for (param, default) in self.param_defaults.items():
             setattr(self, param, kwargs.get(param, default))
 
+    def GameKey(self):
+        """
+        A key that is shared by every request for the same game. Replies belong to the
+        game of the status they reply to, new games belong to their creator.
+        :return:
+        """
+        if self.request_type != str(RequestType.CREATE_GAME) and self.in_reply_to_status_id is not None:
+            return 'game-{}'.format(self.in_reply_to_status_id)
+
+        return 'user-{}'.format(self.user_name)
+
 
 class GameSession(TwitterModel):
     def __init__(self, **kwargs):
@@ -25,15 +55,98 @@ class GameSession(TwitterModel):
             'Players': None,
             'CurrentTweetId': None,
             'CurrentVotes': None,
+            'CurrentVoters': None,
+            'VoteDeadline': None,
             'CurrentGameStep': None,
-            'TwitterSteps': None,
+            # The number of steps in the game. The steps themselves are kept in the game history.
+            'StepCount': None,
             'CreationTime': None,
-            'ExpirationTime': None
+            'ExpirationTime': None,
+            # Only set while the game is open, which keeps it in the sparse expiring games index
+            'ExpiryShard': None,
+            # When DynamoDB TTL deletes the game. Only set once the game is complete.
+            'PurgeTime': None,
+            'Version': None
         }
 
         for (param, default) in self.param_defaults.items():
             setattr(self, param, kwargs.get(param, default))
 
+        self._saved = None
+        self._new_steps = []
+
+    def MarkSaved(self, fields=None):
+        """
+        Remember the current state as the state that is stored in the database
+        :param fields: Only mark these fields as saved. Defaults to all of them.
+        :return:
+        """
+        current = copy.deepcopy(self.AsDict())
+
+        if fields is None or self._saved is None:
+            self._saved = current
+            return
+
+        for field in fields:
+            if field in current:
+                self._saved[field] = current[field]
+            else:
+                self._saved.pop(field, None)
+
+    def AddStep(self, step_tweet_id, game_step, now):
+        """
+        Add a tweet to the game. It is written to the game history when the game is saved.
+        :param step_tweet_id: The id of the tweet
+        :param game_step: The story step it posted, or None for tweets that are not a step
+        :param now: The current epoch time
+        :return:
+        """
+        self.StepCount = int(self.StepCount or 0) + 1
+
+        step = {
+            'TweetStartId': int(self.TweetStartId),
+            'StepNumber': self.StepCount,
+            'StepTweetId': int(step_tweet_id),
+            'CreationTime': int(now),
+            'PurgeTime': int(now) + HISTORY_RETENTION_SECONDS
+        }
+
+        if game_step is not None:
+            step['GameStep'] = game_step
+
+        self._new_steps.append(step)
+
+    def NewSteps(self):
+        """
+        The steps added since the game history was last written
+        :return: A list of step dicts
+        """
+        return list(self._new_steps)
+
+    def MarkStepsSaved(self):
+        self._new_steps = []
+
+    def Complete(self, now):
+        """
+        Mark the game as complete. It leaves the expiring games index, and is purged
+        once the retention period is over.
+        :param now: The current epoch time
+        :return:
+        """
+        self.GameState = str(GameState.GAME_COMPLETE)
+        self.CurrentVotes = None
+        self.CurrentVoters = None
+        self.VoteDeadline = None
+        self.ExpiryShard = None
+        self.PurgeTime = int(now) + COMPLETED_GAME_RETENTION_SECONDS
+
+    def SavedState(self):
+        """
+        The state of the session when it was last loaded or saved
+        :return: The saved dict, or None if the session has never been saved
+        """
+        return self._saved
+
 class RequestType(Enum):
     CREATE_GAME='CREATE_GAME'
     START_GAME='START_GAME'
@@ -53,34 +166,3 @@ class GameState(Enum):
 
     def __str__(self):
         return self.name
-
-class Choice(TwitterModel):
-    def __init__(self, **kwargs):
-        self.param_defaults = {
-            'id': None,
-            'text': None,
-            'is_ending': False,
-            'options': []
-        }
-
-        for (param, default) in self.param_defaults.items():
-            if param != 'options':
-                setattr(self, param, kwargs.get(param, default))
-
-        if 'options' in kwargs:
-            self.options = [Option.NewFromJsonDict(x) for x in kwargs.get('options', [])]
-
-    def __str__(self):
-        return self.text
-
-
-class Option(TwitterModel):
-    def __init__(self, **kwargs):
-        self.param_defaults = {
-            'key': None,
-            'next_id': None
-        }
-
-        for (param, default) in self.param_defaults.items():
-            setattr(self, param, kwargs.get(param, default))
-
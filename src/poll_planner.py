@@ -0,0 +1,57 @@
+import time
+
+from twitter.error import TwitterError
+
+from src.logger import LOGGER
+
+# The endpoints each poll of the twitter feed calls
+MENTIONS_URL = 'https://api.twitter.com/1.1/statuses/mentions_timeline.json'
+USERS_LOOKUP_URL = 'https://api.twitter.com/1.1/users/lookup.json'
+POLLED_URLS = [MENTIONS_URL, USERS_LOOKUP_URL]
+
+DEFAULT_POLL_INTERVAL_SECONDS = 20
+MIN_POLL_INTERVAL_SECONDS = 5
+
+
+def plan_next_poll(twitter_api, now=None, calls_per_poll=None):
+    """
+    Work out how long to wait before polling twitter again, based on the rate limit
+    budget twitter reported for the endpoints a poll uses.
+
+    A poll can call an endpoint more than once, e.g. several pages of mentions during
+    a burst, so the next poll is budgeted as many calls as the last one made. With budget
+    left, the remaining polls are spread evenly over the rest of the rate limit window.
+    Without enough budget for another poll, the poll waits until the window resets.
+    :param twitter_api: The twitter api
+    :param now: The current epoch time. Defaults to time.time()
+    :param calls_per_poll: A dict of url -> calls the last poll made to it. Each endpoint is
+    budgeted at least one call.
+    :return: The number of seconds to wait before the next poll
+    """
+    now = time.time() if now is None else now
+    intervals = []
+
+    for url in POLLED_URLS:
+        try:
+            limit = twitter_api.CheckRateLimit(url)
+        except TwitterError as e:
+            LOGGER.warning('RateLimitCheckFailed', url=url, error=str(e))
+            continue
+
+        reset = int(limit.reset)
+        remaining = int(limit.remaining)
+        calls = max(1, (calls_per_poll or {}).get(url, 1))
+
+        # Twitter has not told us about this window yet
+        if reset <= now:
+            continue
+
+        if remaining < calls:
+            intervals.append(reset - now + 1)
+        else:
+            intervals.append(max(MIN_POLL_INTERVAL_SECONDS, (reset - now) * calls / remaining))
+
+    if len(intervals) == 0:
+        return DEFAULT_POLL_INTERVAL_SECONDS
+
+    return max(intervals)
@@ -1,8 +1,12 @@
-from time import sleep
-
-from boto3.dynamodb.conditions import Key, Attr
+from src.cursor_store import CursorStore
+from src.kinesis_publisher import KinesisPublisher, acknowledged_cursor
+from src.logger import DEBUG, LOGGER
+from src.mention_backfill import iter_mentions
 from src.models import GameRequest, GameState, RequestType
+from src.poll_planner import MENTIONS_URL, USERS_LOOKUP_URL
+from src.user_cache import UserResolver
 from twitter.error import TwitterError
+import time
 
 def process_twitter_feed(twitter_api, kinesis_client, kinesis_stream, dynamo_table):
     """
@@ -14,21 +18,20 @@ def process_twitter_feed(twitter_api, kinesis_client, kinesis_stream, dynamo_tab
     All requests are put into kinesis to be processed by the handle game state function
     :param event: The Lambda event
     :param context: The Lambda invoke context
-    :return:
+    :return: A dict of url -> calls this poll made to it, for planning the next poll
     """
 
-    # Get last processed tweet_id from dynamo
-    result = dynamo_table.query(
-        KeyConditionExpression=Key('TwitterAccount').eq('@SAMQuest9'),
-        ScanIndexForward=False, Limit=1)
+    # Get last processed tweet_id, from dynamo on a cold start
+    cursor_store = CursorStore(dynamo_table)
+    last_processed_tweet_id = cursor_store.get()
 
-    if result['Count'] == 0:
-        last_processed_tweet_id = None
-    else:
-        last_processed_tweet_id = int(result['Items'][0]['TwitterPostId'])
-        print ('Last processed tweet id: ' + str(last_processed_tweet_id))
+    if last_processed_tweet_id is not None:
+        LOGGER.info('CursorLoaded', last_processed_tweet_id=last_processed_tweet_id)
 
-    last_post_id = None
+    publisher = KinesisPublisher(kinesis_client, kinesis_stream)
+    user_resolver = UserResolver(twitter_api)
+    post_ids = []
+    mention_stats = {}
 
     # For each post, divide it into categories:
     # 1) New Game
@@ -36,53 +39,112 @@ def process_twitter_feed(twitter_api, kinesis_client, kinesis_stream, dynamo_tab
     # 3) Voting on choice
 
     try:
-        for post in twitter_api.GetMentions(since_id=last_processed_tweet_id):
-            print(str(post))
-
-            user = twitter_api.GetUser(user_id=post.user.id)
-
-            hashtags = [tag.text.lower() for tag in post.hashtags]
-
-            print(hashtags)
-
-            if 'help' in hashtags:
-                request_type = RequestType.HELP
-            elif 'letsplay' in hashtags:
-                request_type = RequestType.CREATE_GAME
-            elif 'startgame' in hashtags:
-                request_type = RequestType.START_GAME
-            elif 'joingame' in hashtags:
-                request_type = RequestType.JOIN_GAME
-            elif 'chooseme' in hashtags:
-                request_type = RequestType.MAKE_SELECTION
-            else:
-                request_type = RequestType.UNKNOWN
-
-            game_request = GameRequest.NewFromJsonDict({'user_name': user.screen_name,
-                                                               'status_message': post.text,
-                                                               'status_id': post.id,
-                                                               'in_reply_to_status_id': post.in_reply_to_status_id,
-                                                               'request_type': str(request_type),
-                                                               'hashtags': hashtags})
-
-            print('Sending to stream:')
-            print(str(game_request))
-
-            kinesis_client.put_record(StreamName=kinesis_stream,
-                                      Data=str(game_request),
-                                      PartitionKey='@SAMQuest9')
-
-            last_post_id = post.id
+        posts = list(iter_mentions(twitter_api, last_processed_tweet_id, stats=mention_stats))
+
+        for game_request in classify_mentions(posts, user_resolver, time.time()):
+            # Partition by game so each game stays ordered on one shard, while different games spread out
+            publisher.add(game_request.status_id, str(game_request), game_request.GameKey())
+            post_ids.append(game_request.status_id)
     except TwitterError as e:
-        if 'Rate limit exceeded' in e.message:
-            print('Got rate limited by twitter :(. Sleeping for 20 seconds')
-            sleep(20)
+        if 'Rate limit exceeded' in str(e.message):
+            # The poller plans the next poll around the reset time twitter reported
+            LOGGER.warning('TwitterRateLimited')
         else:
-            print(str(e))
+            LOGGER.error('TwitterError', error=str(e))
+
+    # Only move the cursor past the records kinesis actually acknowledged. Nothing is published from the
+    # first mention whose author could not be looked up, so the next poll reads it again
+    acknowledged = publisher.flush()
+    last_post_id = acknowledged_cursor(post_ids, acknowledged)
 
     if last_post_id is not None:
-        dynamo_table.put_item(Item={'TwitterAccount': '@SAMQuest9', 'TwitterPostId': last_post_id})
+        cursor_store.advance(last_post_id)
+
+    LOGGER.info('FeedProcessed', mentions=len(post_ids), acknowledged=len(acknowledged),
+                last_post_id=last_post_id, user_resolution=user_resolver.stats())
+
+    return {MENTIONS_URL: mention_stats.get('Pages', 0), USERS_LOOKUP_URL: user_resolver.lookup_calls}
+
+
+def classify_mentions(posts, user_resolver, ingested_at):
+    """
+    Turn mentions into game requests, by the hashtags in them. Mentions by users that
+    could not be found are dropped. Classifying stops at the first mention whose author
+    could not be looked up, so it and everything after it are left for the next poll.
+    :param posts: The twitter statuses, oldest first
+    :param user_resolver: A UserResolver for the screen names of the authors
+    :param ingested_at: The epoch time the mentions were read from twitter
+    :return: The game requests, in the same order as the mentions
+    """
+    screen_names = user_resolver.resolve_all(posts)
+    game_requests = []
+
+    for post in posts:
+        if LOGGER.is_enabled(DEBUG):
+            LOGGER.debug('MentionReceived', post=str(post))
+
+        if user_resolver.is_unresolved(post):
+            LOGGER.warning('MentionHeldBack', user_id=post.user.id, status_id=post.id)
+            break
+
+        if post.user is None or post.user.id not in screen_names:
+            LOGGER.warning('UserNotFound', user_id=None if post.user is None else post.user.id,
+                           status_id=post.id)
+            continue
+
+        hashtags = [tag.text.lower() for tag in post.hashtags]
+
+        if 'help' in hashtags:
+            request_type = RequestType.HELP
+        elif 'letsplay' in hashtags:
+            request_type = RequestType.CREATE_GAME
+        elif 'startgame' in hashtags:
+            request_type = RequestType.START_GAME
+        elif 'joingame' in hashtags:
+            request_type = RequestType.JOIN_GAME
+        elif 'chooseme' in hashtags:
+            request_type = RequestType.MAKE_SELECTION
+        else:
+            request_type = RequestType.UNKNOWN
+
+        game_request = GameRequest.NewFromJsonDict({'user_name': screen_names[post.user.id],
+                                                    'status_message': post.text,
+                                                    'status_id': post.id,
+                                                    'in_reply_to_status_id': post.in_reply_to_status_id,
+                                                    'request_type': str(request_type),
+                                                    'hashtags': hashtags,
+                                                    'created_at': __created_at(post),
+                                                    'ingested_at': ingested_at})
+
+        LOGGER.info('MentionClassified', status_id=post.id, request_type=str(request_type), hashtags=hashtags)
+
+        if LOGGER.is_enabled(DEBUG):
+            LOGGER.debug('GameRequestBuffered', game_request=str(game_request))
+
+        game_requests.append(game_request)
+
+    return game_requests
+
+
+def classified_through(posts, user_resolver):
+    """
+    Find the newest mention that classify_mentions did not leave for the next poll
+    :param posts: The twitter statuses passed to classify_mentions, oldest first
+    :param user_resolver: The UserResolver passed to classify_mentions
+    :return: The id of that mention, or None if every mention was left
+    """
+    last_post_id = None
+
+    for post in posts:
+        if user_resolver.is_unresolved(post):
+            break
+        last_post_id = post.id
+
+    return last_post_id
 
-    print('Done processing twitter posts.')
 
+def __created_at(post):
+    if post.created_at is None:
+        return None
 
+    return post.created_at_in_seconds
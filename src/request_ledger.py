@@ -0,0 +1,197 @@
+from collections import OrderedDict
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+# Kinesis keeps records for 24 hours by default, so a redelivery can not be older than that
+LEDGER_TTL_SECONDS = 24 * 60 * 60
+
+# Just longer than the 300 second game state lambda timeout, so a claim is only taken over
+# once its holder is gone. Records held by a claim are retried until it runs out, so the
+# event source mapping must not cap retries below what the lease needs (see saml.yaml).
+CLAIM_LEASE_SECONDS = 6 * 60
+
+MAX_CACHED_REQUESTS = 10000
+
+
+# Status id of every request completed by this process, most recently used last.
+# Kept at module level so warm lambda invocations reuse it.
+COMPLETED_REQUESTS = OrderedDict()
+
+
+class RequestInProgressError(Exception):
+    """
+    Raised when a request is claimed while another handler holds an unexpired claim on it
+    """
+    pass
+
+
+class RequestState(object):
+    IN_PROGRESS = 'IN_PROGRESS'
+    FAILED = 'FAILED'
+    COMPLETE = 'COMPLETE'
+
+
+class RequestLedger(object):
+    """
+    Records which game requests have been handled, keyed by the status id of the tweet,
+    so that a batch redelivered by kinesis does not post its replies a second time.
+
+    A request is claimed with a conditional put before any work is done on it, and
+    marked complete once the batch it was in has been saved. Completed requests are
+    remembered in a bounded in process cache, so a retried batch in a warm container is
+    skipped without calling dynamo at all. Ledger items expire through the table's TTL.
+
+    A request that raised is marked failed, with a count of how many times it has been
+    attempted, and can be claimed again straight away by the retry. A request another
+    handler still holds a claim on is neither handled nor skipped, so it is retried once
+    the claim is completed or runs out.
+    """
+
+    def __init__(self, dynamodb_table, ttl=LEDGER_TTL_SECONDS, lease=CLAIM_LEASE_SECONDS,
+                 completed=COMPLETED_REQUESTS, max_cached=MAX_CACHED_REQUESTS, clock=time.time):
+        self.dynamodb_table = dynamodb_table
+        self.ttl = ttl
+        self.lease = lease
+        self.max_cached = max_cached
+        self.clock = clock
+        self.completed = completed
+        self.skipped = 0
+        # Requests for different games are claimed from several threads
+        self.lock = threading.Lock()
+
+    def claim(self, status_id):
+        """
+        Claim a request before handling it
+        :param status_id: The id of the tweet the request came from
+        :return: False if the request was already handled
+        :raises RequestInProgressError: If the request is being handled elsewhere
+        """
+        status_id = int(status_id)
+
+        with self.lock:
+            if status_id in self.completed:
+                self.completed.move_to_end(status_id)
+                self.skipped += 1
+                return False
+
+        now = int(self.clock())
+
+        # An update rather than a put, so the attempts of a failed request are kept
+        try:
+            self.dynamodb_table.update_item(
+                Key={'StatusId': status_id},
+                UpdateExpression='SET RequestState = :in_progress, LeaseExpiry = :lease_expiry, '
+                                 'ExpirationTime = :expiration_time',
+                ConditionExpression='attribute_not_exists(StatusId) OR RequestState = :failed '
+                                    'OR (RequestState = :in_progress AND LeaseExpiry < :now)',
+                ExpressionAttributeValues={
+                    ':in_progress': RequestState.IN_PROGRESS,
+                    ':failed': RequestState.FAILED,
+                    ':lease_expiry': now + self.lease,
+                    ':expiration_time': now + self.ttl,
+                    ':now': now
+                })
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+            item = self.dynamodb_table.get_item(Key={'StatusId': status_id}, ConsistentRead=True).get('Item')
+
+            # An item that failed or expired since the update was rejected is retried as well
+            if item is None or item.get('RequestState') != RequestState.COMPLETE:
+                raise RequestInProgressError('Request {} is being handled elsewhere'.format(status_id))
+
+            self.__remember(status_id)
+
+            with self.lock:
+                self.skipped += 1
+            return False
+
+        return True
+
+    def fail(self, status_id):
+        """
+        Record a failed attempt at a claimed request, and give up the claim so a retry
+        can pick it up
+        :param status_id:
+        :return: The number of times the request has failed
+        """
+        result = self.dynamodb_table.update_item(
+            Key={'StatusId': int(status_id)},
+            UpdateExpression='SET RequestState = :failed, Attempts = if_not_exists(Attempts, :zero) + :one '
+                             'REMOVE LeaseExpiry',
+            ExpressionAttributeValues={':failed': RequestState.FAILED, ':zero': 0, ':one': 1},
+            ReturnValues='UPDATED_NEW')
+
+        return int(result['Attributes']['Attempts'])
+
+    def complete(self, status_ids):
+        """
+        Mark claimed requests as handled
+        :param status_ids:
+        :return:
+        """
+        now = int(self.clock())
+
+        with self.dynamodb_table.batch_writer() as batch:
+            for status_id in status_ids:
+                batch.put_item(Item={
+                    'StatusId': int(status_id),
+                    'RequestState': RequestState.COMPLETE,
+                    'ExpirationTime': now + self.ttl
+                })
+
+                self.__remember(int(status_id))
+
+    def __remember(self, status_id):
+        with self.lock:
+            self.completed[status_id] = True
+            self.completed.move_to_end(status_id)
+
+            while len(self.completed) > self.max_cached:
+                self.completed.popitem(last=False)
+
+
+class InMemoryRequestLedger(object):
+    """
+    A RequestLedger kept in process, for handling requests on a single node without dynamo.
+
+    Only this process handles the requests, so there are no claims to hold. Completed
+    requests are remembered up to max_cached, and the attempts of a failed request until
+    it is completed or dead lettered.
+    """
+
+    def __init__(self, max_cached=MAX_CACHED_REQUESTS):
+        self.max_cached = max_cached
+        self.completed = OrderedDict()
+        self.attempts = {}
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    def claim(self, status_id):
+        with self.lock:
+            if int(status_id) in self.completed:
+                self.skipped += 1
+                return False
+
+        return True
+
+    def fail(self, status_id):
+        status_id = int(status_id)
+
+        with self.lock:
+            self.attempts[status_id] = self.attempts.get(status_id, 0) + 1
+
+            return self.attempts[status_id]
+
+    def complete(self, status_ids):
+        with self.lock:
+            for status_id in status_ids:
+                self.attempts.pop(int(status_id), None)
+                self.completed[int(status_id)] = True
+                self.completed.move_to_end(int(status_id))
+
+            while len(self.completed) > self.max_cached:
+                self.completed.popitem(last=False)
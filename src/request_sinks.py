@@ -0,0 +1,73 @@
+"""
+Where the ingest service sends the game requests it classified.
+
+A sink is handed a batch with publish(game_requests) and returns the status ids of the
+requests it took. The service only checkpoints past requests a sink took, and hands the
+rest to it again.
+"""
+import asyncio
+import json
+
+from src.dead_letter_queue import DeadLetterQueue
+from src.kinesis_publisher import KinesisPublisher
+from src.request_ledger import InMemoryRequestLedger
+from src.sam_quest import MAX_GAME_WORKERS, handle_game_state
+
+
+class KinesisSink(object):
+    """
+    Publishes the requests to the game request stream for the game state function,
+    partitioned by game
+    """
+
+    def __init__(self, kinesis_client, stream_name):
+        self.publisher = KinesisPublisher(kinesis_client, stream_name)
+
+    async def publish(self, game_requests):
+        return await asyncio.get_event_loop().run_in_executor(None, self.__put, game_requests)
+
+    def __put(self, game_requests):
+        for game_request in game_requests:
+            # Partition by game so each game stays ordered on one shard, while different games spread out
+            self.publisher.add(game_request.status_id, str(game_request), game_request.GameKey())
+
+        return self.publisher.flush()
+
+
+class GameStateSink(object):
+    """
+    Hands the requests straight to handle_game_state in this process, with no stream in
+    between. For running SAMQuest on a single node, e.g. with a SqliteGameStore.
+
+    A request that failed is not taken, so the service hands it over again. The ledger
+    counts the attempts, and a request that keeps failing goes to the dead letter queue.
+    """
+
+    def __init__(self, twitter_api, game_store, ledger=None, dead_letters=None, max_workers=MAX_GAME_WORKERS,
+                 bucket=None):
+        """
+        :param twitter_api: The twitter api the replies are posted with
+        :param game_store: The GameStore the games are kept in
+        :param ledger: A RequestLedger. Defaults to an InMemoryRequestLedger.
+        :param dead_letters: Where requests that keep failing are sent. Defaults to logging them.
+        :param max_workers: How many games are handled at the same time
+        :param bucket: The token bucket replies are rate limited by. Defaults to the one of this process.
+        """
+        self.twitter_api = twitter_api
+        self.game_store = game_store
+        self.ledger = ledger or InMemoryRequestLedger()
+        self.dead_letters = dead_letters or DeadLetterQueue()
+        self.max_workers = max_workers
+        self.bucket = bucket
+
+    async def publish(self, game_requests):
+        return await asyncio.get_event_loop().run_in_executor(None, self.__handle, game_requests)
+
+    def __handle(self, game_requests):
+        # The same dicts the game state function reads from the stream
+        posts = [json.loads(str(game_request)) for game_request in game_requests]
+        failed = set(handle_game_state(posts, self.twitter_api, self.game_store, ledger=self.ledger,
+                                       dead_letters=self.dead_letters, max_workers=self.max_workers,
+                                       bucket=self.bucket))
+
+        return {game_request.status_id for (index, game_request) in enumerate(game_requests) if index not in failed}
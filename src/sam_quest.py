@@ -1,49 +1,281 @@
-from boto3.dynamodb.conditions import Key
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
 import string
 import random
 import time
 
-from src.game_steps import get_choice
-from src.models import GameRequest, RequestType, GameState, GameSession
+from src.dead_letter_queue import DeadLetterQueue
+from src.game_steps import STORY, get_choice
+from src.latency import LatencyTracker
+from src.logger import DEBUG, LOGGER
+from src.models import GameRequest, RequestType, GameState, GameSession, EXPIRY_SHARDS, GAME_LIFETIME_SECONDS
+from src.request_ledger import RequestInProgressError
+from src.session_cache import SessionCache
+from src.tweet_dispatcher import STATUS_UPDATE_BUCKET, TweetDispatcher
 from src.constants import HELP_MESSAGE_FORMATS
 
-def handle_game_state(posts, twitter_api, dynamodb_table):
+# How long players have to vote on a step before the next vote closes the round
+VOTE_WINDOW_SECONDS = 15 * 60
 
-    print('Received ' + str(len(posts)) + ' records')
+# How many times a request is attempted before it is sent to the dead letter queue
+MAX_REQUEST_ATTEMPTS = 3
 
-    for post in posts:
+# How many games in a batch are handled at the same time
+MAX_GAME_WORKERS = 8
+
+# How long past the time cap the replies of the requests that were started can wait to be posted
+REPLY_TIME_CAP_SECONDS = 30
+
+
+class StepPostFailedError(Exception):
+    """
+    Raised when the next step of a game could not be posted, so the request is retried
+    """
+    pass
+
+
+class ReplyNotSentError(Exception):
+    """
+    The error a handled request is retried with when one of its replies was not sent
+    """
+    pass
+
+
+def handle_game_state(posts, twitter_api, game_store, dispatcher=None, ledger=None, dead_letters=None,
+                      max_workers=MAX_GAME_WORKERS, time_cap=None, bucket=None):
+    """
+    Handle a batch of game requests. Requests are grouped by game. The requests for a game
+    are handled in order, and different games are handled at the same time.
+
+    A request that raises does not stop the rest of the batch, it is reported back so
+    only it, and the requests after it for the same game, are retried. A game that can not
+    be saved at the end of the batch has every request that used it retried the same way,
+    as does a request one of its replies was not sent for.
+    :param posts: The game requests, as dicts
+    :param twitter_api: The twitter api
+    :param game_store: The GameStore the games are kept in
+    :param dispatcher: Posts the replies. Defaults to a dispatcher for this batch.
+    :param ledger: A RequestLedger that skips requests a redelivered batch already handled. Requests it
+    finds in progress elsewhere are reported as failed, without counting as an attempt. Optional.
+    :param dead_letters: Where requests that failed MAX_REQUEST_ATTEMPTS times are sent. The attempts
+    are counted by the ledger, so without one failed requests are always retried. Defaults to logging them.
+    :param max_workers: How many games are handled at the same time
+    :param time_cap: Seconds after which no more requests are started. The requests left over are
+    reported as failed, without counting as an attempt. The replies of the requests that were started
+    get REPLY_TIME_CAP_SECONDS more to be posted, when the dispatcher is made for the batch. Defaults to no cap.
+    :param bucket: The token bucket the replies are rate limited by, when the dispatcher is made for the batch.
+    Defaults to the STATUS_UPDATE_BUCKET of this process.
+    :return: The indexes in posts of the requests that failed, and should be retried
+    """
+
+    LOGGER.info('BatchReceived', records=len(posts))
+
+    # Every game is loaded once per batch and written back once at the end
+    sessions = SessionCache(game_store)
+    latency = LatencyTracker()
+    deadline = None if time_cap is None else latency.started_at + time_cap
+    owns_dispatcher = dispatcher is None
+
+    if owns_dispatcher:
+        dispatcher = TweetDispatcher(twitter_api, bucket=bucket or STATUS_UPDATE_BUCKET,
+                                     deadline=None if deadline is None else deadline + REPLY_TIME_CAP_SECONDS)
+
+    dead_letters = dead_letters or DeadLetterQueue()
+    handled = []
+    failed = []
+    # Start tweet id -> the handled requests that used the game, as (index, post, game_request)
+    used = {}
+    # The handled requests with the futures of their replies, as (index, post, game_request, futures)
+    replies = []
+
+    try:
+        __handle_requests(posts, dispatcher, sessions, ledger, dead_letters, handled, failed, used, replies,
+                          latency, max_workers, deadline)
+    finally:
+        conflicts = sessions.flush()
+
+        # Let the queued replies go out before the invocation ends, up to the dispatcher's deadline
+        if owns_dispatcher:
+            dispatcher.shutdown(wait=True)
+
+        __retry_requests(__requests_to_retry(conflicts, used, replies), ledger, dead_letters, handled, failed)
+
+        if ledger is not None:
+            ledger.complete(handled)
+
+        latency.emit()
+
+    LOGGER.info('BatchProcessed', records=len(posts), handled=len(handled), failed=len(failed))
+
+    return sorted(failed)
+
+
+def __handle_requests(posts, dispatcher, sessions, ledger, dead_letters, handled, failed, used, replies, latency,
+                      max_workers, deadline):
+    games = OrderedDict()
+
+    for (index, post) in enumerate(posts):
+
+        if LOGGER.is_enabled(DEBUG):
+            LOGGER.debug('RecordReceived', record=post)
 
-        print('Processing record ' + str(post))
         game_request = GameRequest.NewFromJsonDict(post)
+        games.setdefault(game_request.GameKey(), []).append((index, post, game_request))
 
-        if RequestType(game_request.request_type) == RequestType.HELP:
-            print('Getting help')
-            __send_help(game_request, twitter_api)
-        elif RequestType(game_request.request_type) == RequestType.CREATE_GAME:
-            print('Creating game')
-            __create_game(game_request, dynamodb_table, twitter_api)
-        elif RequestType(game_request.request_type) == RequestType.START_GAME:
-            print('Starting game')
-            __start_game(game_request, dynamodb_table, twitter_api)
-        elif RequestType(game_request.request_type) == RequestType.JOIN_GAME:
-            print('Joining game')
-            __join_game(game_request, dynamodb_table, twitter_api)
-        elif RequestType(game_request.request_type) == RequestType.MAKE_SELECTION:
-            print('Making a selection in the game')
-            __make_selection(game_request, dynamodb_table, twitter_api)
-        else:
-            print('Unknown game type.')
-            __send_error_tweet(game_request, twitter_api)
+    arguments = (dispatcher, sessions, ledger, dead_letters, handled, failed, used, replies, latency, deadline)
+
+    if max_workers <= 1 or len(games) <= 1:
+        for requests in games.values():
+            __handle_game(requests, *arguments)
+        return
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(games))) as executor:
+        futures = [executor.submit(__handle_game, requests, *arguments) for requests in games.values()]
 
-    print('Done processing.')
+    # Anything that was not a failure of a single request, such as the ledger being unavailable, fails the batch
+    for future in futures:
+        future.result()
 
 
-def __send_help(game_request, twitter_api):
+def __handle_game(requests, dispatcher, sessions, ledger, dead_letters, handled, failed, used, replies, latency,
+                  deadline):
+    """
+    Handle the requests for a game in order. Once one fails, or the time cap is reached,
+    the rest are left to be retried.
+    """
+    for (position, (index, post, game_request)) in enumerate(requests):
+
+        if deadline is not None and time.time() >= deadline:
+            LOGGER.warning('BatchTimeCapReached', status_id=game_request.status_id,
+                           requests_left=len(requests) - position)
+            failed.extend(index for (index, _, _) in requests[position:])
+            return
+
+        # Redelivered requests are dropped before any twitter or game store work
+        try:
+            claimed = ledger is None or ledger.claim(game_request.status_id)
+        except RequestInProgressError:
+            # Not an attempt of this batch, the request is retried once the other handler is done with it
+            LOGGER.warning('RequestInProgress', status_id=game_request.status_id,
+                           requests_left=len(requests) - position)
+            failed.extend(index for (index, _, _) in requests[position:])
+            return
+
+        if not claimed:
+            LOGGER.info('RequestSkipped', status_id=game_request.status_id)
+            continue
+
+        request_dispatcher = latency.watch(game_request, dispatcher)
+
+        try:
+            __handle_request(game_request, request_dispatcher, sessions)
+
+            for tweet_start_id in sessions.request_games():
+                used.setdefault(tweet_start_id, []).append((index, post, game_request))
+
+            replies.append((index, post, game_request, request_dispatcher.futures))
+        except Exception as e:
+            if not __dead_letter(post, game_request, e, ledger, dead_letters):
+                failed.extend(index for (index, _, _) in requests[position:])
+                return
+        finally:
+            sessions.end_request()
+
+        handled.append(game_request.status_id)
+
+
+def __requests_to_retry(conflicts, used, replies):
+    """
+    Find the handled requests that have to be retried. These are the requests that used a
+    game that could not be saved, so they are retried on top of the stored game, and the
+    requests a reply was not sent for.
+    :param conflicts: The games that could not be saved, start tweet id -> the error
+    :param used: Start tweet id -> the handled requests that used the game
+    :param replies: The handled requests with the futures of their replies
+    :return: An OrderedDict of index -> (post, game_request, error)
+    """
+    retried = OrderedDict()
+
+    for (tweet_start_id, error) in conflicts.items():
+        for (index, post, game_request) in used.get(tweet_start_id, []):
+            retried.setdefault(index, (post, game_request, error))
+
+    for (index, post, game_request, futures) in replies:
+        wait(futures)
+
+        if any(future.exception() is not None or future.result() == False for future in futures):
+            error = ReplyNotSentError('A reply to request {} was not sent'.format(game_request.status_id))
+            retried.setdefault(index, (post, game_request, error))
+
+    return retried
+
+
+def __retry_requests(retried, ledger, dead_letters, handled, failed):
+    """
+    Take requests back out of the handled ones, and fail them so they are retried
+    :param retried: index -> (post, game_request, error)
+    :param ledger:
+    :param dead_letters:
+    :param handled:
+    :param failed:
+    :return:
+    """
+    for (index, (post, game_request, error)) in retried.items():
+        if __dead_letter(post, game_request, error, ledger, dead_letters):
+            continue
+
+        handled.remove(game_request.status_id)
+        failed.append(index)
+
+
+def __dead_letter(post, game_request, error, ledger, dead_letters):
+    """
+    Record a failed request, and send it to the dead letter queue once it has failed too often
+    :param post: The request, as it was read
+    :param game_request:
+    :param error: The exception it failed with
+    :param ledger:
+    :param dead_letters:
+    :return: True if the request was dead lettered, and should not be retried
+    """
+    LOGGER.error('RequestFailed', status_id=game_request.status_id, request_type=game_request.request_type,
+                 error=str(error))
+
+    if ledger is None:
+        return False
+
+    attempts = ledger.fail(game_request.status_id)
+
+    if attempts < MAX_REQUEST_ATTEMPTS:
+        return False
+
+    dead_letters.send(post, error, attempts)
+    return True
+
+
+def __handle_request(game_request, dispatcher, sessions):
+    LOGGER.info('RequestReceived', status_id=game_request.status_id, request_type=game_request.request_type)
+
+    if RequestType(game_request.request_type) == RequestType.HELP:
+        __send_help(game_request, dispatcher)
+    elif RequestType(game_request.request_type) == RequestType.CREATE_GAME:
+        __create_game(game_request, sessions, dispatcher)
+    elif RequestType(game_request.request_type) == RequestType.START_GAME:
+        __start_game(game_request, sessions, dispatcher)
+    elif RequestType(game_request.request_type) == RequestType.JOIN_GAME:
+        __join_game(game_request, sessions, dispatcher)
+    elif RequestType(game_request.request_type) == RequestType.MAKE_SELECTION:
+        __make_selection(game_request, sessions, dispatcher)
+    else:
+        __send_error_tweet(game_request, dispatcher)
+
+
+def __send_help(game_request, dispatcher):
     """
     Send a helpful message.
     If a user tweets in the pattern "#Help #Command", put a help message specific for that command.
     :param game_request:
-    :param twitter_api:
+    :param dispatcher:
     :return:
     """
 
@@ -63,50 +295,51 @@ def __send_help(game_request, twitter_api):
 
     status_message = "@{} {}".format(game_request.user_name, help_message)
 
-    __send_to_twitter(status_message, game_request.in_reply_to_status_id, twitter_api)
+    __send_to_twitter(status_message, game_request.in_reply_to_status_id, dispatcher)
 
-def __send_to_twitter(status_message, reply_status_id, twitter_api):
-    try:
-        print('Posting \"' + status_message + '\"')
+def __send_to_twitter(status_message, reply_status_id, dispatcher):
+    """
+    Queue a tweet on the dispatcher. Replies that nothing waits on are fire and forget.
+    :param status_message:
+    :param reply_status_id:
+    :param dispatcher:
+    :return: A future for the posted status. It resolves to False if posting failed.
+    """
+    LOGGER.info('ReplyPosted', in_reply_to_status_id=reply_status_id)
 
-        status_message += ' '
-        status_message += ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(4))
+    if LOGGER.is_enabled(DEBUG):
+        LOGGER.debug('ReplyText', status=status_message)
 
-        return twitter_api.PostUpdate(status=status_message,
-                               in_reply_to_status_id=reply_status_id)
-    except Exception as e:
-        print('An error occured: ' + str(e))
-        return False
+    status_message += ' '
+    status_message += ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(4))
 
+    return dispatcher.post(status_message, in_reply_to_status_id=reply_status_id)
 
-def __create_game(game_request, dynamodb_table, twitter_api):
+
+def __create_game(game_request, sessions, dispatcher):
     """
     The create game method. The logic is as follows =>
 
-    1) Check that the user has not started a game
+    1) Claim the creator, which fails if the user already has a game
     2) Reply with request for joiners
-    3) Post with post id into dynamodb
-    4) Add new game to dynamo
+    3) Post with post id into the game store
+    4) Add new game to the game store
 
     :param game_request:
-    :param dynamodb_table:
-    :param twitter_api:
+    :param sessions:
+    :param dispatcher:
     :return:
     """
     user = game_request.user_name
 
-    result = dynamodb_table.query(IndexName='GameCreator-index',
-                                  Select='ALL_ATTRIBUTES',
-                                  KeyConditionExpression=Key('GameCreator').eq(user))
-
-    if result['Count'] > 0 and any([game for game in result['Items'] if game['GameState'] != str(GameState.GAME_COMPLETE)]):
+    if not sessions.claim_creator(user):
         status_message = "Hello @{}! You already have a game started!".format(user)
-        __send_to_twitter(status_message, game_request.status_id, twitter_api)
+        __send_to_twitter(status_message, game_request.status_id, dispatcher)
     else:
         status_message = "Welcome to SAMQuest @{}! To start reply with #StartGame. " \
                      "To join this game, reply to this with #JoinGame".format(user)
 
-        start_post_status = __send_to_twitter(status_message, game_request.status_id, twitter_api)
+        start_post_status = __send_to_twitter(status_message, game_request.status_id, dispatcher).result()
 
         if start_post_status != False:
             current_time = int(time.time())
@@ -116,101 +349,87 @@ def __create_game(game_request, dynamodb_table, twitter_api):
                 'GameState': str(GameState.PENDING_GAME_START),
                 'GameCreator': user,
                 'Players': [user],
-                'TwitterSteps': [int(game_request.status_id)],
                 'CreationTime': current_time,
-                'ExpirationTime': current_time + (8 * 60 * 60) # set the expiration time for the current time + 8 hours
+                'ExpirationTime': current_time + GAME_LIFETIME_SECONDS,
+                'ExpiryShard': random.randint(1, EXPIRY_SHARDS)
             })
+            game_session.AddStep(game_request.status_id, None, current_time)
 
-            print(game_session.AsDict())
-
-            dynamodb_table.put_item(Item=game_session.AsDict())
+            sessions.save(game_session)
+        else:
+            sessions.release_creator(user)
 
 
-def __start_game(game_request, dynamodb_table, twitter_api):
+def __start_game(game_request, sessions, dispatcher):
     """
     The start game method. The logic is as follows =>
 
     1) Check the reply id to see if it exists
     2) Check to see that it is the creator
-    3) Mark game as started in dynamo
+    3) Check the reply is to the welcome tweet of a game that has not started
     4) Post back first choice
+    5) Mark game as started in the game store, once the first choice is posted
 
     :param game_request:
-    :param dynamodb_table:
-    :param twitter_api:
+    :param sessions:
+    :param dispatcher:
     :return:
     """
     user = game_request.user_name
 
     if game_request.in_reply_to_status_id is None:
         status_message = "@{} reply to the original message to start. Or try #CreateGame to create a new one".format(user)
-        __send_to_twitter(status_message, game_request.status_id, twitter_api)
+        __send_to_twitter(status_message, game_request.status_id, dispatcher)
         return
 
     try:
-        result = dynamodb_table.get_item(Key={'TweetStartId': game_request.in_reply_to_status_id})
+        game_session = sessions.get_by_tweet(game_request.in_reply_to_status_id)
     except Exception as e:
-        print('An error occured :( ' + str(e))
+        LOGGER.error('GameLookupFailed', status_id=game_request.status_id, error=str(e))
         return
 
-    if 'Item' not in result or result['Item'] is None:
+    if game_session is None:
         status_message = "You are trying to start a game that doesn't exist @{}!".format(user)
-        __send_to_twitter(status_message, game_request.status_id, twitter_api)
-    elif result['Item']['GameCreator'] != user:
+        __send_to_twitter(status_message, game_request.status_id, dispatcher)
+    elif game_session.GameCreator != user:
         status_message = "@{} you cannot start someone elses game! Create your own with #LetsPlay".format(user)
-        __send_to_twitter(status_message, game_request.status_id, twitter_api)
+        __send_to_twitter(status_message, game_request.status_id, dispatcher)
+    elif not __is_waiting_for_players(game_session, game_request):
+        status_message = "@{} this game has already started!".format(user)
+        __send_to_twitter(status_message, game_request.status_id, dispatcher)
     else:
-        game_session = GameSession.NewFromJsonDict(result['Item'])
-
-        game_session.GameState = str(GameState.PENDING_GAME_INPUT)
+        # The game is only marked as started once the first step is out, as the batch saves it either way
+        __post_step(game_session, get_choice(STORY.start_id), dispatcher)
+        sessions.save(game_session)
 
-        current_choice = get_choice(1)
 
-        users = " ".join(["@{}".format(player) for player in game_session.Players])
-        choices = " ".join(["#{}".format(option.key) for option in current_choice.options])
-
-        status_message = "{} {} {}".format(users, current_choice.text, choices)
-
-        start_post_status = __send_to_twitter(status_message, None, twitter_api)
-
-        if start_post_status != False:
-            game_session.TwitterSteps += [int(start_post_status.id)]
-            game_session.CurrentTweetId = int(start_post_status.id)
-            game_session.CurrentGameStep = current_choice.id
-
-            print(game_session.AsDict())
-            dynamodb_table.put_item(Item=game_session.AsDict())
-        else:
-            print('Failure')
-
-
-def __join_game(game_request, dynamodb_table, twitter_api):
+def __join_game(game_request, sessions, dispatcher):
     """
     The join game method. The logic goes as follows =>
 
-    1) Validate this is a started game waiting for users to join
+    1) Validate this is a created game waiting for users to join, replied to at its welcome tweet
     2) Validate current players count is < 4
     3) Check the user has not already joined the game
     4) Add user name to set of user aliases
     5) Reply with tweet
 
     :param game_request:
-    :param dynamodb_table:
-    :param twitter_api
+    :param sessions:
+    :param dispatcher
     :return:
     """
     try:
-        result = dynamodb_table.get_item(Key={'TweetStartId': game_request.in_reply_to_status_id})
+        game_session = sessions.get_by_tweet(game_request.in_reply_to_status_id)
     except Exception as e:
-        print('an error occured: ' + str(e))
+        LOGGER.error('GameLookupFailed', status_id=game_request.status_id, error=str(e))
         return
 
-    if 'Item' not in result or result['Item'] is None or len(result['Item']) == 0:
+    if game_session is None:
         status_message = "Hello @{}! I can't seem to find the game to start.".format(game_request.user_name)
-
+    elif not __is_waiting_for_players(game_session, game_request):
+        status_message = "Hello @{}. This game has already started, but you can try starting your own game!".format(
+            game_request.user_name)
     else:
-        game_session = GameSession.NewFromJsonDict(result['Item'])
-
         if len(game_session.Players) == 4:
             status_message = "Hello @{}. The game is full, but you can try starting your own game!".format(game_request.user_name)
         else:
@@ -221,103 +440,182 @@ def __join_game(game_request, dynamodb_table, twitter_api):
                 status_message = "@{} You have already joined the game!".format(user)
             else:
                 game_session.Players += [game_request.user_name]
-                dynamodb_table.put_item(Item=game_session.AsDict())
+                sessions.save(game_session)
                 status_message = "Hello @{}. Welcome to the game. Prepare yourself :)".format(user)
 
-    __send_to_twitter(status_message, game_request.status_id, twitter_api)
+    __send_to_twitter(status_message, game_request.status_id, dispatcher)
+
+
+def __is_waiting_for_players(game_session, game_request):
+    """
+    A game can only be joined or started before it starts, from a reply to its welcome tweet.
+    A reply to any later step of the game finds it too, so it is not enough that the game exists.
+    :param game_session:
+    :param game_request:
+    :return:
+    """
+    return game_session.GameState == str(GameState.PENDING_GAME_START) and \
+        int(game_request.in_reply_to_status_id) == int(game_session.TweetStartId)
 
 
-def __make_selection(game_request, dynamodb_table, twitter_api):
+def __make_selection(game_request, sessions, dispatcher):
     """
     Handle tweets that are game related. The three scenarios here are:
 
     1) The game does not exist
-    2) The game exists, and you are not part of it
-    3) The game exists, but not everyone has voted
-    4) The game exists, and this is the last vote
+    2) The reply is to a step the game has already moved on from
+    3) The game exists, and you are not part of it
+    4) The game exists, but not everyone has voted
+    5) The game exists, and this is the last vote
     :param game_request:
-    :param dynamodb_table:
-    :param twitter_api:
+    :param sessions:
+    :param dispatcher:
     :return:
     """
-    result = dynamodb_table.query(IndexName='CurrentTweetId-index',
-                                  Select='ALL_ATTRIBUTES',
-                                  KeyConditionExpression=Key('CurrentTweetId').eq(game_request.in_reply_to_status_id))
+    game_session = sessions.get_by_tweet(game_request.in_reply_to_status_id)
 
     # Game does not exist
-    if result['Count'] == 0:
-        status_message = "@{} the game doesnt exist, or this choice was made already.".format(game_request.user_name)
+    if game_session is None:
+        status_message = "@{} the game doesnt exist!".format(game_request.user_name)
 
-        __send_to_twitter(status_message, game_request.status_id, twitter_api)
-        # print('Posting \"' + status_message + '\" to user ' + str(game_request.user_name))
-        # twitter_api.PostUpdate(status=status_message,
-        #                        in_reply_to_status_id=game_request.status_id)
-    else:
-        game_session = GameSession.NewFromJsonDict(result['Items'][0])
+        __send_to_twitter(status_message, game_request.status_id, dispatcher)
+    elif game_session.GameState != str(GameState.GAME_COMPLETE) and (
+            game_session.CurrentTweetId is None
+            or int(game_session.CurrentTweetId) != int(game_request.in_reply_to_status_id)):
+        status_message = "@{} this choice was made already! Reply to the latest step to vote.".format(
+            game_request.user_name)
 
+        __send_to_twitter(status_message, game_request.status_id, dispatcher)
+    else:
         if any(player for player in game_session.Players if player == game_request.user_name):
             #The player is part of the game
             # Check to see if the game is complete
             if GameState(game_session.GameState) == GameState.GAME_COMPLETE:
                 status_message = '@{} the game is over! Try starting a new game.'.format(game_request.user_name)
-                __send_to_twitter(status_message, game_request.status_id, twitter_api)
+                __send_to_twitter(status_message, game_request.status_id, dispatcher)
                 return
 
             # Get the current choice
             current_choice = get_choice(game_session.CurrentGameStep)
 
-            print('Current choice and hashtags')
-            print(str(current_choice))
-            print(game_request.hashtags)
+            if LOGGER.is_enabled(DEBUG):
+                LOGGER.debug('SelectionReceived', step=current_choice.id, hashtags=game_request.hashtags)
 
-           # Check to see if a valid choice was made
-            players_choice = [option for option in current_choice.options if option.key.lower() in game_request.hashtags]
+            # Games started before votes were counted need their vote counters set up
+            if game_session.CurrentVotes is None:
+                game_session.CurrentVotes = {option: 0 for option in current_choice.transitions}
+                sessions.save(game_session)
 
-            print('length: ' + str(len(players_choice)))
+            # Check to see if a valid choice was made
+            option = current_choice.select_option(game_request.hashtags)
 
-            if len(players_choice) == 0 or len(players_choice) > 1:
+            if option is None:
                 status_message = "@{} you didnt do a valid response! Try again!".format(
                     game_request.user_name)
 
-                __send_to_twitter(status_message, game_request.status_id, twitter_api)
-            else:
-                print("Players choice: {}".format(players_choice[0].next_id))
+                __send_to_twitter(status_message, game_request.status_id, dispatcher)
+            elif not sessions.record_vote(game_session, game_request.user_name, option) and \
+                    not __round_is_closed(game_session):
+                status_message = "@{} you have already voted, or this choice was made already.".format(
+                    game_request.user_name)
 
-                next_choice = get_choice(players_choice[0].next_id)
+                __send_to_twitter(status_message, game_request.status_id, dispatcher)
+            elif __round_is_closed(game_session):
+                # Any vote on a closed round tallies it, also one that was not counted. The step
+                # may not have gone out for the vote that closed it, or the deadline passed
+                # after everyone else had voted.
+                next_choice = get_choice(current_choice.transitions[__tally_votes(current_choice, game_session)])
 
-                users = " ".join(["@{}".format(player) for player in game_session.Players])
+                LOGGER.info('RoundClosed', tweet_start_id=game_session.TweetStartId, next_step=next_choice.id)
 
-                if hasattr(next_choice, 'options'):
-                    choices = " ".join(["#{}".format(option.key) for option in next_choice.options])
-                else:
-                    choices = ''
+                __post_step(game_session, next_choice, dispatcher)
+                sessions.save(game_session)
 
-                status_message = "{} {} {}".format(users, next_choice.text, choices)
+        else:
+            # They are not in the game
+            status_message = "Hey you! Get out! You're not part of this game! Start your own by tweeting @ me with #LetsPlay.".format(
+                game_request.user_name)
 
-                start_post_status = __send_to_twitter(status_message, None, twitter_api)
+            __send_to_twitter(status_message, game_request.status_id, dispatcher)
 
-                if start_post_status != False:
-                    game_session.TwitterSteps += [int(start_post_status.id)]
-                    game_session.CurrentTweetId = int(start_post_status.id)
-                    game_session.CurrentGameStep = next_choice.id
 
-                    # If they have reached an ending, mark the game as complete
-                    if next_choice.is_ending:
-                        game_session.GameState = str(GameState.GAME_COMPLETE)
 
-                    dynamodb_table.put_item(Item=game_session.AsDict())
+def __post_step(game_session, choice, dispatcher):
+    """
+    Post a step of the story to the players of a game, and move the game on to it
+    :param game_session:
+    :param choice: The step to post
+    :param dispatcher:
+    :return:
+    :raises StepPostFailedError: If the step could not be posted. The game is left as it was.
+    """
+    users = " ".join(["@{}".format(player) for player in game_session.Players])
+    status_message = "{} {} {}".format(users, choice.text, choice.hashtags)
 
-        else:
-            # They are not in the game
-            status_message = "Hey you! Get out! You're not part of this game! Start your own by tweeting @ me with #LetsPlay.".format(
-                game_request.user_name)
+    step_status = __send_to_twitter(status_message, None, dispatcher).result()
+
+    if step_status == False:
+        LOGGER.error('StepPostFailed', tweet_start_id=game_session.TweetStartId)
+        raise StepPostFailedError('Could not post step {} of game {}'.format(choice.id, game_session.TweetStartId))
+
+    __advance_game(game_session, choice, step_status)
+
+
+def __advance_game(game_session, choice, step_status):
+    """
+    Move a game on to a newly posted step, and open voting on it
+    :param game_session:
+    :param choice: The step that was posted
+    :param step_status: The posted twitter status for the step
+    :return:
+    """
+    current_time = int(time.time())
+
+    game_session.AddStep(step_status.id, choice.id, current_time)
+    game_session.CurrentTweetId = int(step_status.id)
+    game_session.CurrentGameStep = choice.id
+    game_session.CurrentVoters = None
+
+    # If they have reached an ending, mark the game as complete
+    if choice.is_ending:
+        game_session.Complete(current_time)
+    else:
+        game_session.GameState = str(GameState.PENDING_GAME_INPUT)
+        game_session.CurrentVotes = {option: 0 for option in choice.transitions}
+        game_session.VoteDeadline = current_time + VOTE_WINDOW_SECONDS
+        # A game that is still being played is not abandoned
+        game_session.ExpirationTime = current_time + GAME_LIFETIME_SECONDS
+
+
+def __round_is_closed(game_session):
+    """
+    A round is closed once every player has voted, or the voting deadline has passed
+    :param game_session:
+    :return:
+    """
+    voters = game_session.CurrentVoters or []
+
+    if all(player in voters for player in game_session.Players):
+        return True
 
-            __send_to_twitter(status_message, game_request.status_id, twitter_api)
+    return game_session.VoteDeadline is not None and int(game_session.VoteDeadline) <= time.time()
+
+
+def __tally_votes(choice, game_session):
+    """
+    Find the winning option of a round. Ties go to the option listed first.
+    :param choice: The step that was voted on
+    :param game_session:
+    :return: The lowercase key of the winning option
+    """
+    votes = game_session.CurrentVotes or {}
+    options = [option.lower() for option in choice.options]
 
+    return max(options, key=lambda option: (int(votes.get(option, 0)), -options.index(option)))
 
 
-def __send_error_tweet(game_request, twitter_api):
+def __send_error_tweet(game_request, dispatcher):
     status_message = "Hello @{}! I could not understand your request".format(game_request.user_name)
 
-    __send_to_twitter(status_message, game_request.status_id, twitter_api)
+    __send_to_twitter(status_message, game_request.status_id, dispatcher)
 
@@ -0,0 +1,246 @@
+import threading
+
+from src.game_store import GameSessionConflictError
+from src.logger import DEBUG, LOGGER
+from src.metrics import put_metrics
+
+
+class SessionCache(object):
+    """
+    A unit of work over a GameStore for a single batch of requests.
+
+    Each game is read from the store at most once per batch, every request for it is
+    applied to the same in memory GameSession, and the final state is written once
+    when the batch is flushed.
+
+    Requests can be handled on several threads at once. A game that is looked up is
+    held by the thread that looked it up until it calls end_request, so two requests
+    for the same game never change it at the same time. A request only looks up one
+    game, so threads never wait on each other's games.
+
+    The games each request used are kept until it ends, so the requests behind a game
+    that could not be saved when the batch is flushed can be retried.
+    """
+
+    def __init__(self, game_store):
+        self.game_store = game_store
+        self.sessions = {}
+        # Tweet id -> tweet start id, for the tweets looked up in this batch
+        self.tweets = {}
+        self.missing_tweet_ids = set()
+        self.claimed_creators = set()
+        self.creator_locks = {}
+        self.dirty = set()
+        self.lock = threading.RLock()
+        self.game_locks = {}
+        self.held = threading.local()
+
+        # Reads and writes the batch asked for, versus the ones that hit the store
+        self.requested_reads = 0
+        self.requested_writes = 0
+        self.reads = 0
+        self.writes = 0
+
+    def get_by_tweet(self, status_id):
+        """
+        Get a game by the id of any tweet the bot posted for it
+        :param status_id:
+        :return: The GameSession, or None if the tweet is not part of a game
+        """
+        status_id = int(status_id)
+
+        with self.lock:
+            self.requested_reads += 1
+            cached = self.__find_cached(status_id)
+            missing = status_id in self.missing_tweet_ids
+
+            if cached is None and not missing:
+                self.reads += 1
+
+        if cached is not None:
+            return self.__hold(cached)
+
+        if missing:
+            return None
+
+        game_session = self.game_store.get_by_tweet(status_id)
+
+        with self.lock:
+            if game_session is None:
+                self.missing_tweet_ids.add(status_id)
+                return None
+
+            # The game may already be in the batch, and have moved on since it was stored
+            game_session = self.__track(game_session)
+            self.tweets[status_id] = int(game_session.TweetStartId)
+
+        return self.__hold(game_session)
+
+    def claim_creator(self, user):
+        """
+        Claim the right for a user to create a game. Claims are written straight away,
+        so two requests to create a game can not both succeed.
+        :param user:
+        :return: False if the user already has an open game, or is creating one
+        """
+        with self.lock:
+            creator_lock = self.creator_locks.setdefault(user, threading.Lock())
+
+        # Only claims for the same creator wait on each other while the store is called
+        with creator_lock:
+            with self.lock:
+                if user in self.claimed_creators:
+                    return False
+
+                self.requested_writes += 1
+                self.writes += 1
+
+            if not self.game_store.claim_creator(user):
+                return False
+
+            with self.lock:
+                self.claimed_creators.add(user)
+
+            return True
+
+    def release_creator(self, user):
+        """
+        Give up a claim for a game that could not be created
+        :param user:
+        :return:
+        """
+        with self.lock:
+            self.requested_writes += 1
+            self.writes += 1
+
+        self.game_store.release_creator(user)
+
+    def save(self, game_session):
+        """
+        Mark a game as changed. It is written to the store when the batch is flushed.
+        :param game_session:
+        :return:
+        """
+        tweet_start_id = int(game_session.TweetStartId)
+
+        with self.lock:
+            self.requested_writes += 1
+            self.sessions[tweet_start_id] = game_session
+            self.dirty.add(tweet_start_id)
+
+        self.__use(tweet_start_id)
+
+    def record_vote(self, game_session, voter, option):
+        """
+        Count a vote straight away. Votes are atomic counters in the store, so they
+        are not held back until the batch is flushed.
+        :param game_session:
+        :param voter:
+        :param option:
+        :return: True if the vote was counted
+        """
+        tweet_start_id = int(game_session.TweetStartId)
+
+        with self.lock:
+            pending = tweet_start_id in self.dirty
+            self.writes += 2 if pending else 1
+            self.requested_writes += 1
+
+        # The vote is conditional on the stored step, so write any pending changes first
+        if pending:
+            self.game_store.save(game_session)
+
+            with self.lock:
+                self.dirty.discard(tweet_start_id)
+
+        return self.game_store.record_vote(game_session, voter, option)
+
+    def request_games(self):
+        """
+        :return: The start tweet ids of the games this thread looked up or saved for its request
+        """
+        return list(getattr(self.held, 'games', []))
+
+    def end_request(self):
+        """
+        Let other threads have the games this thread looked up for its request
+        :return:
+        """
+        for game_lock in getattr(self.held, 'locks', []):
+            game_lock.release()
+
+        self.held.locks = []
+        self.held.games = []
+
+    def flush(self):
+        """
+        Write every changed game to the store and report how many calls were saved
+        :return: The games that could not be saved because they conflicted with a change
+        made elsewhere, as a dict of start tweet id -> GameSessionConflictError
+        """
+        conflicts = {}
+
+        for tweet_start_id in self.dirty:
+            game_session = self.sessions[tweet_start_id]
+
+            if LOGGER.is_enabled(DEBUG):
+                LOGGER.debug('GameSaved', game_session=game_session.AsDict())
+
+            self.writes += 1
+
+            try:
+                self.game_store.save(game_session)
+            except GameSessionConflictError as e:
+                LOGGER.error('GameSaveFailed', tweet_start_id=tweet_start_id, error=str(e))
+                conflicts[tweet_start_id] = e
+
+        self.dirty = set()
+
+        put_metrics({
+            'DynamoReadsRequested': self.requested_reads,
+            'DynamoReadsSaved': self.requested_reads - self.reads,
+            'DynamoWritesRequested': self.requested_writes,
+            'DynamoWritesSaved': self.requested_writes - self.writes
+        })
+
+        return conflicts
+
+    def __hold(self, game_session):
+        with self.lock:
+            game_lock = self.game_locks.setdefault(int(game_session.TweetStartId), threading.RLock())
+
+        game_lock.acquire()
+
+        if not hasattr(self.held, 'locks'):
+            self.held.locks = []
+
+        self.held.locks.append(game_lock)
+        self.__use(int(game_session.TweetStartId))
+
+        return game_session
+
+    def __use(self, tweet_start_id):
+        if not hasattr(self.held, 'games'):
+            self.held.games = []
+
+        if tweet_start_id not in self.held.games:
+            self.held.games.append(tweet_start_id)
+
+    def __track(self, game_session):
+        tweet_start_id = int(game_session.TweetStartId)
+
+        if tweet_start_id not in self.sessions:
+            self.sessions[tweet_start_id] = game_session
+
+        return self.sessions[tweet_start_id]
+
+    def __find_cached(self, status_id):
+        if status_id in self.tweets:
+            return self.sessions[self.tweets[status_id]]
+
+        for game_session in self.sessions.values():
+            if int(game_session.TweetStartId) == status_id or (
+                    game_session.CurrentTweetId is not None and int(game_session.CurrentTweetId) == status_id):
+                return game_session
+
+        return None
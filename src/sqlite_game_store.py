@@ -0,0 +1,207 @@
+import json
+import sqlite3
+import threading
+import time
+
+from src.game_store import CREATOR_CLAIM_LEASE_SECONDS, GameStore, vote_is_allowed
+from src.models import GameSession, GameState
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS game_sessions ('
+    ' tweet_start_id INTEGER PRIMARY KEY,'
+    ' game_creator TEXT,'
+    ' game_state TEXT,'
+    ' version INTEGER,'
+    ' expires_at INTEGER,'
+    ' body TEXT NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS game_sessions_creator ON game_sessions (game_creator, game_state)',
+    'CREATE INDEX IF NOT EXISTS game_sessions_expires_at ON game_sessions (expires_at)',
+    'CREATE TABLE IF NOT EXISTS active_games ('
+    ' game_creator TEXT PRIMARY KEY,'
+    ' tweet_start_id INTEGER,'
+    ' lease_expiry INTEGER)',
+    'CREATE TABLE IF NOT EXISTS game_history ('
+    ' tweet_start_id INTEGER,'
+    ' step_number INTEGER,'
+    ' body TEXT NOT NULL,'
+    ' PRIMARY KEY (tweet_start_id, step_number))',
+    'CREATE TABLE IF NOT EXISTS game_tweets ('
+    ' status_id INTEGER PRIMARY KEY,'
+    ' tweet_start_id INTEGER NOT NULL)'
+]
+
+
+class SqliteGameStore(GameStore):
+    """
+    Stores game sessions in a SQLite database, for running SAMQuest on a single node.
+
+    The session is kept as a JSON document, with the fields that are looked up or
+    checked on save copied into their own indexed columns. Steps are rows of their own
+    in the game history table, and the tweets posted for each game in the game tweets table.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The database file, or ':memory:'
+        """
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.lock = threading.Lock()
+
+        with self.lock:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+
+    def get_by_start_tweet(self, tweet_start_id):
+        rows = self.__select('SELECT body FROM game_sessions WHERE tweet_start_id = ?', (int(tweet_start_id),))
+
+        return rows[0] if len(rows) > 0 else None
+
+    def get_by_tweet(self, status_id):
+        rows = self.__select('SELECT body FROM game_sessions JOIN game_tweets USING (tweet_start_id) '
+                             'WHERE status_id = ?', (int(status_id),))
+
+        return rows[0] if len(rows) > 0 else None
+
+    def get_active_by_creator(self, user):
+        return self.__select('SELECT body FROM game_sessions WHERE game_creator = ? AND game_state IS NOT ?',
+                             (user, str(GameState.GAME_COMPLETE)))
+
+    def get_expired(self, now):
+        return self.__select('SELECT body FROM game_sessions WHERE expires_at < ?', (int(now),))
+
+    def claim_creator(self, user, now=None):
+        now = int(time.time() if now is None else now)
+
+        with self.lock:
+            cursor = self.connection.execute('INSERT INTO active_games (game_creator, lease_expiry) VALUES (?, ?) '
+                                             'ON CONFLICT (game_creator) DO UPDATE SET lease_expiry = excluded.lease_expiry '
+                                             'WHERE tweet_start_id IS NULL AND lease_expiry < ?',
+                                             (user, now + CREATOR_CLAIM_LEASE_SECONDS, now))
+
+        return cursor.rowcount == 1
+
+    def bind_creator(self, user, tweet_start_id):
+        with self.lock:
+            self.connection.execute('INSERT INTO active_games (game_creator, tweet_start_id) VALUES (?, ?) '
+                                    'ON CONFLICT (game_creator) DO UPDATE SET tweet_start_id = excluded.tweet_start_id, '
+                                    'lease_expiry = NULL', (user, int(tweet_start_id)))
+
+    def release_creator(self, user, tweet_start_id=None):
+        with self.lock:
+            if tweet_start_id is None:
+                self.connection.execute('DELETE FROM active_games WHERE game_creator = ?', (user,))
+            else:
+                self.connection.execute('DELETE FROM active_games WHERE game_creator = ? AND tweet_start_id = ?',
+                                        (user, int(tweet_start_id)))
+
+    def get_history(self, tweet_start_id):
+        with self.lock:
+            rows = self.connection.execute('SELECT body FROM game_history WHERE tweet_start_id = ? '
+                                           'ORDER BY step_number', (int(tweet_start_id),)).fetchall()
+
+        return [json.loads(row[0]) for row in rows]
+
+    def record_vote(self, game_session, voter, option):
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+
+            try:
+                row = self.connection.execute('SELECT body FROM game_sessions WHERE tweet_start_id = ?',
+                                              (int(game_session.TweetStartId),)).fetchone()
+                item = None if row is None else self.__from_json(row[0])
+
+                if item is None or not vote_is_allowed(item, game_session.CurrentTweetId, voter, option):
+                    self.connection.execute('ROLLBACK')
+                    return False
+
+                item['CurrentVotes'][option] += 1
+                item['CurrentVoters'] = set(item.get('CurrentVoters') or ()) | {voter}
+
+                self.connection.execute('UPDATE game_sessions SET body = ? WHERE tweet_start_id = ?',
+                                        (self.__to_json(item), int(game_session.TweetStartId)))
+                self.connection.execute('COMMIT')
+            except Exception:
+                self.connection.execute('ROLLBACK')
+                raise
+
+        game_session.CurrentVotes = item['CurrentVotes']
+        game_session.CurrentVoters = item['CurrentVoters']
+        game_session.MarkSaved(['CurrentVotes', 'CurrentVoters'])
+
+        return True
+
+    def _insert(self, game_session):
+        item = game_session.AsDict()
+
+        try:
+            with self.lock:
+                self.connection.execute('INSERT INTO game_sessions (tweet_start_id, game_creator, game_state, '
+                                        'version, expires_at, body) VALUES (?, ?, ?, ?, ?, ?)',
+                                        self.__columns(item) + (self.__to_json(item),))
+        except sqlite3.IntegrityError:
+            return False
+
+        return True
+
+    def _update(self, game_session, saved, next_version):
+        item = game_session.AsDict()
+        item['Version'] = next_version
+        saved_version = saved.get('Version')
+
+        with self.lock:
+            cursor = self.connection.execute('UPDATE game_sessions SET game_creator = ?, game_state = ?, '
+                                             'version = ?, expires_at = ?, body = ? '
+                                             'WHERE tweet_start_id = ? AND version IS ?',
+                                             self.__columns(item)[1:] + (self.__to_json(item),
+                                                                         int(game_session.TweetStartId),
+                                                                         None if saved_version is None
+                                                                         else int(saved_version)))
+
+        return cursor.rowcount == 1
+
+    def _append_steps(self, tweet_start_id, steps, tweet_ids):
+        with self.lock:
+            self.connection.executemany('INSERT OR REPLACE INTO game_history (tweet_start_id, step_number, body) '
+                                        'VALUES (?, ?, ?)',
+                                        [(int(tweet_start_id), step['StepNumber'], json.dumps(step)) for step in steps])
+            self.connection.executemany('INSERT OR REPLACE INTO game_tweets (status_id, tweet_start_id) VALUES (?, ?)',
+                                        [(int(tweet_id), int(tweet_start_id)) for tweet_id in tweet_ids])
+
+    def __select(self, query, parameters):
+        with self.lock:
+            rows = self.connection.execute(query, parameters).fetchall()
+
+        sessions = []
+        for row in rows:
+            game_session = GameSession.NewFromJsonDict(self.__from_json(row[0]))
+            game_session.MarkSaved()
+            sessions.append(game_session)
+
+        return sessions
+
+    @staticmethod
+    def __columns(item):
+        # Like the sparse index in dynamo, only open games have an expiry
+        expires_at = item.get('ExpirationTime') if item.get('ExpiryShard') is not None else None
+
+        return (int(item['TweetStartId']), item.get('GameCreator'), item.get('GameState'), item.get('Version'),
+                None if expires_at is None else int(expires_at))
+
+    @staticmethod
+    def __to_json(item):
+        item = dict(item)
+
+        # JSON has no sets
+        if item.get('CurrentVoters') is not None:
+            item['CurrentVoters'] = sorted(item['CurrentVoters'])
+
+        return json.dumps(item)
+
+    @staticmethod
+    def __from_json(body):
+        item = json.loads(body)
+
+        if item.get('CurrentVoters') is not None:
+            item['CurrentVoters'] = set(item['CurrentVoters'])
+
+        return item
@@ -0,0 +1,130 @@
+from types import MappingProxyType
+
+
+class StoryError(Exception):
+    pass
+
+
+class StoryValidationError(StoryError):
+    """
+    Raised when a story definition has dangling or unreachable steps
+    """
+    pass
+
+
+class UnknownChoiceError(StoryError):
+    pass
+
+
+class StoryNode(object):
+    """
+    A single step of a compiled story. Nodes are immutable once built.
+    """
+    __slots__ = ('id', 'text', 'is_ending', 'options', 'hashtags', 'transitions')
+
+    def __init__(self, id, text, is_ending, options):
+        object.__setattr__(self, 'id', id)
+        object.__setattr__(self, 'text', text)
+        object.__setattr__(self, 'is_ending', is_ending)
+        object.__setattr__(self, 'options', tuple(key for (key, _) in options))
+        # Pre-rendered so posting a step does not rebuild the hashtag string
+        object.__setattr__(self, 'hashtags', ' '.join('#' + key for (key, _) in options))
+        # Lowercase hashtag -> next node id, matching the lowercased hashtags on a GameRequest
+        object.__setattr__(self, 'transitions',
+                           MappingProxyType({key.lower(): next_id for (key, next_id) in options}))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('StoryNode is immutable')
+
+    def select_option(self, hashtags):
+        """
+        Find the option a set of hashtags picks
+        :param hashtags: The lowercase hashtags of a tweet
+        :return: The lowercase option key, or None unless exactly one option was chosen
+        """
+        keys = [tag for tag in set(hashtags) if tag in self.transitions]
+
+        if len(keys) != 1:
+            return None
+
+        return keys[0]
+
+    def select(self, hashtags):
+        """
+        Find the node a set of hashtags leads to
+        :param hashtags: The lowercase hashtags of a tweet
+        :return: The next node id, or None unless exactly one option was chosen
+        """
+        key = self.select_option(hashtags)
+
+        if key is None:
+            return None
+
+        return self.transitions[key]
+
+    def __str__(self):
+        return self.text
+
+
+class CompiledStory(object):
+    __slots__ = ('nodes', 'start_id')
+
+    def __init__(self, nodes, start_id):
+        object.__setattr__(self, 'nodes', MappingProxyType(nodes))
+        object.__setattr__(self, 'start_id', start_id)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('CompiledStory is immutable')
+
+    def get(self, node_id):
+        try:
+            return self.nodes[node_id]
+        except KeyError:
+            raise UnknownChoiceError('This situation doesnt exist! ({})'.format(node_id))
+
+
+def compile_story(definition, start_id=1):
+    """
+    Compile a story definition into an immutable graph, validating it once up front.
+
+    The definition is a dict of node id -> {'text', 'is_ending', 'options': [{'key', 'next_id'}]}
+    :param definition: The story definition
+    :param start_id: The id of the first step of the story
+    :return: A CompiledStory
+    """
+    nodes = {}
+
+    for (node_id, step) in definition.items():
+        options = [(option['key'], option['next_id']) for option in step.get('options', [])]
+        is_ending = step.get('is_ending', False)
+
+        if is_ending == (len(options) > 0):
+            raise StoryValidationError('Step {} must either be an ending or have options'.format(node_id))
+
+        if len(set(key.lower() for (key, _) in options)) != len(options):
+            raise StoryValidationError('Step {} has duplicate options'.format(node_id))
+
+        nodes[node_id] = StoryNode(node_id, step['text'], is_ending, options)
+
+    if start_id not in nodes:
+        raise StoryValidationError('The start step {} does not exist'.format(start_id))
+
+    for node in nodes.values():
+        for next_id in node.transitions.values():
+            if next_id not in nodes:
+                raise StoryValidationError('Step {} leads to missing step {}'.format(node.id, next_id))
+
+    reachable = set()
+    to_visit = [start_id]
+
+    while len(to_visit) > 0:
+        node_id = to_visit.pop()
+        if node_id not in reachable:
+            reachable.add(node_id)
+            to_visit.extend(nodes[node_id].transitions.values())
+
+    unreachable = sorted(set(nodes) - reachable)
+    if len(unreachable) > 0:
+        raise StoryValidationError('Steps {} cannot be reached'.format(unreachable))
+
+    return CompiledStory(nodes, start_id)
@@ -0,0 +1,209 @@
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from src.logger import LOGGER
+
+# Twitter allows 300 status updates per account every 3 hours
+STATUS_UPDATE_LIMIT = 300
+STATUS_UPDATE_WINDOW_SECONDS = 3 * 60 * 60
+
+# How many updates the shared budget lets out at once. The rest of the limit refills over the window,
+# so no 3 hour window can see more than STATUS_UPDATE_LIMIT updates.
+STATUS_UPDATE_BURST = 30
+
+# The item of the shared budget in its table
+STATUS_UPDATE_BUCKET_NAME = 'StatusUpdates'
+
+MAX_WORKERS = 4
+
+
+class TokenBucket(object):
+    """
+    A thread safe token bucket. Tokens refill continuously up to the bucket capacity.
+    """
+
+    def __init__(self, capacity, refill_per_second, clock=time.time, sleep=time.sleep):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = float(capacity)
+        self.last_refill = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self, deadline=None):
+        """
+        Take a token, waiting for one to refill if the bucket is empty
+        :param deadline: The epoch time, on the bucket's clock, to give up waiting at. Defaults to waiting for as
+        long as it takes.
+        :return: How long the caller waited, in seconds, or None if no token would refill before the deadline
+        """
+        waited = 0.0
+
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.refill_per_second)
+                self.last_refill = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+
+                wait = (1 - self.tokens) / self.refill_per_second
+
+                if deadline is not None and now + wait > deadline:
+                    return None
+
+            self.sleep(wait)
+            waited += wait
+
+
+class SharedTokenBucket(object):
+    """
+    A token bucket kept in a DynamoDB item, so every process posting for the account
+    draws from the same budget. Takes the same calls as TokenBucket.
+
+    A token is taken with a write conditional on the refill time that was read, so two
+    processes never take the same token. The budget is only as shared as the processes
+    that use it, anything posting outside of it is not counted.
+    """
+
+    def __init__(self, dynamodb_table, name=STATUS_UPDATE_BUCKET_NAME, capacity=STATUS_UPDATE_BURST,
+                 refill_per_second=float(STATUS_UPDATE_LIMIT - STATUS_UPDATE_BURST) / STATUS_UPDATE_WINDOW_SECONDS,
+                 clock=time.time, sleep=time.sleep):
+        """
+        :param dynamodb_table: The table the bucket is kept in, keyed by BucketName
+        :param name: The key of the bucket's item
+        :param capacity: The most tokens the bucket holds. It starts full.
+        :param refill_per_second:
+        :param clock:
+        :param sleep:
+        """
+        self.dynamodb_table = dynamodb_table
+        self.name = name
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.clock = clock
+        self.sleep = sleep
+
+    def acquire(self, deadline=None):
+        """
+        Take a token, waiting for one to refill if the bucket is empty
+        :param deadline: The epoch time, on the bucket's clock, to give up waiting at. Defaults to waiting for as
+        long as it takes.
+        :return: How long the caller waited, in seconds, or None if no token would refill before the deadline
+        """
+        waited = 0.0
+
+        while True:
+            now = self.clock()
+            item = self.dynamodb_table.get_item(Key={'BucketName': self.name}, ConsistentRead=True).get('Item')
+
+            if item is None:
+                tokens = float(self.capacity)
+            else:
+                tokens = min(self.capacity, float(item['Tokens']) +
+                             (now - float(item['LastRefill'])) * self.refill_per_second)
+
+            if tokens >= 1:
+                if self.__take(item, tokens - 1, now):
+                    return waited
+
+                # Another process took a token since it was read
+                continue
+
+            wait = (1 - tokens) / self.refill_per_second
+
+            if deadline is not None and now + wait > deadline:
+                return None
+
+            self.sleep(wait)
+            waited += wait
+
+    def __take(self, item, tokens, now):
+        put_args = {'Item': {'BucketName': self.name, 'Tokens': Decimal(repr(tokens)),
+                             'LastRefill': Decimal(repr(now))}}
+
+        if item is None:
+            put_args['ConditionExpression'] = 'attribute_not_exists(BucketName)'
+        else:
+            put_args['ConditionExpression'] = 'LastRefill = :last_refill'
+            put_args['ExpressionAttributeValues'] = {':last_refill': item['LastRefill']}
+
+        try:
+            self.dynamodb_table.put_item(**put_args)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+        return True
+
+
+# Shared by every dispatcher in the process, so warm invocations keep the remaining budget. It only limits
+# this process: it starts full after every cold start, and every other process posting for the account has
+# its own, so it does not keep the account under the twitter limit. Deployed functions use a
+# SharedTokenBucket for that, this is for local runs and tests.
+STATUS_UPDATE_BUCKET = TokenBucket(STATUS_UPDATE_LIMIT, float(STATUS_UPDATE_LIMIT) / STATUS_UPDATE_WINDOW_SECONDS)
+
+
+class TweetDispatcher(object):
+    """
+    Posts status updates from a bounded pool of workers, rate limited by a token bucket.
+
+    post() returns a future straight away. Callers that need the posted status (to
+    record a game step) wait on it, everything else is fire and forget.
+
+    Given a deadline, updates that would have to wait for a token past it are not posted,
+    so waiting on the futures, or shutting down, returns by then.
+    """
+
+    def __init__(self, twitter_api, max_workers=MAX_WORKERS, bucket=STATUS_UPDATE_BUCKET, deadline=None):
+        """
+        :param twitter_api:
+        :param max_workers: How many updates are posted at the same time
+        :param bucket: The TokenBucket updates are rate limited by
+        :param deadline: The epoch time updates stop waiting for a token at. Defaults to none.
+        """
+        self.twitter_api = twitter_api
+        self.bucket = bucket
+        self.deadline = deadline
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def post(self, status, in_reply_to_status_id=None):
+        """
+        Queue a status update
+        :param status: The status text
+        :param in_reply_to_status_id: The status being replied to, if any
+        :return: A future for the posted twitter Status, or False if posting failed or the deadline passed
+        """
+        return self.executor.submit(self.__post, status, in_reply_to_status_id)
+
+    def shutdown(self, wait=True):
+        """
+        Stop accepting updates. By default this waits for every queued update to be posted.
+        :param wait:
+        :return:
+        """
+        self.executor.shutdown(wait=wait)
+
+    def __post(self, status, in_reply_to_status_id):
+        waited = self.bucket.acquire(self.deadline)
+
+        if waited is None:
+            LOGGER.warning('StatusUpdateDeadlinePassed', in_reply_to_status_id=in_reply_to_status_id)
+            return False
+
+        if waited > 0:
+            LOGGER.warning('StatusUpdateThrottled', waited_seconds=round(waited, 1))
+
+        try:
+            return self.twitter_api.PostUpdate(status=status, in_reply_to_status_id=in_reply_to_status_id)
+        except Exception as e:
+            LOGGER.error('StatusUpdateFailed', in_reply_to_status_id=in_reply_to_status_id, error=str(e))
+            return False
@@ -0,0 +1,143 @@
+from collections import OrderedDict
+import time
+
+from twitter.error import TwitterError
+
+from src.logger import LOGGER
+
+MAX_CACHED_USERS = 5000
+USER_TTL_SECONDS = 60 * 60
+
+# twitter allows up to 100 users per users/lookup call
+USERS_LOOKUP_BATCH_SIZE = 100
+
+
+class UserCache(object):
+    """
+    A bounded LRU cache of twitter user id -> screen name, where entries expire
+    after a fixed time to live.
+    """
+
+    def __init__(self, max_size=MAX_CACHED_USERS, ttl=USER_TTL_SECONDS, clock=time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+
+    def get(self, user_id):
+        entry = self.entries.get(user_id)
+
+        if entry is None:
+            return None
+
+        (screen_name, expires_at) = entry
+
+        if expires_at <= self.clock():
+            del self.entries[user_id]
+            return None
+
+        self.entries.move_to_end(user_id)
+        return screen_name
+
+    def put(self, user_id, screen_name):
+        self.entries[user_id] = (screen_name, self.clock() + self.ttl)
+        self.entries.move_to_end(user_id)
+
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# Kept at module level so warm lambda invocations reuse it
+USER_CACHE = UserCache()
+
+
+class UserResolver(object):
+    """
+    Resolves the screen name for the author of a status. The lookup order is:
+
+    Embedded user on the status -> Cached user -> Batched users/lookup call
+    """
+
+    def __init__(self, twitter_api, cache=USER_CACHE):
+        self.twitter_api = twitter_api
+        self.cache = cache
+        self.embedded_hits = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.lookup_calls = 0
+        self.lookup_failures = 0
+        # The users whose lookup failed on the last resolve_all, which may be found on a later poll
+        self.unresolved_user_ids = set()
+
+    def resolve_all(self, posts):
+        """
+        Get the screen name of the author of every status, using as few
+        users/lookup calls as possible.
+        :param posts: The twitter statuses
+        :return: A dict of user id -> screen name. Users that could not be found, or whose
+        lookup failed, are left out
+        """
+        screen_names = {}
+        missing = []
+        self.unresolved_user_ids = set()
+
+        for post in posts:
+            if post.user is None:
+                continue
+
+            user_id = post.user.id
+            screen_name = post.user.screen_name
+
+            if screen_name is not None:
+                self.embedded_hits += 1
+                self.cache.put(user_id, screen_name)
+                screen_names[user_id] = screen_name
+                continue
+
+            screen_name = screen_names.get(user_id) or self.cache.get(user_id)
+
+            if screen_name is not None:
+                self.cache_hits += 1
+                screen_names[user_id] = screen_name
+            else:
+                self.cache_misses += 1
+                if user_id not in missing:
+                    missing.append(user_id)
+
+        for start in range(0, len(missing), USERS_LOOKUP_BATCH_SIZE):
+            batch = missing[start:start + USERS_LOOKUP_BATCH_SIZE]
+            self.lookup_calls += 1
+
+            try:
+                users = self.twitter_api.UsersLookup(user_id=batch)
+            except TwitterError as e:
+                self.lookup_failures += 1
+                self.unresolved_user_ids.update(batch)
+                LOGGER.warning('UsersLookupFailed', users=len(batch), error=str(e))
+                continue
+
+            for user in users:
+                self.cache.put(user.id, user.screen_name)
+                screen_names[user.id] = user.screen_name
+
+        return screen_names
+
+    def stats(self):
+        return {
+            'EmbeddedHits': self.embedded_hits,
+            'CacheHits': self.cache_hits,
+            'CacheMisses': self.cache_misses,
+            'LookupCalls': self.lookup_calls,
+            'LookupFailures': self.lookup_failures,
+            'CachedUsers': len(self.cache)
+        }
+
+    def is_unresolved(self, post):
+        """
+        :param post: A twitter status passed to the last resolve_all
+        :return: True if the lookup of its author failed, rather than the author not being found
+        """
+        return post.user is not None and post.user.id in self.unresolved_user_ids
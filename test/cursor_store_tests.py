@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+from src.cursor_store import CursorStore, CURSOR_CACHE, FileCursorStore, compact_history
+from test_resources import get_twitter_post_processing_table
+from moto import mock_dynamodb2
+
+
+@mock_dynamodb2
+class TestCursorStore(unittest.TestCase):
+
+    def setUp(self):
+        CURSOR_CACHE.clear()
+        self.dynamodb_table = get_twitter_post_processing_table()
+
+        for item in self.dynamodb_table.scan()['Items']:
+            self.dynamodb_table.delete_item(Key={'TwitterAccount': item['TwitterAccount'],
+                                                 'TwitterPostId': item['TwitterPostId']})
+
+    def test_cursor_only_moves_forward(self):
+        cursor_store = CursorStore(self.dynamodb_table)
+        cursor_store.advance(20)
+
+        # Another poller moves the cursor on
+        CursorStore(self.dynamodb_table).advance(30)
+        CURSOR_CACHE.clear()
+        cursor_store.advance(25)
+
+        self.assertEqual(30, cursor_store.get())
+
+    def test_history_is_compacted_into_the_cursor(self):
+        for post_id in [5, 7, 6]:
+            self.dynamodb_table.put_item(Item={'TwitterAccount': '@SAMQuest9', 'TwitterPostId': post_id})
+
+        self.assertEqual(7, CursorStore(self.dynamodb_table).get())
+        self.assertEqual(3, compact_history(self.dynamodb_table))
+
+        CURSOR_CACHE.clear()
+        self.assertEqual(7, CursorStore(self.dynamodb_table).get())
+        self.assertEqual(1, self.dynamodb_table.scan()['Count'])
+
+
+class TestFileCursorStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def test_cursor_only_moves_forward(self):
+        cursor_store = FileCursorStore(os.path.join(self.directory, 'cursor.json'))
+        self.assertIsNone(cursor_store.get())
+
+        cursor_store.advance(30)
+        cursor_store.advance(25)
+
+        self.assertEqual(30, FileCursorStore(os.path.join(self.directory, 'cursor.json')).get())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
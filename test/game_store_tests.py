@@ -0,0 +1,291 @@
+import unittest
+from src.game_store import CREATOR_CLAIM_LEASE_SECONDS, DynamoGameStore, GameSessionConflictError, GameStore
+from src.memory_game_store import InMemoryGameStore
+from src.models import GameSession, GameState
+from src.sqlite_game_store import SqliteGameStore
+from test_resources import get_active_game_table, get_game_history_table, get_game_state_table, \
+    get_tweet_index_table
+from moto import mock_dynamodb2
+
+
+@mock_dynamodb2
+class TestDynamoGameStore(unittest.TestCase):
+
+    def setUp(self):
+        dynamodb_table = get_game_state_table()
+        dynamodb_table.delete_item(Key={'TweetStartId': 400})
+        self.game_store = DynamoGameStore(dynamodb_table)
+
+        game_session = GameSession.NewFromJsonDict({
+            'TweetStartId': 400,
+            'GameState': str(GameState.PENDING_GAME_START),
+            'GameCreator': 'rory_jacob',
+            'Players': ['rory_jacob'],
+            'StepCount': 1
+        })
+        self.game_store.save(game_session)
+
+    def test_concurrent_joiners_are_merged(self):
+        first = self.game_store.get_by_start_tweet(400)
+        second = self.game_store.get_by_start_tweet(400)
+
+        first.Players += ['player_one']
+        second.Players += ['player_two']
+        self.game_store.save(first)
+        self.game_store.save(second)
+
+        latest = self.game_store.get_by_start_tweet(400)
+        self.assertEqual(['rory_jacob', 'player_one', 'player_two'], latest.Players)
+        self.assertEqual(3, latest.Version)
+
+    def test_conflicting_state_changes_are_rejected(self):
+        first = self.game_store.get_by_start_tweet(400)
+        second = self.game_store.get_by_start_tweet(400)
+
+        first.GameState = str(GameState.PENDING_GAME_INPUT)
+        first.CurrentTweetId = 401
+        second.CurrentTweetId = 402
+        self.game_store.save(first)
+
+        with self.assertRaises(GameSessionConflictError):
+            self.game_store.save(second)
+
+        self.assertEqual(401, self.game_store.get_by_start_tweet(400).CurrentTweetId)
+
+    def test_only_changed_fields_are_written(self):
+        game_session = self.game_store.get_by_start_tweet(400)
+        game_session.Players += ['player_one']
+
+        self.game_store.dynamodb_table.update_item(Key={'TweetStartId': 400},
+                                                   UpdateExpression='SET CreationTime = :time',
+                                                   ExpressionAttributeValues={':time': 12345})
+        self.game_store.save(game_session)
+
+        latest = self.game_store.get_by_start_tweet(400)
+        self.assertEqual(['rory_jacob', 'player_one'], latest.Players)
+        self.assertEqual(12345, latest.CreationTime)
+
+    def test_reads_leave_out_attributes_that_are_not_session_fields(self):
+        self.game_store.dynamodb_table.update_item(Key={'TweetStartId': 400},
+                                                   UpdateExpression='SET TwitterSteps = :steps',
+                                                   ExpressionAttributeValues={':steps': [399]})
+
+        self.assertNotIn('TwitterSteps', self.game_store.get_by_start_tweet(400).SavedState())
+        self.assertEqual([400], [game.TweetStartId for game in self.game_store.get_active_by_creator('rory_jacob')])
+
+
+class GameStoreContract(object):
+    """
+    The behaviour every GameStore has to provide. Mixed into a TestCase per backend.
+    """
+
+    def create_store(self):
+        raise NotImplementedError()
+
+    def setUp(self):
+        self.game_store = self.create_store()
+        game_session = GameSession.NewFromJsonDict({
+            'TweetStartId': 400,
+            'GameState': str(GameState.PENDING_GAME_INPUT),
+            'GameCreator': 'rory_jacob',
+            'Players': ['rory_jacob', 'player_one'],
+            'CurrentTweetId': 401,
+            'CurrentGameStep': 1,
+            'CurrentVotes': {'readnote': 0, 'tree': 0}
+        })
+        game_session.AddStep(399, None, 1000)
+        game_session.AddStep(401, 1, 1000)
+        self.game_store.save(game_session)
+
+    def test_games_are_found_by_every_lookup(self):
+        self.assertEqual(1, self.game_store.get_by_start_tweet(400).Version)
+        self.assertEqual(400, self.game_store.get_by_tweet(400).TweetStartId)
+        self.assertEqual(400, self.game_store.get_by_tweet(401).TweetStartId)
+        self.assertEqual([400], [game.TweetStartId for game in self.game_store.get_active_by_creator('rory_jacob')])
+        self.assertIsNone(self.game_store.get_by_start_tweet(404))
+        self.assertIsNone(self.game_store.get_by_tweet(404))
+
+        # The player's #LetsPlay tweet is in the history, but is not a tweet of the game
+        self.assertIsNone(self.game_store.get_by_tweet(399))
+
+    def test_lookups_follow_saved_changes(self):
+        game_session = self.game_store.get_by_start_tweet(400)
+        game_session.AddStep(402, 2, 1000)
+        game_session.CurrentTweetId = 402
+        game_session.GameState = str(GameState.GAME_COMPLETE)
+        self.game_store.save(game_session)
+
+        # Older steps still find the game, which has moved on from them
+        self.assertEqual(402, self.game_store.get_by_tweet(401).CurrentTweetId)
+        self.assertEqual(402, self.game_store.get_by_tweet(402).CurrentTweetId)
+        self.assertEqual([], self.game_store.get_active_by_creator('rory_jacob'))
+
+    def test_concurrent_joiners_are_merged(self):
+        first = self.game_store.get_by_start_tweet(400)
+        second = self.game_store.get_by_start_tweet(400)
+
+        first.Players += ['player_two']
+        second.Players += ['player_three']
+        self.game_store.save(first)
+        self.game_store.save(second)
+
+        latest = self.game_store.get_by_start_tweet(400)
+        self.assertEqual(['rory_jacob', 'player_one', 'player_two', 'player_three'], latest.Players)
+        self.assertEqual(3, latest.Version)
+
+    def test_conflicting_state_changes_are_rejected(self):
+        first = self.game_store.get_by_start_tweet(400)
+        second = self.game_store.get_by_start_tweet(400)
+
+        first.CurrentTweetId = 402
+        second.CurrentTweetId = 403
+        self.game_store.save(first)
+
+        with self.assertRaises(GameSessionConflictError):
+            self.game_store.save(second)
+
+    def test_new_game_cannot_replace_an_existing_one(self):
+        with self.assertRaises(GameSessionConflictError):
+            self.game_store.save(GameSession.NewFromJsonDict({'TweetStartId': 400, 'GameCreator': 'someone_else'}))
+
+    def test_expired_games_are_completed(self):
+        game_session = self.game_store.get_by_start_tweet(400)
+        game_session.ExpirationTime = 1000
+        game_session.ExpiryShard = 1
+        self.game_store.save(game_session)
+
+        expired = self.game_store.get_expired(1001)
+        self.assertEqual([400], [game.TweetStartId for game in expired])
+        self.assertEqual([], self.game_store.get_expired(999))
+
+        expired[0].Complete(1001)
+        self.game_store.complete_expired(expired)
+
+        self.assertEqual([], self.game_store.get_expired(1001))
+        self.assertEqual([], self.game_store.get_active_by_creator('rory_jacob'))
+
+    def test_expired_games_that_moved_on_are_not_completed(self):
+        game_session = self.game_store.get_by_start_tweet(400)
+        game_session.ExpirationTime = 1000
+        game_session.ExpiryShard = 1
+        self.game_store.save(game_session)
+
+        expired = self.game_store.get_expired(1001)
+
+        # A player joins after the sweeper read the game
+        latest = self.game_store.get_by_start_tweet(400)
+        latest.Players += ['player_one']
+        self.game_store.save(latest)
+
+        expired[0].Complete(1001)
+
+        self.assertEqual([], self.game_store.complete_expired(expired))
+        self.assertNotEqual(str(GameState.GAME_COMPLETE), self.game_store.get_by_start_tweet(400).GameState)
+        self.assertFalse(self.game_store.claim_creator('rory_jacob', now=10 ** 10))
+
+    def test_creator_can_only_claim_one_game(self):
+        self.assertTrue(self.game_store.claim_creator('player_one', now=1000))
+        self.assertFalse(self.game_store.claim_creator('player_one', now=1001))
+
+        # A claim that was never used runs out
+        self.assertTrue(self.game_store.claim_creator('player_one', now=1000 + CREATOR_CLAIM_LEASE_SECONDS + 1))
+
+    def test_creator_claim_is_held_until_the_game_completes(self):
+        self.assertFalse(self.game_store.claim_creator('rory_jacob', now=10 ** 10))
+
+        game_session = self.game_store.get_by_start_tweet(400)
+        game_session.Complete(1000)
+        self.game_store.save(game_session)
+
+        self.assertTrue(self.game_store.claim_creator('rory_jacob'))
+
+    def test_steps_are_appended_to_the_history(self):
+        game_session = self.game_store.get_by_start_tweet(400)
+        game_session.AddStep(402, 2, 1000)
+        game_session.CurrentTweetId = 402
+        self.game_store.save(game_session)
+
+        # Saving again does not write the step twice
+        game_session.CurrentGameStep = 2
+        self.game_store.save(game_session)
+
+        latest = self.game_store.get_by_start_tweet(400)
+        self.assertEqual(3, latest.StepCount)
+        self.assertEqual([], latest.NewSteps())
+        self.assertEqual([(1, 399), (2, 401), (3, 402)], [(step['StepNumber'], step['StepTweetId'])
+                                                          for step in self.game_store.get_history(400)])
+        self.assertEqual(2, self.game_store.get_history(400)[-1]['GameStep'])
+
+    def test_new_games_write_their_first_step(self):
+        game_session = GameSession.NewFromJsonDict({'TweetStartId': 500, 'GameCreator': 'player_one',
+                                                    'Players': ['player_one']})
+        game_session.AddStep(499, None, 1000)
+        self.game_store.save(game_session)
+
+        self.assertEqual([(1, 499)], [(step['StepNumber'], step['StepTweetId'])
+                                      for step in self.game_store.get_history(500)])
+        self.assertNotIn('GameStep', self.game_store.get_history(500)[0])
+
+    def test_players_vote_once_per_step(self):
+        game_session = self.game_store.get_by_start_tweet(400)
+
+        self.assertTrue(self.game_store.record_vote(game_session, 'rory_jacob', 'tree'))
+        self.assertFalse(self.game_store.record_vote(game_session, 'rory_jacob', 'readnote'))
+        self.assertFalse(self.game_store.record_vote(game_session, 'player_one', 'missing'))
+
+        latest = self.game_store.get_by_start_tweet(400)
+        self.assertEqual({'readnote': 0, 'tree': 1}, latest.CurrentVotes)
+        self.assertEqual({'rory_jacob'}, latest.CurrentVoters)
+        self.assertEqual(game_session.CurrentVotes, latest.CurrentVotes)
+
+
+@mock_dynamodb2
+class TestDynamoGameStoreContract(GameStoreContract, unittest.TestCase):
+
+    def create_store(self):
+        dynamodb_table = get_game_state_table()
+        active_game_table = get_active_game_table()
+        history_table = get_game_history_table()
+        tweet_index_table = get_tweet_index_table()
+
+        for item in dynamodb_table.scan()['Items']:
+            dynamodb_table.delete_item(Key={'TweetStartId': item['TweetStartId']})
+
+        for item in active_game_table.scan()['Items']:
+            active_game_table.delete_item(Key={'GameCreator': item['GameCreator']})
+
+        for item in history_table.scan()['Items']:
+            history_table.delete_item(Key={'TweetStartId': item['TweetStartId'], 'StepNumber': item['StepNumber']})
+
+        for item in tweet_index_table.scan()['Items']:
+            tweet_index_table.delete_item(Key={'StatusId': item['StatusId']})
+
+        return DynamoGameStore(dynamodb_table, active_game_table, history_table, tweet_index_table)
+
+
+class TestInMemoryGameStore(GameStoreContract, unittest.TestCase):
+
+    def create_store(self):
+        return InMemoryGameStore()
+
+
+class TestSqliteGameStore(GameStoreContract, unittest.TestCase):
+
+    def create_store(self):
+        return SqliteGameStore(':memory:')
+
+
+class TestGameStore(unittest.TestCase):
+
+    def test_a_store_missing_a_method_can_not_be_created(self):
+        class IncompleteGameStore(GameStore):
+
+            def get_by_start_tweet(self, tweet_start_id):
+                return None
+
+        with self.assertRaises(TypeError):
+            IncompleteGameStore()
+
+
+if __name__ == '__main__':
+    unittest.main()
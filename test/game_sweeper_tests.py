@@ -0,0 +1,64 @@
+import unittest
+from src.game_store import DynamoGameStore
+from src.game_sweeper import sweep_expired_games
+from src.models import GameState
+from src.tweet_dispatcher import TokenBucket, TweetDispatcher
+from test_resources import get_game_state_table, MockTwitterApi
+from moto import mock_dynamodb2
+
+NOW = 1000000
+
+
+@mock_dynamodb2
+class TestGameSweeper(unittest.TestCase):
+
+    def setUp(self):
+        self.dynamodb_table = get_game_state_table()
+
+        for item in self.dynamodb_table.scan()['Items']:
+            self.dynamodb_table.delete_item(Key={'TweetStartId': item['TweetStartId']})
+
+        def game(tweet_start_id, game_state, expiration_time, expiry_shard):
+            item = {'TweetStartId': tweet_start_id, 'GameState': str(game_state), 'GameCreator': 'rory_jacob',
+                    'Players': ['rory_jacob', 'player_one'], 'StepCount': 1,
+                    'ExpirationTime': expiration_time, 'Version': 1}
+
+            if expiry_shard is not None:
+                item['ExpiryShard'] = expiry_shard
+
+            self.dynamodb_table.put_item(Item=item)
+
+        game(600, GameState.PENDING_GAME_START, NOW - 10, 1)
+        game(700, GameState.PENDING_GAME_INPUT, NOW - 10, 3)
+        game(800, GameState.PENDING_GAME_INPUT, NOW + 10, 2)
+        game(900, GameState.GAME_COMPLETE, NOW - 10, None)
+
+    def test_expired_open_games_are_completed(self):
+        twitter_api = MockTwitterApi()
+        dispatcher = TweetDispatcher(twitter_api, bucket=TokenBucket(10, 1))
+
+        ended = sweep_expired_games(DynamoGameStore(self.dynamodb_table), dispatcher, now=NOW)
+        dispatcher.shutdown()
+
+        self.assertEqual([600, 700], sorted(game_session.TweetStartId for game_session in ended))
+        self.assertEqual(2, len(twitter_api.posts))
+
+        item = self.dynamodb_table.get_item(Key={'TweetStartId': 700})['Item']
+        self.assertEqual(str(GameState.GAME_COMPLETE), item['GameState'])
+        self.assertNotIn('ExpiryShard', item)
+        self.assertGreater(item['PurgeTime'], NOW)
+        self.assertEqual(2, item['Version'])
+
+        open_item = self.dynamodb_table.get_item(Key={'TweetStartId': 800})['Item']
+        self.assertEqual(str(GameState.PENDING_GAME_INPUT), open_item['GameState'])
+
+    def test_swept_games_are_not_swept_again(self):
+        game_store = DynamoGameStore(self.dynamodb_table)
+
+        sweep_expired_games(game_store, now=NOW)
+
+        self.assertEqual([], sweep_expired_games(game_store, now=NOW))
+
+
+if __name__ == '__main__':
+    unittest.main()
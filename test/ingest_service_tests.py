@@ -0,0 +1,221 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from twitter.error import TwitterError
+
+from test_resources import MockTwitterApi, create_mention
+from src.cursor_store import FileCursorStore
+from src.ingest_service import IngestService
+from src.memory_game_store import InMemoryGameStore
+from src.mention_sources import PollingSource, ReplaySource, WebhookSource
+from src.request_sinks import GameStateSink
+from src.user_cache import UserCache, UserResolver
+
+
+def mention_json(status_id, user_id, hashtags, in_reply_to_status_id=None):
+    return {
+        'id': status_id,
+        'text': '@SAMQuest9 ' + ' '.join(['#' + tag for tag in hashtags]),
+        'in_reply_to_status_id': in_reply_to_status_id,
+        'user': {'id': user_id, 'screen_name': 'user_{}'.format(user_id)},
+        'entities': {'hashtags': [{'text': tag} for tag in hashtags]}
+    }
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class RecordingSink(object):
+    """
+    Takes every request, except the ones it was told to refuse
+    """
+
+    def __init__(self, refusals=None):
+        self.published = []
+        # Status id -> how many more times it is refused, or None to always refuse it
+        self.refusals = refusals or {}
+
+    async def publish(self, game_requests):
+        acknowledged = set()
+
+        for game_request in game_requests:
+            refusals = self.refusals.get(game_request.status_id, 0)
+
+            if refusals is None or refusals > 0:
+                self.refusals[game_request.status_id] = None if refusals is None else refusals - 1
+                continue
+
+            self.published.append(game_request.status_id)
+            acknowledged.add(game_request.status_id)
+
+        return acknowledged
+
+
+class TestIngestService(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.replay_path = os.path.join(self.directory, 'mentions.jsonl')
+        self.cursor_store = FileCursorStore(os.path.join(self.directory, 'cursor.json'))
+        self.twitter_api = MockTwitterApi()
+
+        with open(self.replay_path, 'w') as replay_file:
+            for mention in [mention_json(13, 3, ['JoinGame'], 11), mention_json(11, 1, ['LetsPlay']),
+                            mention_json(12, 2, ['JoinGame'], 11)]:
+                replay_file.write(json.dumps(mention) + '\n')
+
+    def service(self, source, sink, **kwargs):
+        return IngestService(source, sink, self.cursor_store, UserResolver(self.twitter_api, cache=UserCache()),
+                             base_backoff=0.01, **kwargs)
+
+    def test_replayed_mentions_are_published_in_order_and_checkpointed(self):
+        sink = RecordingSink()
+
+        published = run(self.service(ReplaySource(self.replay_path, batch_size=2), sink).run())
+
+        self.assertEqual(3, published)
+        self.assertEqual([11, 12, 13], sink.published)
+        self.assertEqual(13, self.cursor_store.get())
+
+    def test_restart_picks_up_from_the_checkpoint(self):
+        self.cursor_store.advance(11)
+        sink = RecordingSink()
+
+        run(self.service(ReplaySource(self.replay_path), sink).run())
+
+        self.assertEqual([12, 13], sink.published)
+
+    def test_refused_requests_are_handed_over_again(self):
+        sink = RecordingSink(refusals={12: 2})
+
+        run(self.service(ReplaySource(self.replay_path), sink).run())
+
+        self.assertEqual([11, 13, 12], sink.published)
+        self.assertEqual(13, self.cursor_store.get())
+
+    def test_checkpoint_stays_before_a_request_that_was_never_published(self):
+        sink = RecordingSink(refusals={12: None})
+        service = self.service(ReplaySource(self.replay_path), sink)
+
+        async def stop_soon():
+            asyncio.get_event_loop().call_later(0.1, service.stop)
+            return await service.run()
+
+        run(stop_soon())
+
+        self.assertEqual([11, 13], sink.published)
+        self.assertEqual(11, self.cursor_store.get())
+
+    def test_mentions_are_fetched_again_after_a_failed_user_lookup(self):
+        class FlakyTwitterApi(MockTwitterApi):
+            def __init__(self):
+                MockTwitterApi.__init__(self)
+                self.failures = 1
+
+            def UsersLookup(self, user_id):
+                if self.failures > 0:
+                    self.failures -= 1
+                    raise TwitterError('Over capacity')
+                return MockTwitterApi.UsersLookup(self, user_id)
+
+        with open(self.replay_path, 'w') as replay_file:
+            trimmed = mention_json(12, 2, ['JoinGame'], 11)
+            trimmed['user']['screen_name'] = None
+            for mention in [mention_json(11, 1, ['LetsPlay']), trimmed, mention_json(13, 3, ['JoinGame'], 11)]:
+                replay_file.write(json.dumps(mention) + '\n')
+
+        self.twitter_api = FlakyTwitterApi()
+        sink = RecordingSink()
+
+        run(self.service(ReplaySource(self.replay_path), sink).run())
+
+        self.assertEqual([11, 12, 13], sink.published)
+        self.assertEqual(13, self.cursor_store.get())
+
+    def test_stopping_publishes_what_was_fetched(self):
+        source = WebhookSource('secret')
+        sink = RecordingSink()
+        service = self.service(source, sink)
+
+        async def push_then_stop():
+            task = asyncio.get_event_loop().create_task(service.run())
+            source.receive({'for_user_id': '9', 'tweet_create_events': [mention_json(21, 1, ['LetsPlay']),
+                                                                         mention_json(22, 9, ['Help'])]})
+            await asyncio.sleep(0.1)
+            service.stop()
+
+            return await task
+
+        self.assertEqual(1, run(push_then_stop()))
+        self.assertEqual([21], sink.published)
+        self.assertEqual(21, self.cursor_store.get())
+
+    def test_requests_are_handled_in_process(self):
+        game_store = InMemoryGameStore()
+
+        run(self.service(ReplaySource(self.replay_path), GameStateSink(self.twitter_api, game_store)).run())
+
+        self.assertEqual(1, len(game_store.get_active_by_creator('user_1')))
+        self.assertEqual(3, len(self.twitter_api.posts))
+        self.assertEqual(13, self.cursor_store.get())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+class TestMentionSources(unittest.TestCase):
+
+    def test_polling_source_returns_new_mentions_oldest_first(self):
+        twitter_api = MockTwitterApi()
+        twitter_api.SetMentions([create_mention(3, 1, ['LetsPlay']), create_mention(1, 1, ['Help']),
+                                 create_mention(2, 2, ['Help'])])
+        source = PollingSource(twitter_api, planner=lambda api, calls_per_poll: 0)
+
+        self.assertEqual([2, 3], [post.id for post in run(source.fetch(1))])
+
+    def test_webhook_answers_the_crc_and_takes_signed_events(self):
+        source = WebhookSource('secret')
+        body = json.dumps({'for_user_id': '9', 'tweet_create_events': [mention_json(31, 1, ['LetsPlay'])]}).encode()
+
+        async def request(method, target, body=b'', signature=None):
+            server = await source.serve('127.0.0.1', 0)
+
+            try:
+                (reader, writer) = await asyncio.open_connection('127.0.0.1', server.sockets[0].getsockname()[1])
+                headers = 'Content-Length: {}\r\n'.format(len(body))
+
+                if signature is not None:
+                    headers += 'X-Twitter-Webhooks-Signature: {}\r\n'.format(signature)
+
+                writer.write('{} {} HTTP/1.1\r\n{}\r\n'.format(method, target, headers).encode() + body)
+                response = await reader.read()
+                writer.close()
+            finally:
+                server.close()
+                await server.wait_closed()
+
+            (head, response_body) = response.split(b'\r\n\r\n', 1)
+            return int(head.split()[1]), json.loads(response_body.decode())
+
+        self.assertEqual((200, {'response_token': source.sign(b'challenge')}),
+                         run(request('GET', '/webhook?crc_token=challenge')))
+        self.assertEqual(403, run(request('POST', '/webhook', body, 'sha256=forged'))[0])
+        self.assertEqual((200, {'queued': 1}), run(request('POST', '/webhook', body, source.sign(body))))
+
+        # The same event delivered again is dropped
+        self.assertEqual(0, source.receive(json.loads(body.decode())))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import contextlib
+import io
+import json
+import unittest
+import boto3
+from boto3.dynamodb.conditions import Key
+from src.instrumentation import EmfSink, Instrumentation
+from test_resources import get_game_state_table, MockTwitterApi
+from moto import mock_dynamodb2
+
+
+class FakeTracer(object):
+
+    def __init__(self):
+        self.subsegments = []
+        self.open = 0
+
+    def begin_subsegment(self, name):
+        self.subsegments.append(name)
+        self.open += 1
+
+    def end_subsegment(self):
+        self.open -= 1
+
+
+@mock_dynamodb2
+class TestInstrumentation(unittest.TestCase):
+
+    def test_twitter_calls_are_timed_and_failures_counted(self):
+        tracer = FakeTracer()
+        instrumentation = Instrumentation(tracer=tracer)
+        twitter_api = instrumentation.wrap(MockTwitterApi(), 'Twitter')
+
+        twitter_api.PostUpdate(status='Hello!')
+
+        with self.assertRaises(Exception):
+            twitter_api.PostUpdate(status='x' * 141)
+
+        stats = instrumentation.flush()[('Twitter', 'PostUpdate')]
+        self.assertEqual(2, stats.calls)
+        self.assertEqual(1, stats.errors)
+        self.assertEqual(2, len(stats.latencies))
+        self.assertEqual(['Twitter.PostUpdate', 'Twitter.PostUpdate'], tracer.subsegments)
+        self.assertEqual(0, tracer.open)
+        self.assertEqual({}, instrumentation.flush())
+
+    def test_boto_calls_are_recorded_by_operation_and_index(self):
+        instrumentation = Instrumentation()
+        dynamodb_table = boto3.resource('dynamodb', region_name='us-west-2').Table(get_game_state_table().name)
+        instrumentation.instrument_boto(dynamodb_table.meta.client, 'DynamoDB')
+        instrumentation.instrument_boto(dynamodb_table.meta.client, 'DynamoDB')
+
+        dynamodb_table.get_item(Key={'TweetStartId': 1})
+        dynamodb_table.query(IndexName='GameCreator-index', KeyConditionExpression=Key('GameCreator').eq('rory_jacob'))
+
+        stats = instrumentation.flush()
+        self.assertEqual(1, stats[('DynamoDB', 'GetItem')].calls)
+        self.assertEqual(1, stats[('DynamoDB', 'Query.GameCreator-index')].calls)
+
+    def test_emf_sink_writes_counts_and_latencies(self):
+        instrumentation = Instrumentation(sink=EmfSink())
+        instrumentation.record('Kinesis', 'PutRecords', 12.5, retries=2)
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            instrumentation.flush()
+
+        (counts, latencies) = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual('PutRecords', counts['Operation'])
+        self.assertEqual(2, counts['Retries'])
+        self.assertEqual([12.5], latencies['Latency'])
+        self.assertEqual('Milliseconds', latencies['_aws']['CloudWatchMetrics'][0]['Metrics'][0]['Unit'])
+
+
+if __name__ == '__main__':
+    unittest.main()
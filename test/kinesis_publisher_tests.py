@@ -0,0 +1,67 @@
+import unittest
+from src.kinesis_publisher import KinesisPublisher, acknowledged_cursor, MAX_RECORDS_PER_REQUEST
+
+
+class FlakyKinesisClient():
+    """
+    A kinesis client that rejects the given record payloads on their first attempt
+    """
+
+    def __init__(self, reject_once=(), reject_always=()):
+        self.reject_once = set(reject_once)
+        self.reject_always = set(reject_always)
+        self.requests = []
+
+    def put_records(self, StreamName, Records):
+        self.requests.append(Records)
+        results = []
+
+        for record in Records:
+            if record['Data'] in self.reject_always or record['Data'] in self.reject_once:
+                self.reject_once.discard(record['Data'])
+                results.append({'ErrorCode': 'ProvisionedThroughputExceededException',
+                                'ErrorMessage': 'Slow down'})
+            else:
+                results.append({'SequenceNumber': '1', 'ShardId': 'shardId-000000000000'})
+
+        return {'FailedRecordCount': len([r for r in results if 'ErrorCode' in r]), 'Records': results}
+
+
+class TestKinesisPublisher(unittest.TestCase):
+
+    def test_only_failed_records_are_retried(self):
+        kinesis_client = FlakyKinesisClient(reject_once=[b'2'])
+        publisher = KinesisPublisher(kinesis_client, 'mock-stream', base_backoff=0)
+
+        for record_id in [1, 2, 3]:
+            publisher.add(record_id, str(record_id), 'key')
+
+        self.assertEqual({1, 2, 3}, publisher.flush())
+        self.assertEqual(2, len(kinesis_client.requests))
+        self.assertEqual([b'2'], [record['Data'] for record in kinesis_client.requests[1]])
+
+    def test_records_are_chunked(self):
+        kinesis_client = FlakyKinesisClient()
+        publisher = KinesisPublisher(kinesis_client, 'mock-stream', base_backoff=0)
+
+        for record_id in range(MAX_RECORDS_PER_REQUEST + 1):
+            publisher.add(record_id, 'data', 'key')
+
+        self.assertEqual(MAX_RECORDS_PER_REQUEST + 1, len(publisher.flush()))
+        self.assertEqual([MAX_RECORDS_PER_REQUEST, 1], [len(request) for request in kinesis_client.requests])
+
+    def test_cursor_stops_before_unacknowledged_records(self):
+        kinesis_client = FlakyKinesisClient(reject_always=[b'2'])
+        publisher = KinesisPublisher(kinesis_client, 'mock-stream', max_attempts=2, base_backoff=0)
+
+        for record_id in [3, 2, 1]:
+            publisher.add(record_id, str(record_id), 'key')
+
+        acknowledged = publisher.flush()
+
+        self.assertEqual({1, 3}, acknowledged)
+        self.assertEqual(1, acknowledged_cursor([3, 2, 1], acknowledged))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import contextlib
+import io
+import json
+import unittest
+from concurrent.futures import Future
+from src.latency import BUCKET_BOUNDS, MAX_EMF_VALUES, LatencyHistogram, LatencyTracker
+from src.models import GameRequest, RequestType
+
+
+class FakeClock(object):
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class PostedDispatcher(object):
+
+    def post(self, status, in_reply_to_status_id=None):
+        future = Future()
+        future.set_result(True)
+        return future
+
+
+class TestLatencyTracker(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock(110)
+        self.tracker = LatencyTracker(clock=self.clock)
+
+    def bucket(self, request_type, stage):
+        counts = self.tracker.histogram.counts[(request_type, stage)]
+        return BUCKET_BOUNDS[counts.index(1)]
+
+    def test_first_reply_is_split_into_stages(self):
+        game_request = GameRequest.NewFromJsonDict({'status_id': 1, 'request_type': str(RequestType.MAKE_SELECTION),
+                                                    'created_at': 50, 'ingested_at': 100, 'arrived_at': 101})
+        dispatcher = self.tracker.watch(game_request, PostedDispatcher())
+
+        self.clock.now = 112
+        dispatcher.post('The next step')
+        self.clock.now = 200
+        dispatcher.post('Another reply')
+
+        request_type = str(RequestType.MAKE_SELECTION)
+        self.assertEqual(60, self.bucket(request_type, 'TwitterDelay'))
+        self.assertEqual(1, self.bucket(request_type, 'PollDelay'))
+        self.assertEqual(10, self.bucket(request_type, 'StreamLag'))
+        self.assertEqual(2, self.bucket(request_type, 'Processing'))
+        self.assertEqual(120, self.bucket(request_type, 'Total'))
+
+    def test_missing_timestamps_skip_their_stages(self):
+        game_request = GameRequest.NewFromJsonDict({'status_id': 1, 'request_type': str(RequestType.HELP)})
+        self.tracker.watch(game_request, PostedDispatcher()).post('Help!')
+
+        self.assertEqual([(str(RequestType.HELP), 'Processing')], list(self.tracker.histogram.counts))
+
+    def test_failed_replies_are_not_counted(self):
+        class FailedDispatcher(object):
+            def post(self, status, in_reply_to_status_id=None):
+                future = Future()
+                future.set_result(False)
+                return future
+
+        game_request = GameRequest.NewFromJsonDict({'status_id': 1, 'request_type': str(RequestType.HELP)})
+        self.tracker.watch(game_request, FailedDispatcher()).post('Help!')
+
+        self.assertEqual({}, self.tracker.histogram.counts)
+
+
+class TestLatencyHistogram(unittest.TestCase):
+
+    def test_latencies_are_emitted_as_emf_value_arrays(self):
+        histogram = LatencyHistogram()
+        histogram.add('HELP', 'Total', 0.2)
+        histogram.add('HELP', 'Total', 1000)
+
+        for _ in range(MAX_EMF_VALUES):
+            histogram.add('HELP', 'Total', 3)
+
+        output = io.StringIO()
+
+        with contextlib.redirect_stdout(output):
+            histogram.emit()
+
+        lines = [json.loads(line) for line in output.getvalue().splitlines()]
+
+        self.assertEqual([MAX_EMF_VALUES, 2], [len(line['RequestLatency']) for line in lines])
+        self.assertEqual([0.5] + [5] * (MAX_EMF_VALUES - 1), lines[0]['RequestLatency'])
+        self.assertEqual([5, 600], lines[1]['RequestLatency'])
+
+        for line in lines:
+            self.assertTrue(all(isinstance(value, (int, float)) for value in line['RequestLatency']))
+            self.assertEqual([{'Name': 'RequestLatency', 'Unit': 'Seconds'}],
+                             line['_aws']['CloudWatchMetrics'][0]['Metrics'])
+            self.assertEqual([['RequestType', 'Stage']], line['_aws']['CloudWatchMetrics'][0]['Dimensions'])
+            self.assertEqual(('HELP', 'Total'), (line['RequestType'], line['Stage']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import io
+import json
+import unittest
+from src.logger import DEBUG, INFO, WARNING, Logger, parse_sample_rates
+
+
+class TestLogger(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = io.StringIO()
+
+    def entries(self):
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_entries_are_buffered_until_flushed(self):
+        logger = Logger(stream=self.stream)
+        logger.info('BatchReceived', records=5)
+
+        self.assertEqual('', self.stream.getvalue())
+
+        logger.flush()
+        self.assertEqual([{'level': 'INFO', 'event': 'BatchReceived', 'records': 5}], self.entries())
+
+    def test_entries_below_the_level_are_dropped(self):
+        logger = Logger(level=INFO, stream=self.stream)
+
+        self.assertFalse(logger.is_enabled(DEBUG))
+        logger.debug('GameSaved', game_session={'TweetStartId': 1})
+        logger.flush()
+
+        self.assertEqual([], self.entries())
+
+    def test_sampling_never_drops_warnings(self):
+        logger = Logger(level=DEBUG, sample_rates={'RequestReceived': 0.25}, stream=self.stream,
+                        sample=iter([0.1, 0.5, 0.9]).__next__)
+
+        logger.info('RequestReceived', status_id=1)
+        logger.info('RequestReceived', status_id=2)
+        logger.log(WARNING, 'RequestReceived', status_id=3)
+        logger.info('BatchReceived', records=3)
+        logger.flush()
+
+        self.assertEqual([1, 3], [entry['status_id'] for entry in self.entries() if 'status_id' in entry])
+        self.assertEqual('BatchReceived', self.entries()[-1]['event'])
+
+    def test_sample_rates_are_parsed_over_the_defaults(self):
+        rates = parse_sample_rates('RequestReceived=1, GameSaved=0.5')
+
+        self.assertEqual(1, rates['RequestReceived'])
+        self.assertEqual(0.5, rates['GameSaved'])
+        self.assertEqual(0.1, rates['MentionClassified'])
+
+
+if __name__ == '__main__':
+    unittest.main()
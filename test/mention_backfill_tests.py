@@ -0,0 +1,33 @@
+import unittest
+from src.mention_backfill import iter_mentions, PAGE_SIZE
+from test_resources import MockTwitterApi, create_mention
+
+
+class TestMentionBackfill(unittest.TestCase):
+
+    def setUp(self):
+        self.twitter_api = MockTwitterApi()
+        self.twitter_api.SetMentions([create_mention(status_id, 1, ['ChooseMe'])
+                                      for status_id in range(1000, 1000 + (2 * PAGE_SIZE) + 50)])
+
+    def test_mentions_are_yielded_oldest_first(self):
+        post_ids = [post.id for post in iter_mentions(self.twitter_api, 1049)]
+
+        self.assertEqual(list(range(1050, 1000 + (2 * PAGE_SIZE) + 50)), post_ids)
+
+    def test_pages_fetched_are_reported(self):
+        stats = {}
+        list(iter_mentions(self.twitter_api, None, stats=stats))
+
+        self.assertEqual(3, stats['Pages'])
+
+    def test_backlog_drains_over_several_polls(self):
+        first_poll = [post.id for post in iter_mentions(self.twitter_api, None, max_pages=1)]
+        second_poll = [post.id for post in iter_mentions(self.twitter_api, first_poll[-1], max_pages=1)]
+
+        self.assertEqual(list(range(1000, 1000 + PAGE_SIZE)), first_poll)
+        self.assertEqual(list(range(1000 + PAGE_SIZE, 1000 + (2 * PAGE_SIZE))), second_poll)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+from twitter.ratelimit import EndpointRateLimit
+from src.poll_planner import plan_next_poll, MENTIONS_URL, USERS_LOOKUP_URL, DEFAULT_POLL_INTERVAL_SECONDS
+
+
+class RateLimitedTwitterApi():
+
+    def __init__(self, limits):
+        self.limits = limits
+
+    def CheckRateLimit(self, url):
+        return self.limits.get(url, EndpointRateLimit(limit=15, remaining=15, reset=0))
+
+
+class TestPollPlanner(unittest.TestCase):
+
+    def test_unknown_limits_use_the_default_interval(self):
+        self.assertEqual(DEFAULT_POLL_INTERVAL_SECONDS, plan_next_poll(RateLimitedTwitterApi({}), now=1000))
+
+    def test_remaining_budget_is_spread_over_the_window(self):
+        twitter_api = RateLimitedTwitterApi({MENTIONS_URL: EndpointRateLimit(limit=75, remaining=60, reset=1600)})
+
+        self.assertEqual(10, plan_next_poll(twitter_api, now=1000))
+
+    def test_exhausted_budget_waits_until_reset(self):
+        twitter_api = RateLimitedTwitterApi({MENTIONS_URL: EndpointRateLimit(limit=75, remaining=60, reset=1600),
+                                             USERS_LOOKUP_URL: EndpointRateLimit(limit=900, remaining=0, reset=1300)})
+
+        self.assertEqual(301, plan_next_poll(twitter_api, now=1000))
+
+    def test_each_page_a_poll_fetched_is_budgeted(self):
+        twitter_api = RateLimitedTwitterApi({MENTIONS_URL: EndpointRateLimit(limit=75, remaining=60, reset=1600)})
+
+        self.assertEqual(40, plan_next_poll(twitter_api, now=1000, calls_per_poll={MENTIONS_URL: 4}))
+
+    def test_too_little_budget_for_the_pages_waits_until_reset(self):
+        twitter_api = RateLimitedTwitterApi({MENTIONS_URL: EndpointRateLimit(limit=75, remaining=3, reset=1600)})
+
+        self.assertEqual(601, plan_next_poll(twitter_api, now=1000, calls_per_poll={MENTIONS_URL: 4}))
+
+
+if __name__ == '__main__':
+    unittest.main()
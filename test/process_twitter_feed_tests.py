@@ -1,5 +1,7 @@
 import unittest
-from test_resources import get_twitter_post_processing_table, MockTwitterApi
+from test_resources import get_twitter_post_processing_table, MockTwitterApi, create_mention
+from twitter.error import TwitterError
+from src.cursor_store import CursorStore, CURSOR_CACHE
 from src.process_twitter_feed import process_twitter_feed
 import boto3
 from moto import mock_kinesis, mock_dynamodb2
@@ -9,12 +11,14 @@ from moto import mock_kinesis, mock_dynamodb2
 class TestKinesisStreamProcessing(unittest.TestCase):
 
     def setUp(self):
+        CURSOR_CACHE.clear()
         self.dynamodb_table = get_twitter_post_processing_table()
         self.twitter_api = MockTwitterApi()
         self.stream_name = 'mock-stream'
         self.kinesis_client = kinesis_client = boto3.client('kinesis')
-        kinesis_client.create_stream(StreamName=self.stream_name,
-                                     ShardCount=1)
+        if self.stream_name not in kinesis_client.list_streams()['StreamNames']:
+            kinesis_client.create_stream(StreamName=self.stream_name,
+                                         ShardCount=1)
 
     def test_tweet_processing(self):
 
@@ -23,6 +27,45 @@ class TestKinesisStreamProcessing(unittest.TestCase):
 
         print('Result: ' + str(result))
 
+    def test_cursor_moves_to_last_published_mention(self):
+        self.twitter_api.SetMentions([create_mention(12, 1, ['JoinGame'], 10),
+                                      create_mention(11, 2, ['LetsPlay'])])
+
+        process_twitter_feed(self.twitter_api, self.kinesis_client, self.stream_name, self.dynamodb_table)
+
+        self.assertEqual(12, CursorStore(self.dynamodb_table).get())
+        self.assertEqual(1, self.dynamodb_table.scan()['Count'])
+
+    def test_cursor_stops_before_a_mention_whose_user_lookup_failed(self):
+        class FailingTwitterApi(MockTwitterApi):
+            def UsersLookup(self, user_id):
+                raise TwitterError('Rate limit exceeded')
+
+        CursorStore(self.dynamodb_table).advance(15)
+        trimmed = create_mention(16, 7, ['JoinGame'], 14)
+        trimmed.user.screen_name = None
+        twitter_api = FailingTwitterApi()
+        twitter_api.SetMentions([create_mention(17, 8, ['JoinGame'], 14), trimmed])
+
+        process_twitter_feed(twitter_api, self.kinesis_client, self.stream_name, self.dynamodb_table)
+
+        self.assertEqual(15, CursorStore(self.dynamodb_table).get())
+
+    def test_records_are_partitioned_by_game(self):
+        self.twitter_api.SetMentions([create_mention(22, 3, ['ChooseMe', 'Tree'], 20),
+                                      create_mention(21, 4, ['LetsPlay'])])
+
+        process_twitter_feed(self.twitter_api, self.kinesis_client, self.stream_name, self.dynamodb_table)
+
+        shard_id = self.kinesis_client.describe_stream(StreamName=self.stream_name)['StreamDescription']['Shards'][0]['ShardId']
+        iterator = self.kinesis_client.get_shard_iterator(StreamName=self.stream_name, ShardId=shard_id,
+                                                          ShardIteratorType='TRIM_HORIZON')['ShardIterator']
+        partition_keys = [record['PartitionKey'] for record in
+                          self.kinesis_client.get_records(ShardIterator=iterator)['Records']]
+
+        self.assertIn('game-20', partition_keys)
+        self.assertIn('user-user_4', partition_keys)
+
     def tearDown(self):
         self.dynamodb_table = None
         self.kinesis_client = None
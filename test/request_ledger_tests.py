@@ -0,0 +1,120 @@
+import unittest
+from collections import OrderedDict
+from src.game_store import DynamoGameStore
+from src.request_ledger import RequestInProgressError, RequestLedger
+from src.models import RequestType
+from src.sam_quest import MAX_REQUEST_ATTEMPTS, handle_game_state
+from test_resources import get_game_state_table, get_request_ledger_table, MockTwitterApi
+from moto import mock_dynamodb2
+
+
+class FakeClock(object):
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class RecordingDeadLetterQueue(object):
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, post, error, attempts):
+        self.sent.append((post['status_id'], attempts))
+
+
+@mock_dynamodb2
+class TestRequestLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.table = get_request_ledger_table()
+
+        for item in self.table.scan()['Items']:
+            self.table.delete_item(Key={'StatusId': item['StatusId']})
+
+        self.clock = FakeClock(1000)
+        self.ledger = RequestLedger(self.table, lease=60, completed=OrderedDict(), clock=self.clock)
+
+    def test_request_is_claimed_once(self):
+        self.assertTrue(self.ledger.claim(1))
+
+        with self.assertRaises(RequestInProgressError):
+            RequestLedger(self.table, completed=OrderedDict(), clock=self.clock).claim(1)
+
+    def test_expired_claim_can_be_taken_over(self):
+        self.assertTrue(self.ledger.claim(1))
+        self.clock.now += 61
+
+        self.assertTrue(RequestLedger(self.table, completed=OrderedDict(), clock=self.clock).claim(1))
+
+    def test_failed_request_can_be_claimed_again_and_keeps_its_attempts(self):
+        self.assertTrue(self.ledger.claim(1))
+        self.assertEqual(1, self.ledger.fail(1))
+
+        self.assertTrue(self.ledger.claim(1))
+        self.assertEqual(2, self.ledger.fail(1))
+
+    def test_completed_requests_are_skipped_without_dynamo(self):
+        self.assertTrue(self.ledger.claim(1))
+        self.ledger.complete([1])
+        self.clock.now += 61
+
+        self.assertFalse(RequestLedger(self.table, completed=OrderedDict(), clock=self.clock).claim(1))
+
+        # Still skipped from the in process cache once the ledger item is gone
+        self.table.delete_item(Key={'StatusId': 1})
+        self.assertFalse(self.ledger.claim(1))
+        self.assertEqual(1, self.ledger.skipped)
+
+    def test_redelivered_batch_does_not_tweet_again(self):
+        twitter_api = MockTwitterApi()
+        game_store = DynamoGameStore(get_game_state_table())
+        posts = [{'user_name': 'rory_jacob', 'status_message': '#Help', 'status_id': 10,
+                  'in_reply_to_status_id': None, 'request_type': str(RequestType.HELP), 'hashtags': ['help']}]
+
+        handle_game_state(posts, twitter_api, game_store, ledger=self.ledger)
+        handle_game_state(posts, twitter_api, game_store, ledger=self.ledger)
+
+        self.assertEqual(1, len(twitter_api.posts))
+
+    def test_request_in_progress_elsewhere_is_retried_with_the_rest_of_its_game(self):
+        twitter_api = MockTwitterApi()
+        game_store = DynamoGameStore(get_game_state_table())
+        posts = [{'user_name': 'rory_jacob', 'status_message': '#Help', 'status_id': 30,
+                  'in_reply_to_status_id': None, 'request_type': str(RequestType.HELP), 'hashtags': ['help']}]
+
+        self.assertTrue(RequestLedger(self.table, completed=OrderedDict(), clock=self.clock).claim(30))
+
+        self.assertEqual([0], handle_game_state(posts, twitter_api, game_store, ledger=self.ledger))
+        self.assertEqual([], twitter_api.posts)
+        self.assertEqual(0, self.ledger.skipped)
+
+    def test_failing_request_is_retried_until_it_is_dead_lettered(self):
+        twitter_api = MockTwitterApi()
+        game_store = DynamoGameStore(get_game_state_table())
+        dead_letters = RecordingDeadLetterQueue()
+        posts = [{'user_name': 'rory_jacob', 'status_message': '#Huh', 'status_id': 20,
+                  'in_reply_to_status_id': None, 'request_type': 'NOT_A_REQUEST_TYPE'},
+                 {'user_name': 'player_one', 'status_message': '#Help', 'status_id': 21,
+                  'in_reply_to_status_id': None, 'request_type': str(RequestType.HELP), 'hashtags': ['help']}]
+
+        for attempt in range(MAX_REQUEST_ATTEMPTS - 1):
+            self.assertEqual([0], handle_game_state(posts, twitter_api, game_store, ledger=self.ledger,
+                                                    dead_letters=dead_letters))
+
+        self.assertEqual([], handle_game_state(posts, twitter_api, game_store, ledger=self.ledger,
+                                               dead_letters=dead_letters))
+        self.assertEqual([(20, MAX_REQUEST_ATTEMPTS)], dead_letters.sent)
+
+        # The rest of the batch was only handled once, and a redelivery skips the dead lettered request
+        self.assertEqual([], handle_game_state(posts, twitter_api, game_store, ledger=self.ledger,
+                                               dead_letters=dead_letters))
+        self.assertEqual(1, len(twitter_api.posts))
+        self.assertEqual(1, len(dead_letters.sent))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,27 @@
+import threading
 import unittest
 from src.sam_quest import handle_game_state
-from src.models import RequestType
-from test_resources import get_game_state_table, MockTwitterApi
+from src.game_store import DynamoGameStore
+from src.memory_game_store import InMemoryGameStore
+from src.request_ledger import InMemoryRequestLedger
+from src.models import RequestType, GameState
+from test_resources import get_game_state_table, get_tweet_index_table, MockTwitterApi
 from moto import mock_dynamodb2
 
+
+class StepFailingTwitterApi(MockTwitterApi):
+    """
+    Fails to post the steps of a game while failing is set. Replies still go out.
+    """
+    failing = False
+
+    def PostUpdate(self, status, in_reply_to_status_id=None):
+        if self.failing and in_reply_to_status_id is None:
+            raise Exception('Over capacity')
+
+        return MockTwitterApi.PostUpdate(self, status, in_reply_to_status_id)
+
+
 @mock_dynamodb2
 class TestSAMQuest(unittest.TestCase):
 
@@ -47,11 +65,258 @@ class TestSAMQuest(unittest.TestCase):
             'hashtags': ['ReadNote']
         }
 
-        handle_game_state([create_tweet, join_tweet, start_tweet, play_tweet], twitter_api, dynamodb_table)
+        handle_game_state([create_tweet, join_tweet, start_tweet, play_tweet], twitter_api, DynamoGameStore(dynamodb_table))
 
         result = dynamodb_table.scan()
         print('Result: ' + str(result))
 
+    def test_round_closes_when_every_player_has_voted(self):
+        twitter_api = MockTwitterApi()
+        dynamodb_table = get_game_state_table()
+        tweet_index_table = get_tweet_index_table()
+        game_store = DynamoGameStore(dynamodb_table, tweet_index_table=tweet_index_table)
+        tweet_index_table.put_item(Item={'StatusId': 501, 'TweetStartId': 500})
+        dynamodb_table.put_item(Item={'TweetStartId': 500, 'GameState': str(GameState.PENDING_GAME_INPUT),
+                                      'GameCreator': 'rory_jacob', 'Players': ['rory_jacob', 'player_one'],
+                                      'CurrentTweetId': 501, 'CurrentGameStep': 1, 'StepCount': 2,
+                                      'CurrentVotes': {'readnote': 0, 'tree': 0}, 'Version': 1})
+
+        def vote(status_id, user_name, option):
+            return {'user_name': user_name, 'status_message': '#ChooseMe #' + option, 'status_id': status_id,
+                    'in_reply_to_status_id': 501, 'request_type': str(RequestType.MAKE_SELECTION),
+                    'hashtags': ['chooseme', option]}
+
+        handle_game_state([vote(502, 'rory_jacob', 'tree')], twitter_api, game_store)
+
+        self.assertEqual([], twitter_api.posts)
+
+        handle_game_state([vote(503, 'rory_jacob', 'readnote'), vote(504, 'player_one', 'tree')],
+                          twitter_api, game_store)
+
+        item = dynamodb_table.get_item(Key={'TweetStartId': 500})['Item']
+        self.assertEqual(2, len(twitter_api.posts))
+        self.assertEqual(3, item['CurrentGameStep'])
+        self.assertEqual({'stare': 0, 'listen': 0}, item['CurrentVotes'])
+        self.assertNotIn('CurrentVoters', item)
+
+        # The new step is found by its tweet, and the old one is told apart from an unknown game
+        self.assertEqual(500, game_store.get_by_tweet(item['CurrentTweetId']).TweetStartId)
+
+        handle_game_state([vote(505, 'player_one', 'tree')], twitter_api, game_store)
+
+        self.assertIn('made already', twitter_api.posts[-1])
+
+
+class TestSAMQuestInMemory(unittest.TestCase):
+
+    def test_game_is_created_joined_and_started(self):
+        twitter_api = MockTwitterApi()
+        game_store = InMemoryGameStore()
+
+        def request(status_id, user_name, request_type, in_reply_to_status_id=None):
+            return {'user_name': user_name, 'status_message': 'Testing!', 'status_id': status_id,
+                    'in_reply_to_status_id': in_reply_to_status_id, 'request_type': str(request_type)}
+
+        handle_game_state([request(1, 'rory_jacob', RequestType.CREATE_GAME)], twitter_api, game_store)
+        tweet_start_id = 100
+
+        handle_game_state([request(2, 'rory_jacob', RequestType.CREATE_GAME),
+                           request(3, 'player_one', RequestType.JOIN_GAME, tweet_start_id),
+                           request(4, 'rory_jacob', RequestType.START_GAME, tweet_start_id)],
+                          twitter_api, game_store)
+
+        game_session = game_store.get_by_start_tweet(tweet_start_id)
+        self.assertEqual(['rory_jacob', 'player_one'], game_session.Players)
+        self.assertEqual(str(GameState.PENDING_GAME_INPUT), game_session.GameState)
+        self.assertEqual(game_session, game_store.get_by_tweet(game_session.CurrentTweetId))
+        self.assertEqual(game_session, game_store.get_by_tweet(tweet_start_id))
+        self.assertEqual(1, len(game_store.get_active_by_creator('rory_jacob')))
+        self.assertEqual([1, game_session.CurrentTweetId],
+                         [step['StepTweetId'] for step in game_store.get_history(tweet_start_id)])
+
+
+    def test_started_game_can_not_be_started_or_joined_again(self):
+        twitter_api = MockTwitterApi()
+        game_store = InMemoryGameStore()
+
+        def request(status_id, user_name, request_type, in_reply_to_status_id=None):
+            return {'user_name': user_name, 'status_message': 'Testing!', 'status_id': status_id,
+                    'in_reply_to_status_id': in_reply_to_status_id, 'request_type': str(request_type)}
+
+        handle_game_state([request(1, 'rory_jacob', RequestType.CREATE_GAME)], twitter_api, game_store)
+        handle_game_state([request(2, 'rory_jacob', RequestType.START_GAME, 100)], twitter_api, game_store)
+        current_tweet_id = game_store.get_by_start_tweet(100).CurrentTweetId
+
+        handle_game_state([request(3, 'rory_jacob', RequestType.START_GAME, current_tweet_id),
+                           request(4, 'player_one', RequestType.JOIN_GAME, 100)], twitter_api, game_store)
+
+        game_session = game_store.get_by_start_tweet(100)
+        self.assertEqual(current_tweet_id, game_session.CurrentTweetId)
+        self.assertEqual(['rory_jacob'], game_session.Players)
+        self.assertIn('already started', twitter_api.posts[-2])
+        self.assertIn('already started', twitter_api.posts[-1])
+
+    def start_game(self, twitter_api, game_store, players):
+        def request(status_id, user_name, request_type):
+            return {'user_name': user_name, 'status_message': 'Testing!', 'status_id': status_id,
+                    'in_reply_to_status_id': 100, 'request_type': str(request_type)}
+
+        handle_game_state([dict(request(1, players[0], RequestType.CREATE_GAME), in_reply_to_status_id=None)],
+                          twitter_api, game_store)
+        handle_game_state([request(2 + index, player, RequestType.JOIN_GAME)
+                           for (index, player) in enumerate(players[1:])] +
+                          [request(10, players[0], RequestType.START_GAME)], twitter_api, game_store)
+
+        return game_store.get_by_start_tweet(100)
+
+    @staticmethod
+    def vote(status_id, user_name, game_session):
+        return {'user_name': user_name, 'status_message': '#ChooseMe #tree', 'status_id': status_id,
+                'in_reply_to_status_id': int(game_session.CurrentTweetId),
+                'request_type': str(RequestType.MAKE_SELECTION), 'hashtags': ['chooseme', 'tree']}
+
+    def test_closing_vote_is_retried_when_the_next_step_is_not_posted(self):
+        twitter_api = StepFailingTwitterApi()
+        game_store = InMemoryGameStore()
+        game_session = self.start_game(twitter_api, game_store, ['rory_jacob'])
+        vote = self.vote(20, 'rory_jacob', game_session)
+
+        twitter_api.failing = True
+        self.assertEqual([0], handle_game_state([vote], twitter_api, game_store))
+        self.assertEqual(1, game_store.get_by_start_tweet(100).CurrentGameStep)
+
+        # The vote was already counted, so the retry only tallies the round
+        twitter_api.failing = False
+        self.assertEqual([], handle_game_state([vote], twitter_api, game_store))
+        self.assertEqual(3, game_store.get_by_start_tweet(100).CurrentGameStep)
+        self.assertNotIn('already voted', twitter_api.posts[-1])
+
+    def test_game_is_left_waiting_when_its_first_step_is_not_posted(self):
+        twitter_api = StepFailingTwitterApi()
+        game_store = InMemoryGameStore()
+
+        def request(status_id, user_name, request_type, in_reply_to_status_id=100):
+            return {'user_name': user_name, 'status_message': 'Testing!', 'status_id': status_id,
+                    'in_reply_to_status_id': in_reply_to_status_id, 'request_type': str(request_type)}
+
+        handle_game_state([request(1, 'rory_jacob', RequestType.CREATE_GAME, None)], twitter_api, game_store)
+        posts = [request(2, 'player_one', RequestType.JOIN_GAME), request(3, 'rory_jacob', RequestType.START_GAME)]
+
+        twitter_api.failing = True
+        self.assertEqual([1], handle_game_state(posts, twitter_api, game_store))
+
+        game_session = game_store.get_by_start_tweet(100)
+        self.assertEqual(str(GameState.PENDING_GAME_START), game_session.GameState)
+        self.assertEqual(['rory_jacob', 'player_one'], game_session.Players)
+
+        twitter_api.failing = False
+        self.assertEqual([], handle_game_state(posts[1:], twitter_api, game_store))
+        self.assertEqual(str(GameState.PENDING_GAME_INPUT), game_store.get_by_start_tweet(100).GameState)
+
+    def test_round_closes_on_any_vote_after_the_deadline(self):
+        twitter_api = MockTwitterApi()
+        game_store = InMemoryGameStore()
+        game_session = self.start_game(twitter_api, game_store, ['rory_jacob', 'player_one'])
+
+        handle_game_state([self.vote(20, 'rory_jacob', game_session)], twitter_api, game_store)
+        self.assertEqual(1, game_store.get_by_start_tweet(100).CurrentGameStep)
+
+        game_session = game_store.get_by_start_tweet(100)
+        game_session.VoteDeadline = 1000
+        game_store.save(game_session)
+
+        # Only player_one has not voted, and they are away
+        handle_game_state([self.vote(21, 'rory_jacob', game_session)], twitter_api, game_store)
+        self.assertEqual(3, game_store.get_by_start_tweet(100).CurrentGameStep)
+
+    def test_only_one_of_two_simultaneous_games_is_created(self):
+        twitter_api = MockTwitterApi()
+        game_store = InMemoryGameStore()
+        create_tweet = {'user_name': 'rory_jacob', 'status_message': '#LetsPlay',
+                        'request_type': str(RequestType.CREATE_GAME)}
+
+        handle_game_state([dict(create_tweet, status_id=1), dict(create_tweet, status_id=2)], twitter_api, game_store)
+
+        self.assertEqual(1, len(game_store.games))
+        self.assertEqual(1, len([post for post in twitter_api.posts if 'already have a game' in post]))
+
+    def test_failed_request_holds_back_the_rest_of_its_game(self):
+        twitter_api = MockTwitterApi()
+        game_store = InMemoryGameStore()
+        posts = [{'user_name': 'rory_jacob', 'status_message': '#Huh', 'status_id': 1,
+                  'in_reply_to_status_id': 100, 'request_type': 'NOT_A_REQUEST_TYPE'},
+                 {'user_name': 'player_one', 'status_message': '#JoinGame', 'status_id': 2,
+                  'in_reply_to_status_id': 100, 'request_type': str(RequestType.JOIN_GAME)},
+                 {'user_name': 'player_two', 'status_message': '#LetsPlay', 'status_id': 3,
+                  'request_type': str(RequestType.CREATE_GAME)}]
+
+        self.assertEqual([0, 1], handle_game_state(posts, twitter_api, game_store))
+        self.assertEqual(['player_two'], [game.GameCreator for game in
+                                          (game_store.get_by_start_tweet(tweet_start_id)
+                                           for tweet_start_id in game_store.games)])
+
+    def test_requests_for_a_game_that_could_not_be_saved_are_retried(self):
+        class ConflictingGameStore(InMemoryGameStore):
+            conflicting = False
+
+            def _update(self, game_session, saved, next_version):
+                return not self.conflicting and InMemoryGameStore._update(self, game_session, saved, next_version)
+
+        twitter_api = MockTwitterApi()
+        game_store = ConflictingGameStore()
+        ledger = InMemoryRequestLedger()
+        handle_game_state([{'user_name': 'rory_jacob', 'status_message': '#LetsPlay', 'status_id': 1,
+                            'request_type': str(RequestType.CREATE_GAME)}], twitter_api, game_store)
+        posts = [{'user_name': 'player_one', 'status_message': '#JoinGame', 'status_id': 2,
+                  'in_reply_to_status_id': 100, 'request_type': str(RequestType.JOIN_GAME)},
+                 {'user_name': 'player_two', 'status_message': '#Help', 'status_id': 3,
+                  'request_type': str(RequestType.HELP), 'hashtags': ['help']}]
+
+        game_store.conflicting = True
+        self.assertEqual([0], handle_game_state(posts, twitter_api, game_store, ledger=ledger))
+        self.assertEqual({2: 1}, ledger.attempts)
+
+        game_store.conflicting = False
+        self.assertEqual([], handle_game_state(posts, twitter_api, game_store, ledger=ledger))
+        self.assertEqual(['rory_jacob', 'player_one'], game_store.get_by_start_tweet(100).Players)
+
+    def test_request_is_retried_when_its_reply_is_not_sent(self):
+        class ReplyFailingTwitterApi(MockTwitterApi):
+            def PostUpdate(self, status, in_reply_to_status_id=None):
+                raise Exception('Over capacity')
+
+        ledger = InMemoryRequestLedger()
+        posts = [{'user_name': 'rory_jacob', 'status_message': '#Help', 'status_id': 1,
+                  'request_type': str(RequestType.HELP), 'hashtags': ['help']}]
+
+        self.assertEqual([0], handle_game_state(posts, ReplyFailingTwitterApi(), InMemoryGameStore(), ledger=ledger))
+        self.assertEqual({1: 1}, ledger.attempts)
+
+    def test_games_are_handled_at_the_same_time(self):
+        # Each welcome tweet only goes out once the other game is posting its own
+        barrier = threading.Barrier(2, timeout=5)
+
+        class ConcurrentTwitterApi(MockTwitterApi):
+            def PostUpdate(self, status, in_reply_to_status_id=None):
+                barrier.wait()
+                return MockTwitterApi.PostUpdate(self, status, in_reply_to_status_id)
+
+        game_store = InMemoryGameStore()
+        posts = [{'user_name': user, 'status_message': '#LetsPlay', 'status_id': status_id,
+                  'request_type': str(RequestType.CREATE_GAME)}
+                 for (status_id, user) in [(1, 'rory_jacob'), (2, 'player_one')]]
+
+        self.assertEqual([], handle_game_state(posts, ConcurrentTwitterApi(), game_store))
+        self.assertEqual(2, len(game_store.games))
+
+    def test_requests_left_at_the_time_cap_are_retried(self):
+        twitter_api = MockTwitterApi()
+        posts = [{'user_name': 'rory_jacob', 'status_message': '#LetsPlay', 'status_id': 1,
+                  'request_type': str(RequestType.CREATE_GAME)}]
+
+        self.assertEqual([0], handle_game_state(posts, twitter_api, InMemoryGameStore(), time_cap=0))
+        self.assertEqual([], twitter_api.posts)
+
 
 if __name__ == '__main__':
     unittest.main()
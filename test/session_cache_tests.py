@@ -0,0 +1,76 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import unittest
+from src.models import GameState
+from src.game_store import DynamoGameStore
+from src.memory_game_store import InMemoryGameStore
+from src.session_cache import SessionCache
+from test_resources import get_game_state_table, get_tweet_index_table
+from moto import mock_dynamodb2
+
+
+@mock_dynamodb2
+class TestSessionCache(unittest.TestCase):
+
+    def test_games_are_read_and_written_once_per_batch(self):
+        dynamodb_table = get_game_state_table()
+        dynamodb_table.put_item(Item={'TweetStartId': 200, 'GameState': str(GameState.PENDING_GAME_START),
+                                      'GameCreator': 'rory_jacob', 'Players': ['rory_jacob'],
+                                      'StepCount': 1})
+
+        sessions = SessionCache(DynamoGameStore(dynamodb_table))
+
+        for player in ['player_one', 'player_two']:
+            game_session = sessions.get_by_tweet(200)
+            game_session.Players += [player]
+            sessions.save(game_session)
+
+        self.assertIsNone(sessions.get_by_tweet(404))
+        self.assertIsNone(sessions.get_by_tweet(404))
+
+        sessions.flush()
+
+        self.assertEqual(2, sessions.reads)
+        self.assertEqual(1, sessions.writes)
+
+        item = dynamodb_table.get_item(Key={'TweetStartId': 200})['Item']
+        self.assertEqual(['rory_jacob', 'player_one', 'player_two'], item['Players'])
+
+    def test_old_steps_find_the_game_that_moved_on(self):
+        dynamodb_table = get_game_state_table()
+        tweet_index_table = get_tweet_index_table()
+        dynamodb_table.put_item(Item={'TweetStartId': 300, 'GameState': str(GameState.PENDING_GAME_INPUT),
+                                      'GameCreator': 'rory_jacob', 'Players': ['rory_jacob'],
+                                      'CurrentTweetId': 301, 'CurrentGameStep': 1, 'StepCount': 2})
+        tweet_index_table.put_item(Item={'StatusId': 301, 'TweetStartId': 300})
+
+        sessions = SessionCache(DynamoGameStore(dynamodb_table, tweet_index_table=tweet_index_table))
+        game_session = sessions.get_by_tweet(301)
+        game_session.CurrentTweetId = 302
+        sessions.save(game_session)
+
+        self.assertIs(game_session, sessions.get_by_tweet(301))
+        self.assertIs(game_session, sessions.get_by_tweet(302))
+        self.assertIsNone(sessions.get_by_tweet(404))
+        self.assertEqual(2, sessions.reads)
+
+    def test_creators_are_claimed_at_the_same_time(self):
+        # Each claim only returns once the other one is being made
+        barrier = threading.Barrier(2, timeout=5)
+
+        class SlowGameStore(InMemoryGameStore):
+            def claim_creator(self, user, now=None):
+                barrier.wait()
+                return InMemoryGameStore.claim_creator(self, user, now)
+
+        sessions = SessionCache(SlowGameStore())
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            claims = list(executor.map(sessions.claim_creator, ['rory_jacob', 'player_one']))
+
+        self.assertEqual([True, True], claims)
+        self.assertFalse(sessions.claim_creator('rory_jacob'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+from src.game_steps import STORY, get_choice
+from src.story_compiler import compile_story, StoryValidationError, UnknownChoiceError
+
+
+class TestStoryCompiler(unittest.TestCase):
+
+    def test_selection_matches_lowercase_hashtags(self):
+        choice = get_choice(1)
+
+        self.assertEqual('#ReadNote #Tree', choice.hashtags)
+        self.assertEqual(2, choice.select(['chooseme', 'readnote']))
+        self.assertIsNone(choice.select(['chooseme']))
+        self.assertIsNone(choice.select(['readnote', 'tree']))
+        self.assertTrue(get_choice(6).is_ending)
+
+    def test_nodes_are_immutable(self):
+        with self.assertRaises(AttributeError):
+            STORY.get(1).text = 'Something else'
+
+    def test_unknown_choice(self):
+        with self.assertRaises(UnknownChoiceError):
+            get_choice(404)
+
+    def test_dangling_steps_are_rejected(self):
+        with self.assertRaises(StoryValidationError):
+            compile_story({1: {'text': 'Start', 'options': [{'key': 'Go', 'next_id': 2}]}})
+
+    def test_unreachable_steps_are_rejected(self):
+        with self.assertRaises(StoryValidationError):
+            compile_story({1: {'text': 'The end', 'is_ending': True},
+                           2: {'text': 'Lost', 'is_ending': True}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
+import itertools
 import boto3
 import botocore
-from twitter.models import Status
+from twitter.models import Status, User
 
 def get_twitter_post_processing_table():
     """
@@ -82,7 +83,11 @@ def get_game_state_table():
                 'AttributeType': 'S'
             },
             {
-                'AttributeName': 'CurrentTweetId',
+                'AttributeName': 'ExpiryShard',
+                'AttributeType': 'N'
+            },
+            {
+                'AttributeName': 'ExpirationTime',
                 'AttributeType': 'N'
             }
         ],
@@ -108,19 +113,23 @@ def get_game_state_table():
                 }
             },
             {
-                'IndexName': 'CurrentTweetId-index',
+                'IndexName': 'ExpiringGames-index',
                 'KeySchema': [
                     {
-                        'AttributeName': 'CurrentTweetId',
+                        'AttributeName': 'ExpiryShard',
                         'KeyType': 'HASH'
+                    },
+                    {
+                        'AttributeName': 'ExpirationTime',
+                        'KeyType': 'RANGE'
                     }
                 ],
                 'Projection': {
                     'ProjectionType': 'ALL'
                 },
                 'ProvisionedThroughput': {
-                    'ReadCapacityUnits': 10,
-                    'WriteCapacityUnits': 10
+                    'ReadCapacityUnits': 5,
+                    'WriteCapacityUnits': 5
                 }
             }
         ]
@@ -128,19 +137,241 @@ def get_game_state_table():
 
     return table
 
+
+def get_request_ledger_table():
+    """
+    Get the request ledger table
+    :return:
+    """
+    dynamodb = boto3.resource('dynamodb', region_name='us-west-2')
+    test_table_name = 'sam-quest-request-ledger'
+
+    try:
+        table = dynamodb.Table(test_table_name)
+        print (table.creation_date_time)
+        return table
+    except botocore.exceptions.ClientError as e:
+        print('Table does not exist, creating table.')
+
+    table = dynamodb.create_table(
+        TableName= test_table_name,
+        KeySchema=[
+            {
+                'AttributeName': 'StatusId',
+                'KeyType': 'HASH'  # Partition key
+            }
+        ],
+        AttributeDefinitions=[
+            {
+                'AttributeName': 'StatusId',
+                'AttributeType': 'N'
+            }
+        ],
+        ProvisionedThroughput={
+            'ReadCapacityUnits': 10,
+            'WriteCapacityUnits': 10
+        }
+    )
+
+    return table
+
+def get_status_update_table():
+    """
+    Get the status update budget table
+    :return:
+    """
+    dynamodb = boto3.resource('dynamodb', region_name='us-west-2')
+    test_table_name = 'sam-quest-status-update-budget'
+
+    try:
+        table = dynamodb.Table(test_table_name)
+        print (table.creation_date_time)
+        return table
+    except botocore.exceptions.ClientError as e:
+        print('Table does not exist, creating table.')
+
+    table = dynamodb.create_table(
+        TableName= test_table_name,
+        KeySchema=[
+            {
+                'AttributeName': 'BucketName',
+                'KeyType': 'HASH'  # Partition key
+            }
+        ],
+        AttributeDefinitions=[
+            {
+                'AttributeName': 'BucketName',
+                'AttributeType': 'S'
+            }
+        ],
+        ProvisionedThroughput={
+            'ReadCapacityUnits': 5,
+            'WriteCapacityUnits': 5
+        }
+    )
+
+    return table
+
+def get_active_game_table():
+    """
+    Get the active game table
+    :return:
+    """
+    dynamodb = boto3.resource('dynamodb', region_name='us-west-2')
+    test_table_name = 'sam-quest-active-game'
+
+    try:
+        table = dynamodb.Table(test_table_name)
+        print (table.creation_date_time)
+        return table
+    except botocore.exceptions.ClientError as e:
+        print('Table does not exist, creating table.')
+
+    table = dynamodb.create_table(
+        TableName= test_table_name,
+        KeySchema=[
+            {
+                'AttributeName': 'GameCreator',
+                'KeyType': 'HASH'  # Partition key
+            }
+        ],
+        AttributeDefinitions=[
+            {
+                'AttributeName': 'GameCreator',
+                'AttributeType': 'S'
+            }
+        ],
+        ProvisionedThroughput={
+            'ReadCapacityUnits': 5,
+            'WriteCapacityUnits': 5
+        }
+    )
+
+    return table
+
+def get_game_history_table():
+    """
+    Get the game history table
+    :return:
+    """
+    dynamodb = boto3.resource('dynamodb', region_name='us-west-2')
+    test_table_name = 'sam-quest-game-history'
+
+    try:
+        table = dynamodb.Table(test_table_name)
+        print (table.creation_date_time)
+        return table
+    except botocore.exceptions.ClientError as e:
+        print('Table does not exist, creating table.')
+
+    table = dynamodb.create_table(
+        TableName= test_table_name,
+        KeySchema=[
+            {
+                'AttributeName': 'TweetStartId',
+                'KeyType': 'HASH'  # Partition key
+            },
+            {
+                'AttributeName': 'StepNumber',
+                'KeyType': 'RANGE'  # Sort key
+            }
+        ],
+        AttributeDefinitions=[
+            {
+                'AttributeName': 'TweetStartId',
+                'AttributeType': 'N'
+            },
+            {
+                'AttributeName': 'StepNumber',
+                'AttributeType': 'N'
+            }
+        ],
+        ProvisionedThroughput={
+            'ReadCapacityUnits': 5,
+            'WriteCapacityUnits': 10
+        }
+    )
+
+    return table
+
+def get_tweet_index_table():
+    """
+    Get the tweet index table
+    :return:
+    """
+    dynamodb = boto3.resource('dynamodb', region_name='us-west-2')
+    test_table_name = 'sam-quest-tweet-index'
+
+    try:
+        table = dynamodb.Table(test_table_name)
+        print (table.creation_date_time)
+        return table
+    except botocore.exceptions.ClientError as e:
+        print('Table does not exist, creating table.')
+
+    table = dynamodb.create_table(
+        TableName= test_table_name,
+        KeySchema=[
+            {
+                'AttributeName': 'StatusId',
+                'KeyType': 'HASH'  # Partition key
+            }
+        ],
+        AttributeDefinitions=[
+            {
+                'AttributeName': 'StatusId',
+                'AttributeType': 'N'
+            }
+        ],
+        ProvisionedThroughput={
+            'ReadCapacityUnits': 10,
+            'WriteCapacityUnits': 10
+        }
+    )
+
+    return table
+
 class MockTwitterApi():
 
     def __init__(self):
         self.mentions = []
+        self.posts = []
+        self.post_ids = itertools.count(100)
 
     def SetMentions(self, mentions):
         self.mentions = mentions
 
-    def GetMentions(self, since_id):
-        return self.mentions
+    def GetMentions(self, count=None, since_id=None, max_id=None):
+        mentions = [post for post in self.mentions
+                    if (since_id is None or post.id > since_id) and (max_id is None or post.id <= max_id)]
+        mentions = sorted(mentions, key=lambda post: post.id, reverse=True)
+
+        return mentions[:count] if count else mentions
+
+    def GetUser(self, user_id):
+        return User.NewFromJsonDict({'id': user_id, 'screen_name': 'user_{}'.format(user_id)})
+
+    def UsersLookup(self, user_id):
+        return [self.GetUser(user_id=x) for x in user_id]
 
     def PostUpdate(self, status, in_reply_to_status_id=None):
         if len(status) > 140:
             raise ('Too many characters!')
 
-        return Status.NewFromJsonDict({'id': 100})
+        self.posts.append(status)
+
+        return Status.NewFromJsonDict({'id': next(self.post_ids)})
+
+
+def create_mention(status_id, user_id, hashtags, in_reply_to_status_id=None):
+    """
+    Create a twitter status mentioning the bot
+    :return:
+    """
+    return Status.NewFromJsonDict({
+        'id': status_id,
+        'text': '@SAMQuest9 ' + ' '.join(['#' + tag for tag in hashtags]),
+        'in_reply_to_status_id': in_reply_to_status_id,
+        'user': {'id': user_id, 'screen_name': 'user_{}'.format(user_id)},
+        'entities': {'hashtags': [{'text': tag} for tag in hashtags]}
+    })
@@ -0,0 +1,93 @@
+import unittest
+from src.tweet_dispatcher import SharedTokenBucket, TokenBucket, TweetDispatcher
+from test_resources import MockTwitterApi, get_status_update_table
+from moto import mock_dynamodb2
+
+
+class FakeClock():
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_waits_for_refill_when_empty(self):
+        clock = FakeClock()
+        bucket = TokenBucket(2, 0.5, clock=clock.time, sleep=clock.sleep)
+
+        self.assertEqual(0, bucket.acquire())
+        self.assertEqual(0, bucket.acquire())
+        self.assertAlmostEqual(2.0, bucket.acquire())
+
+    def test_gives_up_when_no_token_refills_before_the_deadline(self):
+        clock = FakeClock()
+        bucket = TokenBucket(1, 0.5, clock=clock.time, sleep=clock.sleep)
+
+        self.assertEqual(0, bucket.acquire(deadline=1))
+        self.assertIsNone(bucket.acquire(deadline=1))
+        self.assertEqual(0, clock.now)
+        self.assertAlmostEqual(2.0, bucket.acquire(deadline=2))
+
+
+@mock_dynamodb2
+class TestSharedTokenBucket(unittest.TestCase):
+
+    def test_processes_draw_from_the_same_budget(self):
+        clock = FakeClock()
+        table = get_status_update_table()
+        table.delete_item(Key={'BucketName': 'StatusUpdates'})
+
+        def bucket():
+            return SharedTokenBucket(table, capacity=2, refill_per_second=0.5, clock=clock.time, sleep=clock.sleep)
+
+        (first, second) = (bucket(), bucket())
+
+        self.assertEqual(0, first.acquire())
+        self.assertEqual(0, second.acquire())
+        self.assertIsNone(first.acquire(deadline=1))
+        self.assertAlmostEqual(2.0, second.acquire())
+
+        # A process that starts later does not get a full bucket
+        self.assertIsNone(bucket().acquire(deadline=clock.now + 1))
+
+
+class TestTweetDispatcher(unittest.TestCase):
+
+    def test_posts_resolve_to_statuses(self):
+        twitter_api = MockTwitterApi()
+        dispatcher = TweetDispatcher(twitter_api, bucket=TokenBucket(10, 1))
+
+        futures = [dispatcher.post('Hello {}'.format(i)) for i in range(5)]
+        dispatcher.shutdown()
+
+        self.assertEqual(set(range(100, 105)), set(future.result().id for future in futures))
+
+    def test_failed_posts_resolve_to_false(self):
+        dispatcher = TweetDispatcher(MockTwitterApi(), bucket=TokenBucket(10, 1))
+
+        self.assertFalse(dispatcher.post('x' * 141).result())
+        dispatcher.shutdown()
+
+    def test_posts_past_the_deadline_resolve_to_false(self):
+        clock = FakeClock()
+        twitter_api = MockTwitterApi()
+        dispatcher = TweetDispatcher(twitter_api, max_workers=1, deadline=60,
+                                     bucket=TokenBucket(1, 0.001, clock=clock.time, sleep=clock.sleep))
+
+        futures = [dispatcher.post('Hello {}'.format(i)) for i in range(2)]
+        dispatcher.shutdown()
+
+        self.assertEqual(100, futures[0].result().id)
+        self.assertFalse(futures[1].result())
+        self.assertEqual(1, len(twitter_api.posts))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+from twitter.error import TwitterError
+from src.user_cache import UserCache, UserResolver
+from test_resources import MockTwitterApi, create_mention
+
+
+class CountingTwitterApi(MockTwitterApi):
+
+    def __init__(self):
+        MockTwitterApi.__init__(self)
+        self.lookups = []
+
+    def UsersLookup(self, user_id):
+        self.lookups.append(list(user_id))
+        return MockTwitterApi.UsersLookup(self, user_id)
+
+
+class TestUserCache(unittest.TestCase):
+
+    def test_entries_expire(self):
+        now = [0]
+        cache = UserCache(ttl=10, clock=lambda: now[0])
+        cache.put(1, 'rory_jacob')
+
+        self.assertEqual('rory_jacob', cache.get(1))
+        now[0] = 10
+        self.assertIsNone(cache.get(1))
+
+    def test_least_recently_used_is_evicted(self):
+        cache = UserCache(max_size=2)
+        cache.put(1, 'one')
+        cache.put(2, 'two')
+        cache.get(1)
+        cache.put(3, 'three')
+
+        self.assertEqual('one', cache.get(1))
+        self.assertIsNone(cache.get(2))
+
+
+class TestUserResolver(unittest.TestCase):
+
+    def test_trimmed_users_are_looked_up_once(self):
+        twitter_api = CountingTwitterApi()
+        resolver = UserResolver(twitter_api, cache=UserCache())
+
+        embedded = create_mention(1, 1, ['LetsPlay'])
+        trimmed = [create_mention(status_id, 2, ['JoinGame']) for status_id in [2, 3]]
+        for post in trimmed:
+            post.user.screen_name = None
+
+        screen_names = resolver.resolve_all([embedded] + trimmed)
+        resolver.resolve_all(trimmed)
+
+        self.assertEqual({1: 'user_1', 2: 'user_2'}, screen_names)
+        self.assertEqual([[2]], twitter_api.lookups)
+        self.assertEqual(1, resolver.stats()['EmbeddedHits'])
+        self.assertEqual(2, resolver.stats()['CacheHits'])
+        self.assertEqual(2, resolver.stats()['CacheMisses'])
+
+    def test_failed_lookup_only_drops_its_users(self):
+        class FailingTwitterApi(MockTwitterApi):
+            def UsersLookup(self, user_id):
+                raise TwitterError('Over capacity')
+
+        resolver = UserResolver(FailingTwitterApi(), cache=UserCache())
+
+        embedded = create_mention(1, 1, ['LetsPlay'])
+        trimmed = create_mention(2, 2, ['JoinGame'])
+        trimmed.user.screen_name = None
+
+        self.assertEqual({1: 'user_1'}, resolver.resolve_all([embedded, trimmed]))
+        self.assertEqual(1, resolver.stats()['LookupFailures'])
+        self.assertFalse(resolver.is_unresolved(embedded))
+        self.assertTrue(resolver.is_unresolved(trimmed))
+
+    def test_mentions_without_a_user_are_skipped(self):
+        resolver = UserResolver(CountingTwitterApi(), cache=UserCache())
+
+        mention = create_mention(1, 1, ['LetsPlay'])
+        mention.user = None
+
+        self.assertEqual({}, resolver.resolve_all([mention]))
+        self.assertFalse(resolver.is_unresolved(mention))
+
+
+if __name__ == '__main__':
+    unittest.main()